@@ -1,3 +1,102 @@
+from functools import partial
+
 from django.contrib import admin
+from django.db import connections, transaction
+
+from organisations.admin import TenantAdminMixin
+from organisations.tenancy import tenant_database
+from weel.admin import EstimatedCountPaginator
+from .cache import invalidate_card_state
+from .expiry import deactivate_cards
+from .models import Card, CardControl
+
+# Rows changed per statement by the bulk actions
+ACTION_BATCH_SIZE = 1000
+
+
+class CardControlInline(admin.TabularInline):
+    model = CardControl
+    fields = ('control_type', 'merchant_category', 'merchant', 'amount')
+    autocomplete_fields = ('merchant_category', 'merchant')
+    extra = 0
+
+
+@admin.register(Card)
+class CardAdmin(TenantAdminMixin, admin.ModelAdmin):
+    list_display = ('card_number', 'cardholder_name', 'organisation', 'expiration_date', 'is_active')
+    list_select_related = ('organisation',)
+    list_filter = ('is_active', 'organisation')
+    # Exact matches only, so the search is a lookup on the unique card_number index
+    search_fields = ('card_number__exact',)
+    ordering = ('-id',)
+    readonly_fields = ('card_number', 'balance')
+    inlines = (CardControlInline,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('deactivate',)
+
+    def get_readonly_fields(self, request, obj=None):
+        # Chosen when the card is issued; its ledger and transactions stay with that organisation
+        readonly = super().get_readonly_fields(request, obj)
+        return readonly + ('organisation',) if obj is not None else readonly
+
+    def save_formset(self, request, form, formset, change):
+        # The admin acts for no organisation, so controls would otherwise go to the default one
+        for control in formset.save(commit=False):
+            control.organisation_id = form.instance.organisation_id
+            control.save()
+        for control in formset.deleted_objects:
+            control.delete()
+        formset.save_m2m()
+
+    @admin.action(description="Deactivate selected cards")
+    def deactivate(self, request, queryset):
+        result = deactivate_cards(queryset, batch_size=ACTION_BATCH_SIZE)
+        self.message_user(request, f"Deactivated {result.cards} cards.")
+
+
+@admin.register(CardControl)
+class CardControlAdmin(TenantAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'card', 'organisation', 'control_type', 'detail', 'amount')
+    list_select_related = ('card', 'organisation', 'merchant_category', 'merchant')
+    list_filter = ('control_type', 'organisation')
+    search_fields = ('card__card_number__exact',)
+    ordering = ('-id',)
+    raw_id_fields = ('card',)
+    autocomplete_fields = ('merchant_category', 'merchant')
+    # Always the card's organisation, see save_model
+    readonly_fields = ('organisation',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ('delete_controls',)
+
+    def save_model(self, request, obj, form, change):
+        # As for the inline controls, see CardAdmin.save_formset
+        obj.organisation_id = obj.card.organisation_id
+        super().save_model(request, obj, form, change)
+
+    def get_actions(self, request):
+        # Replaced by delete_controls, which does not load and delete the controls one by one
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description="Delete selected controls", permissions=['delete'])
+    def delete_controls(self, request, queryset):
+        from transactions.models import TransactionDecline
 
-# Register your models here.
+        using = tenant_database()
+        table = CardControl._meta.db_table
+        deleted = 0
+        controls = queryset.order_by().values_list('pk', 'card_id')
+        while rows := list(controls[:ACTION_BATCH_SIZE]):
+            ids = [control_id for control_id, _ in rows]
+            with transaction.atomic(using=using):
+                # What the declines' on_delete=SET_NULL and the cache signal handlers would do per control
+                TransactionDecline.objects.filter(control_id__in=ids).update(control=None)
+                with connections[using].cursor() as cursor:
+                    cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+                # Dropped once committed, so an authorization racing the DELETE cannot cache the old controls
+                transaction.on_commit(partial(invalidate_card_state, *{card_id for _, card_id in rows}, using=using), using=using)
+            deleted += len(ids)
+        self.message_user(request, f"Deleted {deleted} controls.")
@@ -0,0 +1,100 @@
+"""
+Read-through cache of the authorization-time view of a card.
+
+Authorizing a transaction needs a card's active flag, expiration date and
+compiled controls, all of which change rarely, so they are cached as a
+CardState under CARD_STATE_CACHE (the 'default' cache unless configured) and
+dropped by the signal handlers in cards.signals whenever a Card or CardControl
+is saved or deleted, both at once and when the writing transaction commits. The
+balance is deliberately not cached: it is always read and debited in the database.
+
+The default cache is a LocMemCache, which is private to each process: a change
+only drops the state cached by the process that made it, and every other worker
+process keeps authorizing against its copy for up to the cache TIMEOUT (300s).
+With more than one worker process, point CARD_STATE_CACHE at a shared cache
+such as Redis or Memcached.
+
+Card IDs are only unique within a database, so keys include the database alias,
+and a cached card is only returned to the organisation that owns it.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from organisations.tenancy import current_organisation, tenant_database
+from .controls import CompiledControls
+
+KEY_PREFIX = 'card-state'
+
+
+class CardState:
+    __slots__ = ('card_id', 'organisation_id', 'is_active', 'expiration_date', 'controls')
+
+    def __init__(self, card_id, organisation_id, is_active, expiration_date, controls):
+        self.card_id = card_id
+        self.organisation_id = organisation_id
+        self.is_active = is_active
+        self.expiration_date = expiration_date
+        self.controls = controls
+
+
+def _cache():
+    return caches[getattr(settings, 'CARD_STATE_CACHE', 'default')]
+
+
+def _key(card_id, database):
+    return f"{KEY_PREFIX}:{database}:{card_id}"
+
+
+def _load_states(card_ids):
+    from .models import Card, CardControl
+    states = {
+        row['id']: CardState(row['id'], row['organisation_id'], row['is_active'], row['expiration_date'], CompiledControls())
+        for row in Card.objects.filter(id__in=card_ids).values('id', 'organisation_id', 'is_active', 'expiration_date')
+    }
+    if states:
+        # The cards are already scoped to the organisation; their controls are theirs. The
+        # names are joined in for the ControlRefs that explain declines
+        controls = CardControl.objects.unscoped().filter(card_id__in=states.keys()).select_related('merchant_category', 'merchant')
+        for control in controls:
+            states[control.card_id].controls.add(control)
+    return states
+
+
+def get_card_states(card_ids):
+    """
+    Return {card_id: CardState} for the given cards, loading every uncached card
+    (and its controls) with one query each. Unknown card IDs, and cards of another
+    organisation than the current one, are left out.
+    """
+    card_ids = set(card_ids)
+    database = tenant_database()
+    cached = _cache().get_many([_key(card_id, database) for card_id in card_ids])
+    states = {state.card_id: state for state in cached.values()}
+    missing = card_ids - states.keys()
+    if missing:
+        loaded = _load_states(missing)
+        _cache().set_many({_key(card_id, database): state for card_id, state in loaded.items()})
+        states.update(loaded)
+    organisation = current_organisation()
+    if organisation is not None:
+        states = {card_id: state for card_id, state in states.items() if state.organisation_id == organisation.id}
+    return states
+
+
+def get_card_state(card_id):
+    """
+    Return the CardState for a card. Raises Card.DoesNotExist for an unknown card.
+    """
+    state = _cache().get(_key(card_id, tenant_database()))
+    if state is None:
+        state = get_card_states([card_id]).get(card_id)
+    organisation = current_organisation()
+    if state is None or (organisation is not None and state.organisation_id != organisation.id):
+        from .models import Card
+        raise Card.DoesNotExist("Card matching query does not exist.")
+    return state
+
+
+def invalidate_card_state(*card_ids, using=None):
+    database = using or tenant_database()
+    _cache().delete_many([_key(card_id, database) for card_id in card_ids])
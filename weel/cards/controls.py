@@ -0,0 +1,133 @@
+from decimal import Decimal, InvalidOperation
+
+from .declines import ControlRef, Decline, DeclineCode
+
+# Rolling limit control types and the (period, measure) of CardSpend they limit
+VELOCITY_CONTROLS = {
+    'daily_amount': ('day', 'amount'),
+    'monthly_amount': ('month', 'amount'),
+    'hourly_count': ('hour', 'count'),
+    'daily_count': ('day', 'count'),
+}
+
+# Control types whose `amount` is a sum of money
+AMOUNT_CONTROLS = ('max_amount', 'min_amount', 'daily_amount', 'monthly_amount')
+# The largest amount CardControl.amount holds (max_digits=10, decimal_places=2)
+MAX_CONTROL_AMOUNT = Decimal('99999999.99')
+
+
+class InvalidControl(ValueError):
+    pass
+
+
+def clean_control_amount(control_type, amount):
+    """
+    Check the `amount` of a new control of `control_type` and return it as a Decimal.
+
+    Amount controls need a positive amount in whole cents and the count limits a positive
+    whole number of transactions, each at most MAX_CONTROL_AMOUNT. Category and merchant
+    controls have no amount, so theirs is returned unchanged. Raises InvalidControl.
+    """
+    if control_type not in AMOUNT_CONTROLS and control_type not in VELOCITY_CONTROLS:
+        return amount
+    if amount is None:
+        raise InvalidControl(f"A {control_type} control needs an 'amount'")
+    try:
+        value = Decimal(str(amount))
+    except (TypeError, ValueError, InvalidOperation):
+        raise InvalidControl(f"Invalid amount '{amount}'")
+    step = Decimal('0.01') if control_type in AMOUNT_CONTROLS else Decimal(1)
+    if not value.is_finite() or not 0 < value <= MAX_CONTROL_AMOUNT or value != value.quantize(step):
+        raise InvalidControl(f"Invalid amount '{amount}' for a {control_type} control")
+    return value.quantize(Decimal('0.01'))
+
+
+class CompiledControls:
+    """
+    A card's CardControl rows folded into a single evaluator.
+
+    Category and merchant controls become sets of allowed MerchantCategory and
+    Merchant IDs and the amount controls are folded into one [min_amount,
+    max_amount] window, so evaluating a transaction is a couple of integer set
+    lookups and comparisons no matter how many controls the card has. Rolling limits are folded into the tightest limit per
+    (period, measure) and checked against the card's spend counters.
+
+    `sources` keeps a ControlRef for each control behind a folded value (every
+    category or merchant control, the tightest amount control and limit), so
+    declines can point at the controls that caused them.
+    """
+    __slots__ = ('categories', 'merchants', 'min_amount', 'max_amount', 'limits', 'sources')
+
+    def __init__(self, controls=()):
+        self.categories = set()
+        self.merchants = set()
+        self.min_amount = None
+        self.max_amount = None
+        self.limits = {}
+        self.sources = {}
+        for control in controls:
+            self.add(control)
+
+    def add(self, control):
+        ref = ControlRef.of(control)
+        if control.control_type == 'category':
+            self.categories.add(control.merchant_category_id)
+            self.sources['category'] = self.sources.get('category', ()) + (ref,)
+        elif control.control_type == 'merchant':
+            self.merchants.add(control.merchant_id)
+            self.sources['merchant'] = self.sources.get('merchant', ()) + (ref,)
+        elif control.control_type == 'max_amount':
+            if self.max_amount is None or control.amount < self.max_amount:
+                self.max_amount = control.amount
+                self.sources['max_amount'] = (ref,)
+        elif control.control_type == 'min_amount':
+            if self.min_amount is None or control.amount > self.min_amount:
+                self.min_amount = control.amount
+                self.sources['min_amount'] = (ref,)
+        elif control.control_type in VELOCITY_CONTROLS:
+            key = VELOCITY_CONTROLS[control.control_type]
+            limit = control.amount if key[1] == 'amount' else int(control.amount)
+            if key not in self.limits or limit < self.limits[key]:
+                self.limits[key] = limit
+                self.sources[key] = (ref,)
+
+    @property
+    def velocity_limits(self):
+        """
+        The rolling limits as (period, measure, limit) tuples, for cards.velocity.record_spend.
+        """
+        return [(period, measure, limit) for (period, measure), limit in self.limits.items()]
+
+    def evaluate(self, amount, merchant_id, merchant_category_id):
+        """
+        Return the list of Declines for a transaction, empty if every control passes.
+
+        `amount` must already be a Decimal, and the merchant and its category are given by
+        their interned IDs (see merchants.interning).
+        """
+        failures = []
+        if self.categories and merchant_category_id not in self.categories:
+            failures.append(Decline(DeclineCode.CATEGORY_NOT_ALLOWED, self.sources['category']))
+        if self.merchants and merchant_id not in self.merchants:
+            failures.append(Decline(DeclineCode.MERCHANT_NOT_ALLOWED, self.sources['merchant']))
+        if self.max_amount is not None and amount > self.max_amount:
+            failures.append(Decline(DeclineCode.ABOVE_MAXIMUM_AMOUNT, self.sources['max_amount']))
+        if self.min_amount is not None and amount < self.min_amount:
+            failures.append(Decline(DeclineCode.BELOW_MINIMUM_AMOUNT, self.sources['min_amount']))
+        return failures
+
+    def evaluate_velocity(self, amount, usage, count=1):
+        """
+        Return Declines for the rolling limits a transaction would break, given the
+        card's current `usage` from cards.velocity.get_usage.
+        """
+        failures = []
+        for key, limit in self.limits.items():
+            period, measure = key
+            spent, transactions = usage[period]
+            if measure == 'amount' and spent + amount > limit:
+                failures.append(Decline(DeclineCode.SPEND_LIMIT_EXCEEDED, self.sources[key]))
+            elif measure == 'count' and transactions + count > limit:
+                failures.append(Decline(DeclineCode.TRANSACTION_LIMIT_REACHED, self.sources[key]))
+        return failures
+
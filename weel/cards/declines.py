@@ -0,0 +1,90 @@
+"""
+Decline reasons as codes.
+
+Authorization produces a list of Decline values: a DeclineCode plus the card
+controls that caused it, if any. Only the code and the control IDs are stored
+(see transactions.models.TransactionDecline); the human-readable message is
+rendered by describe() when a transaction is read, from the code, the
+transaction's own fields and the referenced controls.
+"""
+from typing import NamedTuple
+
+from django.db import models
+
+
+class DeclineCode(models.IntegerChoices):
+    OTHER = 0, "Declined"
+    INSUFFICIENT_FUNDS = 1, "Insufficient funds"
+    CARD_INACTIVE = 2, "Card is not active"
+    CATEGORY_NOT_ALLOWED = 3, "Category not allowed"
+    MERCHANT_NOT_ALLOWED = 4, "Merchant not allowed"
+    ABOVE_MAXIMUM_AMOUNT = 5, "Above maximum amount"
+    BELOW_MINIMUM_AMOUNT = 6, "Below minimum amount"
+    SPEND_LIMIT_EXCEEDED = 7, "Spend limit exceeded"
+    TRANSACTION_LIMIT_REACHED = 8, "Transaction limit reached"
+    CARD_EXPIRED = 9, "Card has expired"
+
+
+class ControlRef(NamedTuple):
+    """
+    The parts of a CardControl needed to explain a decline.
+    """
+    id: int
+    control_type: str
+    detail: str
+    amount: object
+
+    @classmethod
+    def of(cls, control):
+        return cls(control.id, control.control_type, control.detail, control.amount)
+
+
+class Decline(NamedTuple):
+    code: int
+    controls: tuple = ()
+
+
+def describe(decline, amount, merchant, merchant_category):
+    """
+    Render the message for a Decline of a transaction for `amount` at `merchant`.
+
+    Controls deleted since the transaction was declined are no longer referenced,
+    so each message has a generic form for when the decline has no controls.
+    """
+    code, controls = decline
+    limit = controls[0].amount if controls else None
+    # Rolling limit control types are named '<period>_<measure>', e.g. 'daily_amount'
+    period = controls[0].control_type.split('_')[0] if controls else None
+    if code == DeclineCode.CATEGORY_NOT_ALLOWED:
+        if controls:
+            return f"Transaction category '{merchant_category}' does not match required category '{_join(c.detail for c in controls)}'."
+        return f"Transaction category '{merchant_category}' is not allowed on this card."
+    if code == DeclineCode.MERCHANT_NOT_ALLOWED:
+        if controls:
+            return f"Transaction merchant '{merchant}' does not match required merchant '{_join(c.detail for c in controls)}'."
+        return f"Transaction merchant '{merchant}' is not allowed on this card."
+    if code == DeclineCode.ABOVE_MAXIMUM_AMOUNT:
+        if controls:
+            return f"Transaction amount '{amount}' exceeds the maximum allowed amount of '{limit}'."
+        return f"Transaction amount '{amount}' exceeds the maximum allowed amount."
+    if code == DeclineCode.BELOW_MINIMUM_AMOUNT:
+        if controls:
+            return f"Transaction amount '{amount}' is less than the minimum required amount of '{limit}'."
+        return f"Transaction amount '{amount}' is less than the minimum required amount."
+    if code == DeclineCode.SPEND_LIMIT_EXCEEDED:
+        if controls:
+            return f"Transaction amount '{amount}' would exceed the {period} spend limit of '{limit}'."
+        return f"Transaction amount '{amount}' would exceed a spend limit."
+    if code == DeclineCode.TRANSACTION_LIMIT_REACHED:
+        if controls:
+            return f"Card has reached its {period} limit of {int(limit)} transactions."
+        return "Card has reached a transaction limit."
+    return DeclineCode(code).label
+
+
+def describe_all(declines, amount, merchant, merchant_category):
+    return [describe(decline, amount, merchant, merchant_category) for decline in declines]
+
+
+def _join(values):
+    return "' or '".join(sorted(str(value) for value in values))
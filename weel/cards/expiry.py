@@ -0,0 +1,65 @@
+"""
+Card expiry.
+
+A card is valid through its expiration date. Authorization declines expired
+cards from the cached card state whether or not they have been deactivated yet,
+and expire_cards deactivates them in bulk, so that the card list and the ledger
+debit, which check is_active, agree.
+
+expire_cards finds the expired cards through card_active_expiry_idx, a partial
+index holding only active cards, and deactivates them with one short UPDATE per
+batch. Deactivated cards leave the index, so each batch is a seek to the start
+of the index rather than a scan, and no batch holds locks for longer than its
+own UPDATE.
+"""
+import time
+from dataclasses import dataclass
+from functools import partial
+
+from django.db import transaction
+from django.utils import timezone
+
+from organisations.tenancy import tenant_database
+from .cache import invalidate_card_state
+from .models import Card
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass
+class ExpiryResult:
+    cards: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+
+def is_expired(expiration_date, today=None):
+    return expiration_date < (today or timezone.localdate())
+
+
+def deactivate_cards(cards, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deactivate the active cards of the Card queryset `cards`, `batch_size` cards per
+    UPDATE. Returns an ExpiryResult.
+    """
+    started = time.perf_counter()
+    using = tenant_database()
+    result = ExpiryResult()
+    active = cards.filter(is_active=True).order_by()
+    while ids := list(active.values_list('pk', flat=True)[:batch_size]):
+        with transaction.atomic(using=using):
+            # update() skips the signals that drop the cached states of saved cards
+            result.cards += Card.objects.filter(pk__in=ids, is_active=True).update(is_active=False)
+            # Dropped once committed, so an authorization racing the UPDATE cannot cache the old state
+            transaction.on_commit(partial(invalidate_card_state, *ids, using=using), using=using)
+        result.batches += 1
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def expire_cards(batch_size=DEFAULT_BATCH_SIZE, today=None):
+    """
+    Deactivate the current organisation's active cards that expired before `today`
+    (default: the current date), `batch_size` cards per UPDATE. Returns an ExpiryResult.
+    """
+    return deactivate_cards(Card.objects.filter(expiration_date__lt=today or timezone.localdate()), batch_size)
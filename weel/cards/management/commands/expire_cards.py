@@ -0,0 +1,29 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cards.expiry import DEFAULT_BATCH_SIZE, expire_cards
+from organisations.models import Organisation
+from organisations.tenancy import get_organisation, use_organisation
+
+
+class Command(BaseCommand):
+    help = "Deactivate cards past their expiration date. Run it nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', help="Slug of the organisation to expire cards of; every card in the default database if omitted.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Cards deactivated per UPDATE.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            organisation = get_organisation(options['organisation']) if options['organisation'] else None
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+
+        with use_organisation(organisation) if organisation else nullcontext():
+            result = expire_cards(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deactivated {result.cards} expired cards in {result.batches} batches in {result.seconds:.3f}s"
+        ))
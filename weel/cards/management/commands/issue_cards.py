@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cards.issuance import DEFAULT_CHUNK_SIZE, issue_cards, read_csv, read_ndjson
+from organisations.models import DEFAULT_ORGANISATION_SLUG, Organisation
+from organisations.tenancy import get_organisation, use_organisation
+
+
+class Command(BaseCommand):
+    help = "Issue cards in bulk from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or NDJSON file of cards.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="File format; guessed from the file extension if omitted.")
+        parser.add_argument('--organisation', default=DEFAULT_ORGANISATION_SLUG, help="Slug of the organisation to issue the cards for.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="Cards inserted per database transaction.")
+        parser.add_argument(
+            '--control', action='append', default=[], dest='controls', metavar='JSON',
+            help='Control template attached to every card, e.g. \'{"control_type": "max_amount", "amount": 100}\'. May be repeated.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive")
+        try:
+            organisation = get_organisation(options['organisation'])
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+        try:
+            controls = [json.loads(control) for control in options['controls']]
+            with open(path, newline='') as f:
+                rows = read_csv(f) if file_format == 'csv' else read_ndjson(f)
+            with use_organisation(organisation):
+                result = issue_cards(rows, controls, chunk_size=options['chunk_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        stats = result.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Issued {stats['count']} cards and {stats['controls']} controls in {stats['seconds']}s "
+            f"({stats['cards_per_second']} cards/s)"
+        ))
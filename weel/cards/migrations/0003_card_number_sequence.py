@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:29
+
+from django.db import migrations, models
+
+
+def create_card_number_sequence(apps, schema_editor):
+    CardNumberSequence = apps.get_model('cards', 'CardNumberSequence')
+    CardNumberSequence.objects.get_or_create(name='card_number')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0002_alter_card_card_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_card_number_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0003_card_number_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cardcontrol',
+            index=models.Index(fields=['card', 'control_type'], name='card_control_type_idx'),
+        ),
+        # Drop the plain FK index only once the composite index leading with card exists
+        migrations.AlterField(
+            model_name='cardcontrol',
+            name='card',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='controls', to='cards.card'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0004_authorization_and_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardSpend',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='spend', serialize=False, to='cards.card')),
+                ('hour_start', models.DateTimeField(null=True)),
+                ('hour_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('hour_count', models.PositiveIntegerField(default=0)),
+                ('day_start', models.DateTimeField(null=True)),
+                ('day_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('day_count', models.PositiveIntegerField(default=0)),
+                ('month_start', models.DateTimeField(null=True)),
+                ('month_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('month_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='cardcontrol',
+            name='control_type',
+            field=models.CharField(choices=[('category', 'Category'), ('merchant', 'Merchant'), ('max_amount', 'Maximum Amount'), ('min_amount', 'Minimum Amount'), ('daily_amount', 'Daily Spend Limit'), ('monthly_amount', 'Monthly Spend Limit'), ('hourly_count', 'Hourly Transaction Limit'), ('daily_count', 'Daily Transaction Limit')], max_length=20),
+        ),
+    ]
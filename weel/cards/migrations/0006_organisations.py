@@ -0,0 +1,34 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:44
+
+import django.db.models.deletion
+import organisations.tenancy
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0005_card_spend'),
+        ('organisations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='organisation',
+            field=models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='cards', to='organisations.organisation'),
+        ),
+        migrations.AddField(
+            model_name='cardcontrol',
+            name='organisation',
+            field=models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='card_controls', to='organisations.organisation'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['organisation', 'id'], name='card_organisation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cardcontrol',
+            index=models.Index(fields=['organisation', 'id'], name='card_control_organisation_idx'),
+        ),
+    ]
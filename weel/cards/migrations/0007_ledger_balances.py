@@ -0,0 +1,19 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:56
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0006_organisations'),
+        # Balances are carried over to the ledger before the column goes
+        ('ledger', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='card',
+            name='balance',
+        ),
+    ]
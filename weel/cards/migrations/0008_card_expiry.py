@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0007_ledger_balances'),
+        ('organisations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expiration_date'], name='card_active_expiry_idx'),
+        ),
+    ]
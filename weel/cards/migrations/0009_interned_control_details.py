@@ -0,0 +1,57 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from merchants.interning import intern_legacy
+
+# The control types whose detail names a category or merchant, and where it is interned
+DETAILS = {'category': ('MerchantCategory', 'merchant_category'), 'merchant': ('Merchant', 'merchant')}
+
+
+def intern_details(apps, schema_editor):
+    CardControl = apps.get_model('cards', 'CardControl')
+    db = schema_editor.connection.alias
+    for control_type, (model_name, field) in DETAILS.items():
+        controls = CardControl.objects.using(db).filter(control_type=control_type).exclude(detail__isnull=True).exclude(detail='')
+        names = list(controls.order_by().values_list('detail', flat=True).distinct())
+        for name, interned in intern_legacy(apps.get_model('merchants', model_name), names, db).items():
+            controls.filter(detail=name).update(**{f'{field}_id': interned})
+
+
+def restore_details(apps, schema_editor):
+    CardControl = apps.get_model('cards', 'CardControl')
+    db = schema_editor.connection.alias
+    for control_type, (model_name, field) in DETAILS.items():
+        controls = CardControl.objects.using(db).filter(control_type=control_type)
+        names = apps.get_model('merchants', model_name).objects.using(db).filter(
+            id__in=controls.order_by().values(f'{field}_id').distinct(),
+        ).values_list('id', 'name')
+        for interned, name in names:
+            controls.filter(**{f'{field}_id': interned}).update(detail=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0008_card_expiry'),
+        ('merchants', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardcontrol',
+            name='merchant_category',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchantcategory'),
+        ),
+        migrations.AddField(
+            model_name='cardcontrol',
+            name='merchant',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchant'),
+        ),
+        migrations.RunPython(intern_details, restore_details),
+        migrations.RemoveField(
+            model_name='cardcontrol',
+            name='detail',
+        ),
+    ]
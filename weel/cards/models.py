@@ -1,25 +1,130 @@
-from decimal import Decimal
-from django.db import models
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.db import models, router, transaction
+from merchants.interning import categories, merchants
+from merchants.models import Merchant, MerchantCategory
+from organisations.managers import TenantManager
+from organisations.models import Organisation
+from organisations.tenancy import current_organisation_id
+from .numbers import allocate_card_number
+
+
+def organisation_field(related_name):
+    # Tenant rows may live in another database than the organisations, so no database constraint;
+    # the organisation-leading indexes in each model's Meta cover lookups by organisation
+    return models.ForeignKey(
+        Organisation, on_delete=models.PROTECT, related_name=related_name,
+        default=current_organisation_id, db_constraint=False, db_index=False,
+    )
+
 
 class Card(models.Model):
-    counter = 1111111111111111
+    organisation = organisation_field('cards')
     card_number = models.CharField(max_length=16, unique=True, null=True, blank=True)  # Remove default value
     cardholder_name = models.CharField(max_length=100)
     expiration_date = models.DateField()
     is_active = models.BooleanField(default=True)
-    balance = models.DecimalField(max_digits=10, decimal_places=2)
+
+    objects = TenantManager()
+
+    # Balance set on this instance and posted to the ledger by the next save()
+    _new_balance = None
+
+    class Meta:
+        indexes = [
+            # An organisation's cards in ID order, for the card list
+            models.Index(fields=['organisation', 'id'], name='card_organisation_idx'),
+            # Active cards by expiry, for expire_cards; deactivated cards drop out of it
+            models.Index(fields=['expiration_date'], condition=models.Q(is_active=True), name='card_active_expiry_idx'),
+        ]
+
+    @property
+    def balance(self):
+        """
+        The card's balance, derived from its ledger entries (see ledger.balances).
+
+        Setting it records the new balance on this instance; save() then posts the opening
+        balance of a new card, or an adjustment for the difference on an existing one.
+        """
+        if self._new_balance is not None or self.pk is None:
+            return self._new_balance if self._new_balance is not None else Decimal('0.00')
+        from ledger.balances import get_balance
+        return get_balance(self.pk)
+
+    @balance.setter
+    def balance(self, value):
+        try:
+            self._new_balance = Decimal(str(value)).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise ValidationError({'balance': [f"'{value}' value must be a decimal number."]})
 
     def save(self, *args, **kwargs):
         # Generate a card number
         if not self.card_number:
-            self.card_number = str(Card.counter)
-            Card.counter += 1
-        super().save(*args, **kwargs)
+            self.card_number = allocate_card_number()
+        if self._new_balance is None:
+            return super().save(*args, **kwargs)
+
+        from ledger.balances import get_balance, post
+        from ledger.models import EntryKind
+        adding = self._state.adding
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Card, instance=self)):
+            current = Decimal('0.00') if adding else get_balance(self.pk)
+            super().save(*args, **kwargs)
+            if self._new_balance != current:
+                kind = EntryKind.OPENING if adding else EntryKind.ADJUSTMENT
+                post(self.pk, kind, self._new_balance - current, organisation_id=self.organisation_id)
+        self._new_balance = None
+
+    def debit(self, amount):
+        """
+        Take `amount` off the card's balance by appending a ledger entry.
+
+        The balance check and the append happen in a single guarded INSERT (balance >= amount
+        AND is_active), so concurrent debits can never overdraw the card or lose each other's
+        entries. Returns True if the card was debited. Raises ValueError unless `amount` is positive.
+        """
+        from ledger.balances import debit
+        return debit(self.pk, amount, organisation_id=self.organisation_id)
 
     def __str__(self):
         return f"{self.cardholder_name} {self.card_number}"
 
 
+class CardNumberSequence(models.Model):
+    """
+    High-water mark for a card number sequence; see cards.numbers.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} at {self.next_value}"
+
+
+class CardSpend(models.Model):
+    """
+    Rolling spend counters for a card's current hour, day and month; see cards.velocity.
+
+    Each period keeps the start of the bucket it is counting and the approved amount and
+    transaction count in it. A counter whose start is not the current bucket is stale and
+    reads as zero; the next approval resets it.
+    """
+    card = models.OneToOneField(Card, on_delete=models.CASCADE, primary_key=True, related_name='spend')
+    hour_start = models.DateTimeField(null=True)
+    hour_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    hour_count = models.PositiveIntegerField(default=0)
+    day_start = models.DateTimeField(null=True)
+    day_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    day_count = models.PositiveIntegerField(default=0)
+    month_start = models.DateTimeField(null=True)
+    month_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    month_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Spend for card {self.card_id}"
+
+
 # Card Controls
 class CardControl(models.Model):
     CONTROL_TYPES = (
@@ -27,21 +132,57 @@ class CardControl(models.Model):
         ('merchant', 'Merchant'),
         ('max_amount', 'Maximum Amount'),
         ('min_amount', 'Minimum Amount'),
+        # Rolling limits, checked against CardSpend; the count limits keep the number of transactions in `amount`
+        ('daily_amount', 'Daily Spend Limit'),
+        ('monthly_amount', 'Monthly Spend Limit'),
+        ('hourly_count', 'Hourly Transaction Limit'),
+        ('daily_count', 'Daily Transaction Limit'),
     )
 
-    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='controls')
+    organisation = organisation_field('card_controls')
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='controls', db_index=False)  # Covered by card_control_type_idx
     control_type = models.CharField(max_length=20, choices=CONTROL_TYPES)
-    detail = models.CharField(max_length=100, blank=True, null=True)  # For category or merchant name
+    # The category or merchant a category or merchant control allows, set through `detail`
+    merchant_category = models.ForeignKey(MerchantCategory, on_delete=models.PROTECT, null=True, blank=True, related_name='+', db_index=False)
+    merchant = models.ForeignKey(Merchant, on_delete=models.PROTECT, null=True, blank=True, related_name='+', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)  # For amount controls
 
+    objects = TenantManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['card', 'control_type'], name='card_control_type_idx'),
+            # An organisation's controls in ID order, for the control list
+            models.Index(fields=['organisation', 'id'], name='card_control_organisation_idx'),
+        ]
+
+    @property
+    def detail(self):
+        """
+        The name of the category or merchant a category or merchant control allows.
+
+        Setting it interns the name as a MerchantCategory or Merchant, by control_type (see
+        merchants.interning), so control_type must be set first. Raises InvalidName.
+        """
+        if self.control_type == 'category' and self.merchant_category_id is not None:
+            return self.merchant_category.name
+        if self.control_type == 'merchant' and self.merchant_id is not None:
+            return self.merchant.name
+        return None
+
+    @detail.setter
+    def detail(self, value):
+        self.merchant_category_id = categories.intern(value) if value and self.control_type == 'category' else None
+        self.merchant_id = merchants.intern(value) if value and self.control_type == 'merchant' else None
+
     def apply_control(self, transaction):
         if self.control_type == 'category':
-            if transaction['merchant_category'] == self.detail:
+            if categories.lookup(transaction['merchant_category']) == self.merchant_category_id:
                 return True, ""
             else:
                 return False, f"Transaction category '{transaction['merchant_category']}' does not match required category '{self.detail}'."
         elif self.control_type == 'merchant':
-            if transaction['merchant'] == self.detail:
+            if merchants.lookup(transaction['merchant']) == self.merchant_id:
                 return True, ""
             else:
                 return False, f"Transaction merchant '{transaction['merchant']}' does not match required merchant '{self.detail}'."
@@ -0,0 +1,105 @@
+"""
+Card number allocation.
+
+Numbers come from a hi-lo scheme: each process reserves a block of sequence
+values from the CardNumberSequence table with one atomic UPDATE and then hands
+them out from memory, so allocation is usually a lock-protected increment and
+two processes can never be given the same value. Every sequence value is
+turned into a 16 digit number made of CARD_NUMBER_PREFIX, the zero-padded
+value and a Luhn check digit.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+DEFAULT_PREFIX = '400000'
+DEFAULT_BLOCK_SIZE = 100
+CARD_NUMBER_LENGTH = 16
+
+
+def luhn_check_digit(digits):
+    """
+    Return the Luhn check digit for a string of digits.
+    """
+    total = 0
+    for i, digit in enumerate(reversed(digits)):
+        value = int(digit)
+        if i % 2 == 0:
+            value *= 2
+            if value > 9:
+                value -= 9
+        total += value
+    return str((10 - total % 10) % 10)
+
+
+def is_luhn_valid(number):
+    return len(number) > 1 and number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def format_card_number(prefix, value):
+    body = prefix + str(value).zfill(CARD_NUMBER_LENGTH - 1 - len(prefix))
+    if len(body) != CARD_NUMBER_LENGTH - 1:
+        raise OverflowError(f"Card number sequence exhausted for prefix '{prefix}'")
+    return body + luhn_check_digit(body)
+
+
+class CardNumberAllocator:
+    """
+    Hands out card numbers from blocks reserved in the CardNumberSequence table.
+
+    Blocks are reserved in their own atomic block; reserve them outside of any
+    enclosing transaction that may roll back, otherwise the rolled back block
+    can be reserved again by another process.
+    """
+
+    def __init__(self, sequence='card_number', prefix=None, block_size=None):
+        self.sequence = sequence
+        self.prefix = prefix or getattr(settings, 'CARD_NUMBER_PREFIX', DEFAULT_PREFIX)
+        self.block_size = block_size or getattr(settings, 'CARD_NUMBER_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._end = 0
+
+    def _reserve(self, size):
+        from .models import CardNumberSequence
+        with transaction.atomic():
+            sequence = CardNumberSequence.objects.filter(name=self.sequence)
+            if not sequence.update(next_value=F('next_value') + size):
+                raise LookupError(f"Card number sequence '{self.sequence}' does not exist")
+            end = sequence.values_list('next_value', flat=True).get()
+        return end - size, end
+
+    def allocate(self, count=1):
+        """
+        Return a list of `count` unused card numbers.
+
+        Requests larger than the block size are reserved as one dedicated block.
+        """
+        with self._lock:
+            # A forked worker must not keep handing out its parent's block
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+
+            values = []
+            if self._end - self._next < count and count > self.block_size:
+                start, end = self._reserve(count)
+                values = range(start, end)
+            else:
+                while len(values) < count:
+                    if self._next >= self._end:
+                        self._next, self._end = self._reserve(self.block_size)
+                    take = min(count - len(values), self._end - self._next)
+                    values = [*values, *range(self._next, self._next + take)]
+                    self._next += take
+        return [format_card_number(self.prefix, value) for value in values]
+
+
+allocator = CardNumberAllocator()
+
+
+def allocate_card_number():
+    return allocator.allocate(1)[0]
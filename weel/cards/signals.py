@@ -0,0 +1,25 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_card_state
+from .models import Card, CardControl
+
+
+def _invalidate(card_id, using):
+    # Dropped now and again once the write commits: until then another connection still
+    # reads the old row and may put it back in the cache
+    invalidate_card_state(card_id, using=using)
+    transaction.on_commit(partial(invalidate_card_state, card_id, using=using), using=using)
+
+
+@receiver([post_save, post_delete], sender=Card)
+def card_changed(sender, instance, using, **kwargs):
+    _invalidate(instance.pk, using)
+
+
+@receiver([post_save, post_delete], sender=CardControl)
+def card_control_changed(sender, instance, using, **kwargs):
+    _invalidate(instance.card_id, using)
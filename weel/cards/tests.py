@@ -1,7 +1,28 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from io import StringIO
+from tempfile import NamedTemporaryFile
+from unittest import mock, skipUnless
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
 from django.urls import reverse
+from merchants.interning import categories, merchants
+from organisations.models import Organisation
+from organisations.tenancy import use_organisation
+from weel.pagination import encode_cursor
 from .models import Card, CardControl
-from datetime import date
+from . import cache
+from .cache import get_card_state
+from .controls import CompiledControls
+from .declines import DeclineCode
+from .expiry import expire_cards
+from .numbers import CardNumberAllocator, is_luhn_valid
+from .velocity import get_usage, record_spend
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
 import json
 
 class CardTests(TestCase):
@@ -89,8 +110,481 @@ class CardControlTests(TestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(CardControl.objects.count(), 3)
 
+    def test_invalid_control_amounts_are_rejected(self):
+        for control_type, amount in [
+            ('max_amount', None), ('min_amount', -5), ('daily_amount', "NaN"), ('monthly_amount', "1.001"),
+            ('max_amount', "100000000.00"), ('hourly_count', 0), ('daily_count', 2.5), ('daily_count', "abc"),
+        ]:
+            data = {"card_id": self.card.id, "control_type": control_type, "amount": amount}
+            response = self.client.post(reverse('card-controls'), json.dumps(data), content_type="application/json")
+            self.assertEqual(response.status_code, 400, (control_type, amount))
+        self.assertEqual(CardControl.objects.count(), 2)
+
+    def test_count_control_amount_is_a_whole_number(self):
+        data = {"card_id": self.card.id, "control_type": "daily_count", "amount": "5"}
+        response = self.client.post(reverse('card-controls'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CardControl.objects.get(pk=response.json()['control_id']).amount, Decimal('5.00'))
+
     def test_delete_card_control(self):
         control_id = self.category_control.id
         response = self.client.delete(reverse('delete-card-control', args=[control_id]))
         self.assertEqual(response.status_code, 204)
         self.assertEqual(CardControl.objects.count(), 1)
+
+
+class CompiledControlsTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(
+            cardholder_name='Test User',
+            expiration_date=date(2025, 1, 1),
+            balance=200.00
+        )
+
+    def test_amount_controls_fold_into_one_window(self):
+        for control_type, amount in [('max_amount', 100), ('max_amount', 50), ('min_amount', 5), ('min_amount', 10)]:
+            CardControl.objects.create(card=self.card, control_type=control_type, amount=amount)
+        compiled = get_card_state(self.card.id).controls
+        self.assertEqual(compiled.max_amount, Decimal('50'))
+        self.assertEqual(compiled.min_amount, Decimal('10'))
+        walmart, grocery = merchants.intern('Walmart'), categories.intern('5411')
+        self.assertEqual(compiled.evaluate(Decimal('20.00'), walmart, grocery), [])
+        self.assertEqual(len(compiled.evaluate(Decimal('60.00'), walmart, grocery)), 1)
+        self.assertEqual(len(compiled.evaluate(Decimal('5.00'), walmart, grocery)), 1)
+
+    def test_merchants_and_categories_are_allowed_sets(self):
+        CardControl.objects.create(card=self.card, control_type='merchant', detail='Walmart')
+        CardControl.objects.create(card=self.card, control_type='merchant', detail='Target')
+        CardControl.objects.create(card=self.card, control_type='category', detail='5411')
+        compiled = get_card_state(self.card.id).controls
+        # Names match whatever their case, spacing or punctuation
+        self.assertEqual(compiled.evaluate(Decimal('1.00'), merchants.intern(' TARGET.'), categories.intern('5411')), [])
+        self.assertEqual(len(compiled.evaluate(Decimal('1.00'), merchants.intern('Amazon'), categories.intern('1234'))), 2)
+
+    def test_no_controls_passes_everything(self):
+        self.assertEqual(CompiledControls().evaluate(Decimal('1.00'), merchants.intern('Amazon'), categories.intern('1234')), [])
+
+    def test_cache_invalidated_by_create_and_delete_views(self):
+        self.assertIsNone(get_card_state(self.card.id).controls.max_amount)
+        data = {"card_id": self.card.id, "control_type": "max_amount", "amount": 50.00}
+        response = self.client.post(reverse('card-controls'), json.dumps(data), content_type="application/json")
+        self.assertEqual(get_card_state(self.card.id).controls.max_amount, Decimal('50'))
+        self.client.delete(reverse('delete-card-control', args=[response.json()['control_id']]))
+        self.assertIsNone(get_card_state(self.card.id).controls.max_amount)
+
+
+class CardDebitTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(
+            cardholder_name='Test User',
+            expiration_date=date(2025, 1, 1),
+            balance=100.00
+        )
+
+    def test_debit_reduces_balance(self):
+        self.assertTrue(self.card.debit(Decimal('40.00')))
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('60.00'))
+
+    def test_debit_refuses_to_overdraw(self):
+        self.assertFalse(self.card.debit(Decimal('100.01')))
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('100.00'))
+
+    def test_debit_refuses_inactive_card(self):
+        Card.objects.filter(pk=self.card.pk).update(is_active=False)
+        self.assertFalse(self.card.debit(Decimal('1.00')))
+
+
+class CardDebitConcurrencyTests(TransactionTestCase):
+    debits = 2000
+    workers = 16
+
+    def test_parallel_debits_never_lose_updates_or_overdraw(self):
+        # Enough balance for exactly half of the debits to succeed
+        card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2025, 1, 1), balance=self.debits // 2)
+
+        def debit(_):
+            try:
+                return Card(pk=card.pk).debit(Decimal('1.00'))
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(debit, range(self.debits)))
+
+        card.refresh_from_db()
+        self.assertEqual(results.count(True), self.debits // 2)
+        self.assertEqual(card.balance, Decimal('0.00'))
+
+
+class CardStateInvalidationTests(TestCase):
+    def setUp(self):
+        # Names interned by committed callbacks outlive the rolled back rows
+        self.addCleanup(merchants.clear)
+        self.addCleanup(categories.clear)
+
+    def test_state_cached_before_the_commit_is_dropped_after_it(self):
+        card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2030, 1, 1), balance=10)
+        stale = get_card_state(card.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            card.is_active = False
+            card.save()
+            CardControl.objects.create(card=card, control_type='merchant', detail='Coles')
+            # What an authorization on another connection reading the committed rows would cache
+            cache._cache().set(cache._key(card.pk, 'default'), stale)
+            self.assertTrue(get_card_state(card.pk).is_active)
+        state = get_card_state(card.pk)
+        self.assertFalse(state.is_active)
+        self.assertTrue(state.controls.merchants)
+
+
+class CardStateInvalidationConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        if connection.is_in_memory_db():
+            self.skipTest("An in-memory SQLite database locks its tables against other connections' reads")
+        self.addCleanup(merchants.clear)
+        self.addCleanup(categories.clear)
+
+    def test_state_read_before_the_commit_is_dropped_after_it(self):
+        card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2030, 1, 1), balance=10)
+        context = copy_context()
+
+        def read_state():
+            try:
+                return context.run(get_card_state, card.pk).is_active
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            card.is_active = False
+            card.save()
+            CardControl.objects.create(card=card, control_type='merchant', detail='Coles')
+            # Another connection still sees the committed row and caches it
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                self.assertTrue(pool.submit(read_state).result())
+        state = get_card_state(card.pk)
+        self.assertFalse(state.is_active)
+        self.assertTrue(state.controls.merchants)
+
+
+class CardListPaginationTests(TestCase):
+    def setUp(self):
+        for i in range(5):
+            Card.objects.create(cardholder_name=f'User {i}', expiration_date=date(2025, 1, 1), balance=10.00)
+
+    def test_cursor_walks_every_card_once(self):
+        names, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            body = self.client.get(reverse('cards'), params).json()
+            names += [card['cardholder_name'] for card in body['cards']]
+            cursor = body['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(names, [f'User {i}' for i in range(5)])
+
+    def test_page_size_is_capped(self):
+        with mock.patch('weel.pagination.MAX_PAGE_SIZE', 3):
+            response = self.client.get(reverse('cards'), {'limit': 10 ** 6})
+        self.assertEqual(len(response.json()['cards']), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('cards'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        for values in (["x"], [None], [[1]]):
+            for name in ('cards', 'card-controls'):
+                response = self.client.get(reverse(name), {'cursor': encode_cursor(values)})
+                self.assertEqual(response.status_code, 400, (name, values))
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('cards'), {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['cardholder_name'] for line in lines], [f'User {i}' for i in range(5)])
+
+    def test_field_selection(self):
+        body = self.client.get(reverse('cards'), {'fields': 'cardholder_name,balance', 'limit': 2}).json()
+        self.assertEqual(body['cards'], [{'cardholder_name': 'User 0', 'balance': 10.0}, {'cardholder_name': 'User 1', 'balance': 10.0}])
+        body = self.client.get(reverse('cards'), {'fields': 'balance', 'cursor': body['next_cursor']}).json()
+        self.assertEqual(len(body['cards']), 3)
+        lines = b''.join(self.client.get(reverse('cards'), {'fields': 'card_number', 'format': 'ndjson'}).streaming_content).splitlines()
+        self.assertEqual(set(json.loads(lines[0])), {'card_number'})
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('cards'), {'fields': 'balance,pin'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pin', response.json()['error'])
+
+
+class CardNumberAllocatorTests(TestCase):
+    def test_numbers_are_luhn_valid(self):
+        card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2025, 1, 1), balance=0)
+        self.assertEqual(len(card.card_number), 16)
+        self.assertTrue(is_luhn_valid(card.card_number))
+        self.assertFalse(is_luhn_valid('4000000000000001'))
+
+    def test_allocators_never_share_numbers(self):
+        # Two allocators stand in for two worker processes sharing the sequence table
+        first, second = CardNumberAllocator(block_size=10), CardNumberAllocator(block_size=10)
+        numbers = first.allocate(15) + second.allocate(15) + first.allocate(5) + second.allocate(50)
+        self.assertEqual(len(set(numbers)), len(numbers))
+
+    def test_allocation_within_a_block_skips_the_database(self):
+        allocator = CardNumberAllocator(block_size=10)
+        allocator.allocate(1)
+        with self.assertNumQueries(0):
+            allocator.allocate(9)
+
+
+class CardBulkIssueTests(TestCase):
+    def test_bulk_issue_with_control_templates(self):
+        data = {
+            "cards": [{"cardholder_name": f"User {i}", "expiration_date": "2030-01-01", "balance": 10} for i in range(25)],
+            "controls": [{"control_type": "max_amount", "amount": 50}, {"control_type": "merchant", "detail": "Amazon"}],
+            "chunk_size": 10,
+        }
+        response = self.client.post(reverse('cards-bulk'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['count'], 25)
+        self.assertEqual(Card.objects.count(), 25)
+        self.assertEqual(CardControl.objects.count(), 50)
+        numbers = Card.objects.values_list('card_number', flat=True)
+        self.assertEqual(len(set(numbers)), 25)
+        self.assertTrue(all(is_luhn_valid(number) for number in numbers))
+
+    def test_bulk_issue_from_csv(self):
+        body = "cardholder_name,expiration_date,balance,is_active\nAlice,2030-01-01,5.00,true\nBob,2030-01-01,,false\n"
+        response = self.client.post(reverse('cards-bulk'), body, content_type="text/csv")
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Card.objects.get(cardholder_name='Bob').is_active)
+
+    def test_invalid_card_creates_nothing(self):
+        data = {"cards": [{"cardholder_name": "Alice", "expiration_date": "2030-01-01"}, {"cardholder_name": "Bob"}]}
+        response = self.client.post(reverse('cards-bulk'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Card.objects.count(), 0)
+
+    def test_invalid_control_amount_creates_nothing(self):
+        cards = [{"cardholder_name": "Alice", "expiration_date": "2030-01-01"}]
+        for control in ({"control_type": "max_amount"}, {"control_type": "daily_amount", "amount": "NaN"}, {"control_type": "hourly_count", "amount": 1.5}):
+            data = {"cards": cards, "controls": [control]}
+            response = self.client.post(reverse('cards-bulk'), json.dumps(data), content_type="application/json")
+            self.assertEqual(response.status_code, 400, control)
+        self.assertEqual(Card.objects.count(), 0)
+
+    def test_control_template_amounts_are_quantized(self):
+        data = {"cards": [{"cardholder_name": "Alice", "expiration_date": "2030-01-01"}], "controls": [{"control_type": "max_amount", "amount": 49.5}]}
+        self.client.post(reverse('cards-bulk'), json.dumps(data), content_type="application/json")
+        self.assertEqual(CardControl.objects.get().amount, Decimal('49.50'))
+
+    def test_issue_cards_command(self):
+        with NamedTemporaryFile('w', suffix='.ndjson') as f:
+            f.write('\n'.join(json.dumps({"cardholder_name": f"User {i}", "expiration_date": "2030-01-01"}) for i in range(3)))
+            f.flush()
+            out = StringIO()
+            call_command('issue_cards', f.name, '--control', '{"control_type": "min_amount", "amount": 1}', stdout=out)
+        self.assertIn("Issued 3 cards and 3 controls", out.getvalue())
+        self.assertEqual(Card.objects.count(), 3)
+
+
+class CardStateCacheTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2025, 1, 1), balance=200.00)
+        CardControl.objects.create(card=self.card, control_type='merchant', detail='Walmart')
+
+    def test_cached_state_skips_the_database(self):
+        get_card_state(self.card.id)
+        with self.assertNumQueries(0):
+            state = get_card_state(self.card.id)
+        self.assertEqual(state.controls.merchants, {merchants.intern('Walmart')})
+
+    def test_card_save_invalidates_state(self):
+        self.assertTrue(get_card_state(self.card.id).is_active)
+        self.card.is_active = False
+        self.card.save()
+        self.assertFalse(get_card_state(self.card.id).is_active)
+
+    def test_control_changes_invalidate_state(self):
+        get_card_state(self.card.id)
+        control = CardControl.objects.create(card=self.card, control_type='category', detail='5411')
+        self.assertEqual(get_card_state(self.card.id).controls.categories, {categories.intern('5411')})
+        control.delete()
+        self.assertEqual(get_card_state(self.card.id).controls.categories, set())
+
+    def test_unknown_card(self):
+        with self.assertRaises(Card.DoesNotExist):
+            get_card_state(999999)
+
+
+class SpendCounterTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='Test User', expiration_date=date(2030, 1, 1), balance=1000.00)
+        self.now = datetime(2025, 3, 31, 23, 30, tzinfo=timezone.utc)
+
+    def test_counters_accumulate_within_a_period(self):
+        record_spend(self.card.id, Decimal('10.00'), now=self.now)
+        record_spend(self.card.id, Decimal('5.00'), now=self.now)
+        usage = get_usage([self.card.id], now=self.now)[self.card.id]
+        self.assertEqual(usage['day'], (Decimal('15.00'), 2))
+        self.assertEqual(usage['month'], (Decimal('15.00'), 2))
+
+    def test_counters_reset_when_the_period_rolls_over(self):
+        record_spend(self.card.id, Decimal('10.00'), now=self.now)
+        later = self.now + timedelta(hours=1)
+        record_spend(self.card.id, Decimal('5.00'), now=later)
+        usage = get_usage([self.card.id], now=later)[self.card.id]
+        self.assertEqual(usage['hour'], (Decimal('5.00'), 1))
+        self.assertEqual(usage['day'], (Decimal('5.00'), 1))
+        self.assertEqual(usage['month'], (Decimal('5.00'), 1))
+
+    def test_limits_guard_the_update(self):
+        limits = [('day', 'amount', Decimal('20.00')), ('hour', 'count', 2)]
+        self.assertTrue(record_spend(self.card.id, Decimal('15.00'), limits=limits, now=self.now))
+        self.assertFalse(record_spend(self.card.id, Decimal('10.00'), limits=limits, now=self.now))
+        self.assertTrue(record_spend(self.card.id, Decimal('5.00'), limits=limits, now=self.now))
+        self.assertFalse(record_spend(self.card.id, Decimal('0.01'), limits=[('hour', 'count', 2)], now=self.now))
+        self.assertEqual(get_usage([self.card.id], now=self.now)[self.card.id]['day'], (Decimal('20.00'), 2))
+
+    def test_velocity_controls_fold_to_tightest_limit(self):
+        CardControl.objects.create(card=self.card, control_type='daily_amount', amount=100)
+        CardControl.objects.create(card=self.card, control_type='daily_amount', amount=50)
+        CardControl.objects.create(card=self.card, control_type='hourly_count', amount=3)
+        controls = get_card_state(self.card.id).controls
+        self.assertEqual(sorted(controls.velocity_limits), [('day', 'amount', Decimal('50')), ('hour', 'count', 3)])
+        usage = {'hour': (Decimal('0'), 3), 'day': (Decimal('45.00'), 3), 'month': (Decimal('45.00'), 3)}
+        self.assertEqual(len(controls.evaluate_velocity(Decimal('10.00'), usage)), 2)
+
+
+class CardExpiryTests(TestCase):
+    def setUp(self):
+        self.today = date.today()
+        self.expired = [
+            Card.objects.create(cardholder_name=f'Expired {i}', expiration_date=self.today - timedelta(days=i + 1), balance=100)
+            for i in range(3)
+        ]
+        self.valid = Card.objects.create(cardholder_name='Valid', expiration_date=self.today, balance=100)
+        self.inactive = Card.objects.create(cardholder_name='Inactive', expiration_date=self.today - timedelta(days=1), is_active=False)
+
+    def authorize(self, card, url='transactions'):
+        data = {"card": card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"}
+        return self.client.post(reverse(url), json.dumps(data), content_type="application/json")
+
+    def test_command_deactivates_expired_cards_in_batches(self):
+        get_card_state(self.expired[0].pk)
+        out = StringIO()
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command('expire_cards', '--batch-size', '2', stdout=out)
+        self.assertIn("Deactivated 3 expired cards in 2 batches", out.getvalue())
+        self.assertEqual(set(Card.objects.filter(is_active=True)), {self.valid})
+        # update() fires no signals; the cached states are dropped explicitly, once each batch commits
+        self.assertEqual(len(callbacks), 2)
+        self.assertTrue(get_card_state(self.expired[0].pk).is_active)
+        for callback in callbacks:
+            callback()
+        self.assertFalse(get_card_state(self.expired[0].pk).is_active)
+        self.assertEqual(expire_cards().cards, 0)
+
+    def test_expired_cards_are_declined_before_they_are_deactivated(self):
+        for url in ('transactions', 'transactions-authorize'):
+            with self.subTest(url=url):
+                response = self.authorize(self.expired[0], url)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['reasons'], ["Card has expired"])
+        self.assertEqual(self.authorize(self.valid).status_code, 200)
+        self.assertEqual(list(self.expired[0].transactions.values_list('declines__code', flat=True)), [DeclineCode.CARD_EXPIRED])
+
+    def test_batch_declines_expired_cards(self):
+        data = [{"card": card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"} for card in (self.expired[1], self.valid)]
+        results = self.client.post(reverse('transactions-batch'), json.dumps(data), content_type="application/json").json()['results']
+        self.assertEqual([result['status'] for result in results], ['declined', 'approved'])
+
+    @skipUnless(connection.vendor == 'sqlite', "Plans are asserted against SQLite's EXPLAIN QUERY PLAN output")
+    def test_expired_cards_are_found_through_the_partial_index(self):
+        plan = Card.objects.filter(is_active=True, expiration_date__lt=self.today).values('pk')[:1000].explain()
+        self.assertIn("card_active_expiry_idx", plan)
+
+
+class CardAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('ops', 'ops@example.com', 'password'))
+        self.cards = [Card.objects.create(cardholder_name=f'User {i}', expiration_date=date(2030, 1, 1), balance=10) for i in range(3)]
+        self.controls = [CardControl.objects.create(card=card, control_type='merchant', detail='Woolworths') for card in self.cards]
+
+    def test_changelists(self):
+        for url in ('admin:cards_card_changelist', 'admin:cards_cardcontrol_changelist'):
+            with self.subTest(url=url):
+                response = self.client.get(reverse(url), {'q': self.cards[0].card_number})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_controls_changelist_loads_the_cards_with_the_controls(self):
+        url = reverse('admin:cards_cardcontrol_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        # Read now; the log is cleared by the next request
+        few = queries.captured_queries
+        CardControl.objects.create(card=Card.objects.create(cardholder_name='Other', expiration_date=date(2030, 1, 1)), control_type='category', detail='food')
+        with self.assertNumQueries(len(few)):
+            self.client.get(url)
+
+    def test_deactivate_action(self):
+        get_card_state(self.cards[0].pk)
+        data = {'action': 'deactivate', '_selected_action': [card.pk for card in self.cards[:2]]}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:cards_card_changelist'), data)
+        self.assertEqual([card.pk for card in Card.objects.filter(is_active=True)], [self.cards[2].pk])
+        self.assertFalse(get_card_state(self.cards[0].pk).is_active)
+
+    def test_every_organisation_is_administered(self):
+        acme = Organisation.objects.create(name='Acme', slug='acme')
+        with use_organisation(acme):
+            card = Card.objects.create(cardholder_name='Acme User', expiration_date=date(2030, 1, 1), balance=10)
+            control = CardControl.objects.create(card=card, control_type='merchant', detail='Coles')
+        changelist = reverse('admin:cards_card_changelist')
+        self.assertEqual(self.client.get(changelist, {'q': card.card_number}).context['cl'].result_count, 1)
+        self.assertEqual(self.client.get(changelist, {'organisation__id__exact': acme.id}).context['cl'].result_count, 1)
+        self.assertEqual(self.client.get(reverse('admin:cards_cardcontrol_change', args=[control.pk])).status_code, 200)
+
+        # Controls added on the card's page belong to the card's organisation
+        data = {
+            'cardholder_name': 'Acme User', 'expiration_date': '2030-01-01', 'is_active': 'on',
+            'controls-TOTAL_FORMS': '2', 'controls-INITIAL_FORMS': '1', 'controls-MIN_NUM_FORMS': '0', 'controls-MAX_NUM_FORMS': '1000',
+            'controls-0-id': control.pk, 'controls-0-card': card.pk, 'controls-0-control_type': 'merchant', 'controls-0-merchant': control.merchant_id,
+            'controls-1-card': card.pk, 'controls-1-control_type': 'max_amount', 'controls-1-amount': '50.00',
+        }
+        response = self.client.post(reverse('admin:cards_card_change', args=[card.pk]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(CardControl.objects.unscoped().filter(card=card).values_list('organisation_id', flat=True)), {acme.id})
+
+        data = {'action': 'deactivate', '_selected_action': [card.pk]}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(changelist, data)
+        self.assertFalse(Card.objects.unscoped().get(pk=card.pk).is_active)
+
+    def test_new_cards_are_issued_to_the_chosen_organisation(self):
+        acme = Organisation.objects.create(name='Acme', slug='acme')
+        data = {
+            'cardholder_name': 'Acme User', 'expiration_date': '2030-01-01', 'is_active': 'on', 'organisation': acme.id,
+            'controls-TOTAL_FORMS': '0', 'controls-INITIAL_FORMS': '0', 'controls-MIN_NUM_FORMS': '0', 'controls-MAX_NUM_FORMS': '1000',
+        }
+        self.assertEqual(self.client.post(reverse('admin:cards_card_add'), data).status_code, 302)
+        self.assertEqual(Card.objects.unscoped().get(cardholder_name='Acme User').organisation_id, acme.id)
+
+    def test_delete_controls_action(self):
+        from transactions.models import TransactionDecline
+        data = {"card": self.cards[0].id, "amount": "1.00", "merchant": "Coles", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(get_card_state(self.cards[0].pk).controls.evaluate(Decimal('1.00'), merchants.intern('Coles'), categories.intern('food'))[0].code, DeclineCode.MERCHANT_NOT_ALLOWED)
+
+        data = {'action': 'delete_controls', 'select_across': '1', '_selected_action': [self.controls[0].pk]}
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('admin:cards_cardcontrol_changelist'), data)
+        self.assertFalse(CardControl.objects.exists())
+        # The cached states still hold the deleted controls until the batch commits
+        self.assertTrue(get_card_state(self.cards[0].pk).controls.merchants)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(list(TransactionDecline.objects.values_list('code', 'control')), [(DeclineCode.MERCHANT_NOT_ALLOWED, None)])
+        self.assertEqual(get_card_state(self.cards[0].pk).controls.evaluate(Decimal('1.00'), merchants.intern('Coles'), categories.intern('food')), [])
@@ -0,0 +1,83 @@
+"""
+Rolling spend counters for the velocity and spend-limit controls.
+
+Every approval adds its amount to the card's CardSpend row for the current
+hour, day and month in one UPDATE, made in the same database transaction as
+the balance debit. The UPDATE is guarded by the card's limits, so a limit can
+never be overshot by concurrent approvals, and checking a limit is a single
+primary key lookup however much history the card has.
+"""
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from organisations.tenancy import tenant_database
+from .models import CardSpend
+
+PERIODS = ('hour', 'day', 'month')
+
+
+def period_starts(now=None):
+    """
+    Return the start of the current hour, day and month in the current time zone.
+    """
+    now = timezone.localtime(now)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    day = hour.replace(hour=0)
+    return {'hour': hour, 'day': day, 'month': day.replace(day=1)}
+
+
+def get_usage(card_ids, now=None):
+    """
+    Return {card_id: {period: (amount, count)}} with the spend in the current buckets.
+    """
+    starts = period_starts(now)
+    zero = {period: (0, 0) for period in PERIODS}
+    usage = {card_id: dict(zero) for card_id in card_ids}
+    for spend in CardSpend.objects.filter(card_id__in=card_ids):
+        usage[spend.card_id] = {
+            period: (getattr(spend, f'{period}_amount'), getattr(spend, f'{period}_count'))
+            if getattr(spend, f'{period}_start') == start else (0, 0)
+            for period, start in starts.items()
+        }
+    return usage
+
+
+def record_spend(card_id, amount, count=1, limits=(), now=None):
+    """
+    Add `amount` and `count` to the card's current buckets unless that would break one of
+    `limits`, a sequence of (period, 'amount' or 'count', limit) tuples. Returns False,
+    changing nothing, if a limit would be exceeded.
+    """
+    starts = period_starts(now)
+    guard = Q()
+    for period, measure, limit in limits:
+        increment = amount if measure == 'amount' else count
+        if increment > limit:
+            return False
+        guard &= ~Q(**{f'{period}_start': starts[period]}) | Q(**{f'{period}_{measure}__lte': limit - increment})
+
+    updates = {}
+    for period, start in starts.items():
+        current = Q(**{f'{period}_start': start})
+        updates[f'{period}_amount'] = Case(When(current, then=F(f'{period}_amount') + amount), default=Value(amount), output_field=models.DecimalField())
+        updates[f'{period}_count'] = Case(When(current, then=F(f'{period}_count') + count), default=Value(count), output_field=models.PositiveIntegerField())
+        updates[f'{period}_start'] = Value(start, output_field=models.DateTimeField())
+
+    for attempt in range(2):
+        if CardSpend.objects.filter(card_id=card_id).filter(guard).update(**updates):
+            return True
+        if CardSpend.objects.filter(card_id=card_id).exists():
+            return False
+        try:
+            with transaction.atomic(using=tenant_database()):
+                CardSpend.objects.create(card_id=card_id, **{
+                    field: value
+                    for period, start in starts.items()
+                    for field, value in ((f'{period}_start', start), (f'{period}_amount', amount), (f'{period}_count', count))
+                })
+            return True
+        except IntegrityError:
+            # Another approval created the row first; go round again to update it
+            continue
+    return False
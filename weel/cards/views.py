@@ -1,18 +1,48 @@
+from datetime import date
 from django.http import JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from weel.metrics import timed
+from weel.routers import replica_reads
+from weel.pagination import InvalidCursor, ndjson_response, paginate, wants_export
+from weel.serialization import Field, InvalidFields, Serializer, json_response
+from ledger.balances import balance_expression
+from .controls import InvalidControl, clean_control_amount
+from .issuance import DEFAULT_CHUNK_SIZE, InvalidIssuance, issue_cards, read_csv, read_ndjson
 from .models import Card, CardControl
 import json
 
+
+CARD_SERIALIZER = Serializer(
+    Field('card_number'),
+    Field('cardholder_name'),
+    Field('expiration_date', date.isoformat),
+    Field('is_active'),
+    Field('balance', float, sources=('current_balance',)),
+)
+
+CONTROL_SERIALIZER = Serializer(
+    Field('id'),
+    Field('card_id'),
+    Field('control_type'),
+    # The name of the allowed category or merchant, joined in from its interned row
+    Field('detail', lambda category, merchant: category or merchant, sources=('merchant_category__name', 'merchant__name')),
+    Field('amount', lambda amount: float(amount) if amount else None),
+)
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@replica_reads
 def card_list(request):
     """
     Handle the GET and POST requests for the card list.
 
-    If the request method is GET, return a list of all cards in the database.
+    If the request method is GET, return a page of cards ordered by ID.
     Each card is represented as a dictionary with the following keys: 
     'card_number', 'cardholder_name', 'expiration_date', 'is_active', and 'balance'.
+    The page size is set with `limit` (capped at MAX_PAGE_SIZE) and the next page is fetched
+    by passing the returned `next_cursor` back as `cursor`. `format=ndjson` streams every card instead.
+    `fields` (e.g. `fields=card_number,balance`) returns only the listed keys.
 
     If the request method is POST, create a new card with the data provided in the request body.
     The request body should be a JSON object with the following keys: 
@@ -26,9 +56,22 @@ def card_list(request):
     """
     # GET path
     if request.method == 'GET':
+        try:
+            selection = CARD_SERIALIZER.select(request, extra_columns=('id',))
+        except InvalidFields as e:
+            return JsonResponse({"error": str(e)}, status=400)
         cards = Card.objects.all()
-        data = [{"card_number": card.card_number, "cardholder_name": card.cardholder_name, "expiration_date": card.expiration_date.strftime("%Y-%m-%d"), "is_active": card.is_active, "balance": float(card.balance)} for card in cards]
-        return JsonResponse({"cards": data})
+        if 'balance' in selection:
+            cards = cards.annotate(current_balance=balance_expression())
+        cards = cards.values_list(*selection.columns)
+        if wants_export(request):
+            return ndjson_response(cards.order_by('id'), selection.serialize, 'cards.ndjson')
+        try:
+            rows, next_cursor = paginate(request, cards, ('id',), cursor_values=selection.getter('id'))
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        with timed(request, 'serialization'):
+            return json_response({"cards": selection.serialize(rows), "next_cursor": next_cursor})
 
     # POST path
     elif request.method == 'POST':
@@ -46,20 +89,62 @@ def card_list(request):
             return JsonResponse({"error": str(e)}, status=400)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def card_bulk_issue(request):
+    """
+    Handle the POST request for issuing many cards at once.
+
+    The request body is either a JSON object with a 'cards' list (each item shaped like the
+    card_list POST body), an optional 'controls' list of control templates ('control_type',
+    'detail', 'amount') attached to every new card and an optional 'chunk_size', or a plain
+    CSV (text/csv) or NDJSON (application/x-ndjson) file of cards.
+
+    Card numbers are reserved as one block and the cards are inserted with bulk_create.
+
+    Returns:
+        JsonResponse: A JSON response with the IDs of the created cards and throughput stats,
+        or an error message if any card in the request is invalid (in which case nothing is created).
+    """
+    try:
+        content_type = request.content_type
+        controls, chunk_size = [], DEFAULT_CHUNK_SIZE
+        if content_type == 'text/csv':
+            rows = read_csv(request.body.decode().splitlines())
+        elif content_type == 'application/x-ndjson':
+            rows = read_ndjson(request.body.decode().splitlines())
+        else:
+            data = json.loads(request.body)
+            rows = data['cards']
+            controls = data.get('controls', [])
+            chunk_size = int(data.get('chunk_size', DEFAULT_CHUNK_SIZE))
+        if chunk_size < 1:
+            raise InvalidIssuance("chunk_size must be positive")
+        result = issue_cards(rows, controls, chunk_size=chunk_size)
+        return JsonResponse({"message": "Cards created successfully", "card_ids": result.card_ids, **result.as_dict()}, status=201)
+    except (TypeError, ValueError, KeyError) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@replica_reads
 def card_controls(request):
     """
     Handle the GET and POST requests for card controls.
 
-    If the request method is GET, return a list of all card controls in the database.
+    If the request method is GET, return a page of card controls ordered by ID.
     Each control is represented as a dictionary with the following keys: 
     'id', 'card_id', 'control_type', 'detail', and 'amount'.
+    Pagination, `format=ndjson` export and `fields` work as for the card list.
 
     If the request method is POST, create a new card control with the data provided in the request body.
     The request body should be a JSON object with the following keys: 
     'card_id', 'control_type', 'detail', and 'amount'.
-    'detail' and 'amount' are optional.
+    'detail' and 'amount' are optional. The category or merchant named in 'detail' is interned
+    (see merchants.interning), so it matches transactions whatever their case, spacing or punctuation.
+    Amount and rolling limit controls need a positive 'amount', a whole number for the count
+    limits (see cards.controls.clean_control_amount).
 
     Returns:
         JsonResponse: A JSON response with the list of card controls (for GET requests) or a success message 
@@ -68,18 +153,20 @@ def card_controls(request):
     """
     # GET path
     if request.method == 'GET':
-        controls = CardControl.objects.all()
-        data = [
-            {
-                "id": control.id,
-                "card_id": control.card_id,
-                "control_type": control.control_type,
-                "detail": control.detail,
-                "amount": float(control.amount) if control.amount else None,
-            } for control in controls
-        ]
-        return JsonResponse({"card_controls": data}, safe=False)
-    
+        try:
+            selection = CONTROL_SERIALIZER.select(request, extra_columns=('id',))
+        except InvalidFields as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        controls = CardControl.objects.values_list(*selection.columns)
+        if wants_export(request):
+            return ndjson_response(controls.order_by('id'), selection.serialize, 'card_controls.ndjson')
+        try:
+            rows, next_cursor = paginate(request, controls, ('id',), cursor_values=selection.getter('id'))
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        with timed(request, 'serialization'):
+            return json_response({"card_controls": selection.serialize(rows), "next_cursor": next_cursor})
+
     # POST path
     elif request.method == 'POST':
         try:
@@ -87,11 +174,14 @@ def card_controls(request):
             card = Card.objects.get(id=data['card_id'])
             control = CardControl.objects.create(
                 card=card,
+                organisation_id=card.organisation_id,
                 control_type=data['control_type'],
                 detail=data.get('detail'),
-                amount=data.get('amount')
+                amount=clean_control_amount(data['control_type'], data.get('amount'))
             )
             return JsonResponse({"message": "Card control created successfully", "control_id": control.id}, status=201)
+        except InvalidControl as e:
+            return JsonResponse({"error": str(e)}, status=400)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=400)
 
@@ -0,0 +1,159 @@
+"""
+Card balances from the append-only ledger.
+
+Every change to a balance is a LedgerEntry and nothing is ever updated in place,
+so a card's history can be audited and its balance rebuilt at any time. The
+current balance is the card's latest BalanceSnapshot plus the entries after it,
+read with one query through balance_expression(); snapshot_balances keeps the
+number of entries summed small.
+
+Debits append their entry with a single INSERT ... SELECT guarded by the card's
+balance and status (BALANCE_SQL), so the card row is never rewritten and the
+check and the append cannot be separated. SQLite runs that statement under its one write
+lock; on PostgreSQL each posting first takes a per-card advisory lock (see
+posting_lock), which queues postings to one card without writing to any row.
+"""
+from contextlib import contextmanager
+
+from django.db import connections, models, transaction as db_transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from cards.models import Card
+from organisations.tenancy import current_organisation_id, tenant_database
+from .models import BalanceSnapshot, EntryKind, LedgerEntry
+
+# First key of the PostgreSQL advisory locks taken for card postings
+LOCK_NAMESPACE = 0x1ed9e4
+
+# The balance of the card whose ID is `{card}`: its latest snapshot plus the entries after it.
+# Rounded because SQLite sums decimals in binary floating point.
+BALANCE_SQL = (
+    "ROUND("
+    "COALESCE((SELECT s.balance FROM {snapshot} s WHERE s.card_id = {card} ORDER BY s.entry_id DESC LIMIT 1), 0)"
+    " + COALESCE((SELECT SUM(e.amount) FROM {entry} e WHERE e.card_id = {card} AND e.id > "
+    "COALESCE((SELECT MAX(s.entry_id) FROM {snapshot} s WHERE s.card_id = {card}), 0)), 0)"
+    ", 2)"
+)
+
+
+def _balance_sql(card):
+    return BALANCE_SQL.format(card=card, snapshot=BalanceSnapshot._meta.db_table, entry=LedgerEntry._meta.db_table)
+
+
+def balance_expression():
+    """
+    An expression for the balance of each card of a Card queryset, e.g.
+    Card.objects.annotate(current_balance=balance_expression()).
+
+    Plain SQL rather than nested subqueries so it costs nothing to build on every request;
+    it refers to the card table by name and so only works in a top-level Card queryset.
+    """
+    card = f"{Card._meta.db_table}.{Card._meta.pk.column}"
+    return RawSQL(_balance_sql(card), (), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+
+
+def latest_snapshot(card):
+    """
+    The snapshots of `card` (an ID or an OuterRef), newest first.
+    """
+    return BalanceSnapshot.objects.unscoped().filter(card=card).order_by('-entry_id')
+
+
+def get_accounts(card_ids):
+    """
+    Return {card_id: (is_active, balance)} for the given cards, with one query.
+    """
+    rows = Card.objects.unscoped().filter(pk__in=card_ids).annotate(current_balance=balance_expression())
+    return {card_id: (is_active, balance) for card_id, is_active, balance in rows.values_list('id', 'is_active', 'current_balance')}
+
+
+def get_balance(card_id):
+    """
+    Return the card's current balance. Raises Card.DoesNotExist.
+    """
+    return Card.objects.unscoped().filter(pk=card_id).annotate(current_balance=balance_expression()).values_list('current_balance', flat=True).get()
+
+
+@contextmanager
+def posting_lock(card_ids, using):
+    """
+    Queue postings to `card_ids` behind each other until the end of the block.
+
+    A no-op except on PostgreSQL, where the advisory locks are held by a transaction
+    opened here. Locks are taken in card ID order so batches cannot deadlock.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    with db_transaction.atomic(using=using):
+        with connection.cursor() as cursor:
+            for card_id in sorted(set(card_ids)):
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [LOCK_NAMESPACE, card_id])
+        yield
+
+
+def post(card_id, kind, amount, transaction=None, organisation_id=None):
+    """
+    Append an unconditional entry, e.g. a credit, and return it.
+    """
+    using = tenant_database()
+    with posting_lock([card_id], using):
+        return LedgerEntry.objects.using(using).create(
+            organisation_id=organisation_id or current_organisation_id(),
+            card_id=card_id, kind=kind, amount=amount, transaction=transaction,
+        )
+
+
+def debit(card_id, amount, kind=EntryKind.PURCHASE, transaction=None, organisation_id=None):
+    """
+    Append a debit of `amount` unless the card is inactive or its balance is less than
+    `amount`. Returns True if the entry was appended. Raises ValueError unless `amount` is
+    positive: credits are posted as reversals or adjustments.
+    """
+    if not amount > 0:
+        raise ValueError(f"Debit amount must be positive, got {amount}")
+    using = tenant_database()
+    connection = connections[using]
+    sql = (
+        f"INSERT INTO {LedgerEntry._meta.db_table} (organisation_id, card_id, kind, amount, transaction_id, created) "
+        f"SELECT %s, card.id, %s, CAST(%s AS NUMERIC), %s, %s FROM {Card._meta.db_table} card "
+        f"WHERE card.id = %s AND card.is_active AND {_balance_sql('card.id')} >= CAST(%s AS NUMERIC)"
+    )
+    params = [
+        organisation_id or current_organisation_id(), kind, str(-amount),
+        transaction.pk if transaction is not None else None,
+        connection.ops.adapt_datetimefield_value(timezone.now()), card_id, str(amount),
+    ]
+    with posting_lock([card_id], using), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
+def debit_many(entries):
+    """
+    Append unsaved debit entries for several cards, e.g. a batch of purchases, inside the
+    caller's transaction. Returns False if any of the cards is inactive or would be
+    overdrawn, in which case the caller must roll back. Raises ValueError if any entry
+    is not a debit, i.e. its amount is not negative.
+    """
+    for entry in entries:
+        if not entry.amount < 0:
+            raise ValueError(f"Debit entries must have a negative amount, got {entry.amount}")
+    using = tenant_database()
+    card_ids = {entry.card_id for entry in entries}
+    with posting_lock(card_ids, using):
+        LedgerEntry.objects.using(using).bulk_create(entries)
+        return all(is_active and balance >= 0 for is_active, balance in get_accounts(card_ids).values())
+
+
+def opening_entries(cards):
+    """
+    Build the OPENING entries for new `cards` with a balance, to save with bulk_create.
+    """
+    return [
+        LedgerEntry(organisation_id=card.organisation_id, card_id=card.pk, kind=EntryKind.OPENING, amount=card.balance)
+        for card in cards
+        if card.balance
+    ]
@@ -0,0 +1,180 @@
+"""
+Ledger maintenance: balance snapshots and consistency checks.
+
+Both walk the cards in ID-keyed batches and handle each batch with a few
+set-based queries, so they run in bounded memory over millions of cards and
+can be stopped and resumed from any card ID.
+"""
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from cards.models import Card
+from organisations.tenancy import tenant_database
+from transactions.models import ArchivedCardTotal, Reversal, Transaction
+from .balances import balance_expression, latest_snapshot, posting_lock
+from .models import BalanceSnapshot, EntryKind, LedgerEntry
+
+DEFAULT_BATCH_SIZE = 1000
+# Entries a card must have gained since its last snapshot to get a new one
+DEFAULT_MIN_ENTRIES = 10
+# Snapshots kept per card; older ones are deleted when a new one is written
+DEFAULT_KEEP = 2
+
+
+@dataclass
+class MaintenanceResult:
+    cards: int = 0
+    snapshots: int = 0
+    problems: list = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def card_batches(batch_size=DEFAULT_BATCH_SIZE, start_after=0):
+    """
+    Yield lists of up to `batch_size` card IDs of the current organisation, in ID order.
+    """
+    last = start_after
+    while True:
+        ids = list(Card.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def _aggregate(queryset, value):
+    """
+    A subquery for `value` (an aggregate) over `queryset`, which filters on OuterRef('pk').
+    """
+    return Subquery(queryset.order_by().values('card').annotate(value=value).values('value'))
+
+
+def snapshot_cards(card_ids, min_entries=DEFAULT_MIN_ENTRIES, keep=DEFAULT_KEEP):
+    """
+    Write a snapshot for each of the cards with at least `min_entries` entries since its
+    latest snapshot, and delete all but its `keep` newest snapshots. Returns the number
+    of snapshots written.
+    """
+    using = tenant_database()
+    with transaction.atomic(using=using), posting_lock(card_ids, using):
+        entries = LedgerEntry.objects.unscoped().filter(card=OuterRef('pk'))
+        cards = (
+            Card.objects.unscoped().filter(pk__in=card_ids)
+            .annotate(snapshot_entry=Coalesce(Subquery(latest_snapshot(OuterRef('pk')).values('entry_id')[:1]), 0))
+            .annotate(
+                pending=Coalesce(_aggregate(entries.filter(id__gt=OuterRef('snapshot_entry')), Count('id')), 0),
+                last_entry=Subquery(entries.order_by('-id').values('id')[:1]),
+                current_balance=balance_expression(),
+            )
+            .filter(pending__gte=max(min_entries, 1))
+            .values_list('pk', 'organisation_id', 'last_entry', 'current_balance')
+        )
+        snapshots = BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(card_id=card_id, organisation_id=organisation_id, entry_id=last_entry, balance=balance)
+            for card_id, organisation_id, last_entry, balance in cards
+        ])
+
+        superseded, kept = [], {}
+        snapshotted = {snapshot.card_id for snapshot in snapshots}
+        rows = BalanceSnapshot.objects.unscoped().filter(card_id__in=snapshotted).order_by('card_id', '-entry_id').values_list('pk', 'card_id')
+        for snapshot_id, card_id in rows:
+            kept[card_id] = kept.get(card_id, 0) + 1
+            if kept[card_id] > keep:
+                superseded.append(snapshot_id)
+        BalanceSnapshot.objects.unscoped().filter(pk__in=superseded).delete()
+    return len(snapshots)
+
+
+def _money(value):
+    # Sums come back as floats or integers on SQLite
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def check_cards(card_ids):
+    """
+    Check the ledgers of the given cards and return a list of problems as strings.
+
+    For every card, the latest snapshot must equal the sum of the entries it covers, the
+    balance must not be negative, and the purchase entries must match the card's approved
+    transactions, archived ones included, in number and total. The reversal entries must
+    add up to the card's reversals.
+    """
+    entries = LedgerEntry.objects.unscoped().filter(card=OuterRef('pk'))
+    purchases = entries.filter(kind=EntryKind.PURCHASE)
+    reversal_entries = entries.filter(kind=EntryKind.REVERSAL)
+    reversals = Reversal.objects.unscoped().filter(card=OuterRef('pk'))
+    approved = Transaction.objects.unscoped().filter(card=OuterRef('pk'), approved=True)
+    archived = ArchivedCardTotal.objects.unscoped().filter(card=OuterRef('pk'))
+    cards = (
+        Card.objects.unscoped().filter(pk__in=card_ids).order_by('pk')
+        .annotate(
+            snapshot_entry=Subquery(latest_snapshot(OuterRef('pk')).values('entry_id')[:1]),
+            snapshot_balance=Subquery(latest_snapshot(OuterRef('pk')).values('balance')[:1]),
+        )
+        .annotate(
+            folded=_aggregate(entries.filter(id__lte=OuterRef('snapshot_entry')), Sum('amount')),
+            current_balance=balance_expression(),
+            purchase_count=_aggregate(purchases, Count('id')),
+            purchase_total=_aggregate(purchases, Sum('amount')),
+            approved_count=_aggregate(approved, Count('id')),
+            approved_total=_aggregate(approved, Sum('amount')),
+            archived_count=_aggregate(archived, Sum('approved_count')),
+            archived_total=_aggregate(archived, Sum('approved_total')),
+            reversal_entry_total=_aggregate(reversal_entries, Sum('amount')),
+            reversal_total=_aggregate(reversals, Sum('amount')),
+        )
+        .values_list(
+            'pk', 'snapshot_entry', 'snapshot_balance', 'folded', 'current_balance',
+            'purchase_count', 'purchase_total', 'approved_count', 'approved_total', 'archived_count', 'archived_total',
+            'reversal_entry_total', 'reversal_total',
+        )
+    )
+    problems = []
+    for (card_id, entry_id, snapshot, folded, balance, purchase_count, purchase_total,
+         approved_count, approved_total, archived_count, archived_total, reversal_entry_total, reversal_total) in cards:
+        folded, purchased = _money(folded), -_money(purchase_total)
+        approved_count, approved_total = (approved_count or 0) + (archived_count or 0), _money(approved_total) + _money(archived_total)
+        if entry_id is not None and _money(snapshot) != folded:
+            problems.append(f"Card {card_id}: snapshot at entry {entry_id} is {_money(snapshot)} but its entries sum to {folded}")
+        if balance < 0:
+            problems.append(f"Card {card_id}: balance is negative ({_money(balance)})")
+        if (purchase_count or 0) != approved_count or purchased != approved_total:
+            problems.append(
+                f"Card {card_id}: {approved_count} approved transactions total {approved_total} "
+                f"but {purchase_count or 0} purchase entries total {purchased}"
+            )
+        if _money(reversal_entry_total) != _money(reversal_total):
+            problems.append(f"Card {card_id}: reversals total {_money(reversal_total)} but reversal entries total {_money(reversal_entry_total)}")
+    return problems
+
+
+def snapshot_balances(batch_size=DEFAULT_BATCH_SIZE, min_entries=DEFAULT_MIN_ENTRIES, keep=DEFAULT_KEEP, start_after=0):
+    """
+    Snapshot the balances of every card of the current organisation, one batch per
+    database transaction. Returns a MaintenanceResult.
+    """
+    started = time.perf_counter()
+    result = MaintenanceResult()
+    for card_ids in card_batches(batch_size, start_after):
+        result.cards += len(card_ids)
+        result.snapshots += snapshot_cards(card_ids, min_entries=min_entries, keep=keep)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def check_ledger(batch_size=DEFAULT_BATCH_SIZE, start_after=0):
+    """
+    Check the ledgers of every card of the current organisation. Returns a MaintenanceResult.
+    """
+    started = time.perf_counter()
+    result = MaintenanceResult()
+    for card_ids in card_batches(batch_size, start_after):
+        result.cards += len(card_ids)
+        result.problems.extend(check_cards(card_ids))
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,32 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ledger.maintenance import DEFAULT_BATCH_SIZE, check_ledger
+from organisations.models import Organisation
+from organisations.tenancy import get_organisation, use_organisation
+
+
+class Command(BaseCommand):
+    help = "Check that card ledgers, their snapshots and the approved transactions agree."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organisation', help="Slug of the organisation to check; every card in the default database if omitted.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Cards checked per query.")
+        parser.add_argument('--start-after', type=int, default=0, help="Resume after this card ID.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            organisation = get_organisation(options['organisation']) if options['organisation'] else None
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+
+        with use_organisation(organisation) if organisation else nullcontext():
+            result = check_ledger(batch_size=options['batch_size'], start_after=options['start_after'])
+        for problem in result.problems:
+            self.stdout.write(problem)
+        if result.problems:
+            raise CommandError(f"Found {len(result.problems)} problems in {result.cards} cards")
+        self.stdout.write(self.style.SUCCESS(f"Checked {result.cards} cards in {result.seconds:.3f}s: no problems"))
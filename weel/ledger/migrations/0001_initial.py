@@ -0,0 +1,63 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:56
+
+import django.db.models.deletion
+import django.utils.timezone
+import organisations.tenancy
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    # Every existing balance becomes the card's opening entry
+    Card = apps.get_model('cards', 'Card')
+    LedgerEntry = apps.get_model('ledger', 'LedgerEntry')
+    db = schema_editor.connection.alias
+    cards = Card.objects.using(db).exclude(balance=0).values_list('id', 'organisation_id', 'balance').order_by('id')
+    LedgerEntry.objects.using(db).bulk_create(
+        (LedgerEntry(card_id=card_id, organisation_id=organisation_id, kind=1, amount=balance) for card_id, organisation_id, balance in cards.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('cards', '0006_organisations'),
+        ('organisations', '0001_initial'),
+        ('transactions', '0004_organisations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_id', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('card', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='cards.card')),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='balance_snapshots', to='organisations.organisation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['card', '-entry_id'], name='balance_snapshot_card_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Opening balance'), (2, 'Purchase'), (3, 'Top-up'), (4, 'Reversal'), (5, 'Adjustment')])),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('card', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='cards.card')),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='organisations.organisation')),
+                ('transaction', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ledger_entries', to='transactions.transaction')),
+            ],
+            options={
+                'verbose_name_plural': 'ledger entries',
+                'indexes': [models.Index(fields=['card', 'id'], name='ledger_entry_card_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
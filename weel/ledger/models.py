@@ -0,0 +1,65 @@
+from django.db import models
+from django.utils import timezone
+from cards.models import Card, organisation_field
+from organisations.managers import TenantManager
+from transactions.models import Transaction
+
+
+class EntryKind(models.IntegerChoices):
+    OPENING = 1, "Opening balance"
+    PURCHASE = 2, "Purchase"
+    TOP_UP = 3, "Top-up"
+    REVERSAL = 4, "Reversal"
+    ADJUSTMENT = 5, "Adjustment"
+
+
+class LedgerEntry(models.Model):
+    """
+    One movement of a card's balance; see ledger.balances.
+
+    Credits are positive and debits negative, and the other side of each movement is
+    named by its kind (the cardholder's funding for openings and top-ups, the merchant
+    for purchases and reversals). Entries are only ever inserted: a card's balance is
+    its latest BalanceSnapshot plus the entries after it.
+    """
+    organisation = organisation_field('ledger_entries')
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='ledger_entries', db_index=False)  # Covered by ledger_entry_card_idx
+    kind = models.PositiveSmallIntegerField(choices=EntryKind.choices)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Kept as a plain reference so archiving or deleting transactions never rewrites the ledger
+    transaction = models.ForeignKey(Transaction, on_delete=models.DO_NOTHING, null=True, blank=True, related_name='ledger_entries', db_constraint=False)
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = TenantManager()
+
+    class Meta:
+        verbose_name_plural = 'ledger entries'
+        indexes = [
+            # A card's entries in posting order, for balances since a snapshot
+            models.Index(fields=['card', 'id'], name='ledger_entry_card_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.amount} on card {self.card_id}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    A card's balance after every entry up to and including `entry_id`, written by the
+    snapshot_balances command so balances never sum more than the recent entries.
+    """
+    organisation = organisation_field('balance_snapshots')
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='balance_snapshots', db_index=False)  # Covered by balance_snapshot_card_idx
+    entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = TenantManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['card', '-entry_id'], name='balance_snapshot_card_idx'),
+        ]
+
+    def __str__(self):
+        return f"Balance of card {self.card_id} at entry {self.entry_id}"
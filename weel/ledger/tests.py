@@ -0,0 +1,137 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from cards.models import Card
+from merchants.interning import categories, merchants
+from transactions.models import Reversal, ReversalKind, Transaction
+from .balances import balance_expression, debit_many, get_balance
+from .maintenance import snapshot_cards
+from .models import BalanceSnapshot, EntryKind, LedgerEntry
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+import json
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+
+    def entries(self):
+        return list(LedgerEntry.objects.filter(card=self.card).order_by('id').values_list('kind', 'amount'))
+
+    def test_opening_balance_is_posted(self):
+        self.assertEqual(self.entries(), [(EntryKind.OPENING, Decimal('100.00'))])
+        self.assertEqual(Card.objects.get(pk=self.card.pk).balance, Decimal('100.00'))
+
+    def test_debits_append_entries(self):
+        self.assertTrue(self.card.debit(Decimal('30.00')))
+        self.assertFalse(self.card.debit(Decimal('70.01')))
+        self.assertEqual(self.entries(), [(EntryKind.OPENING, Decimal('100.00')), (EntryKind.PURCHASE, Decimal('-30.00'))])
+        self.assertEqual(self.card.balance, Decimal('70.00'))
+
+    def test_non_positive_debits_are_rejected(self):
+        for amount in (Decimal('0.00'), Decimal('-10.00')):
+            with self.assertRaises(ValueError):
+                self.card.debit(amount)
+        with self.assertRaises(ValueError):
+            debit_many([LedgerEntry(organisation_id=self.card.organisation_id, card_id=self.card.pk, kind=EntryKind.PURCHASE, amount=Decimal('5.00'))])
+        self.assertEqual(len(self.entries()), 1)
+
+    def test_setting_the_balance_posts_an_adjustment(self):
+        self.card.balance = 80
+        self.card.save()
+        self.assertEqual(self.entries()[-1], (EntryKind.ADJUSTMENT, Decimal('-20.00')))
+        self.assertEqual(self.card.balance, Decimal('80.00'))
+
+    def test_approved_transactions_are_debited(self):
+        data = {"card": self.card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.client.post(reverse('transactions-batch'), json.dumps([data, data]), content_type="application/json")
+        transactions = list(Transaction.objects.order_by('id').values_list('id', flat=True))
+        purchases = LedgerEntry.objects.filter(kind=EntryKind.PURCHASE).order_by('id')
+        self.assertEqual([(entry.transaction_id, entry.amount) for entry in purchases], [(id, Decimal('-10.00')) for id in transactions])
+        self.assertEqual(self.client.get(reverse('cards')).json()['cards'][0]['balance'], 70.0)
+
+    def test_declined_transactions_post_nothing(self):
+        data = {"card": self.card.id, "amount": "500.00", "merchant": "Woolworths", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(len(self.entries()), 1)
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        for _ in range(3):
+            self.card.debit(Decimal('10.00'))
+
+    def test_snapshot_folds_entries(self):
+        self.assertEqual(snapshot_cards([self.card.pk], min_entries=1), 1)
+        snapshot = BalanceSnapshot.objects.get()
+        self.assertEqual((snapshot.entry_id, snapshot.balance), (LedgerEntry.objects.latest('id').id, Decimal('70.00')))
+        self.card.debit(Decimal('5.00'))
+        self.assertEqual(get_balance(self.card.pk), Decimal('65.00'))
+
+    def test_cards_with_few_new_entries_are_skipped(self):
+        self.assertEqual(snapshot_cards([self.card.pk], min_entries=5), 0)
+        self.assertEqual(snapshot_cards([self.card.pk], min_entries=4), 1)
+        self.assertEqual(snapshot_cards([self.card.pk], min_entries=1), 0)
+
+    def test_old_snapshots_are_pruned(self):
+        for _ in range(3):
+            self.card.debit(Decimal('1.00'))
+            snapshot_cards([self.card.pk], min_entries=1, keep=2)
+        self.assertEqual(list(BalanceSnapshot.objects.order_by('-entry_id').values_list('balance', flat=True)), [Decimal('67.00'), Decimal('68.00')])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('snapshot_balances', '--min-entries', '1', stdout=out)
+        self.assertIn("Snapshotted 1 of 1 cards", out.getvalue())
+
+
+class CheckLedgerCommandTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        data = {"card": self.card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        snapshot_cards([self.card.pk], min_entries=1)
+
+    def check(self):
+        out = StringIO()
+        call_command('check_ledger', '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def test_consistent_ledger(self):
+        Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=0)
+        self.assertIn("Checked 2 cards", self.check())
+
+    def test_reports_a_snapshot_that_disagrees_with_its_entries(self):
+        BalanceSnapshot.objects.update(balance=Decimal('1000.00'))
+        with self.assertRaisesMessage(CommandError, "Found 1 problems in 1 cards"):
+            self.check()
+
+    def test_reports_approved_transactions_missing_from_the_ledger(self):
+        Transaction.objects.create(card=self.card, amount=5, merchant_id=merchants.intern('Coles'), merchant_category_id=categories.intern('food'), approved=True)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_ledger', stdout=out)
+        self.assertIn("2 approved transactions total 15.00 but 1 purchase entries total 10.00", out.getvalue())
+
+    def test_reports_reversals_missing_from_the_ledger(self):
+        Reversal.objects.create(transaction=Transaction.objects.get(), card=self.card, kind=ReversalKind.REFUND, amount=4)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('check_ledger', stdout=out)
+        self.assertIn("reversals total 4.00 but reversal entries total 0.00", out.getvalue())
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plans are asserted against SQLite's EXPLAIN QUERY PLAN output")
+class LedgerQueryPlanTests(TestCase):
+    def test_balance_reads_only_the_card_entries_and_snapshot(self):
+        card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=10.00)
+        plan = Card.objects.filter(pk=card.pk).annotate(current_balance=balance_expression()).explain()
+        self.assertIn("USING COVERING INDEX balance_snapshot_card_idx", plan)
+        self.assertIn("USING INDEX ledger_entry_card_idx", plan)
+        self.assertNotIn("SCAN", plan)
@@ -0,0 +1,33 @@
+from django.contrib import admin
+
+from weel.admin import EstimatedCountPaginator
+from .models import Merchant, MerchantCategory
+
+
+class InternedAdmin(admin.ModelAdmin):
+    """
+    Rows are created by merchants.interning and referenced by every transaction, so only
+    the display name can be changed.
+    """
+    list_display = ('id', 'name', 'key')
+    search_fields = ('name',)
+    ordering = ('name',)
+    readonly_fields = ('key',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MerchantCategory)
+class MerchantCategoryAdmin(InternedAdmin):
+    pass
+
+
+@admin.register(Merchant)
+class MerchantAdmin(InternedAdmin):
+    pass
@@ -0,0 +1,151 @@
+"""
+Interning of merchant and merchant category names.
+
+Transactions and card controls refer to merchants and categories by the ID of a
+Merchant or MerchantCategory row rather than repeating the name, so the
+transaction table and its indexes stay small and a control check compares
+integers. Names are matched on a normalized key (see normalize), so 'AMAZON.COM'
+and 'Amazon com' are the same merchant; the first spelling seen is kept for
+display.
+
+Each process keeps the key -> ID mappings it has resolved, per database, so a
+known name costs no query; names not seen before are inserted with one
+conflict-ignoring bulk insert. A mapping is only cached once the transaction
+that read or wrote its row has committed (see transaction.on_commit), so a
+rolled-back insert can never leave an ID pointing at nothing in the cache.
+"""
+import re
+import unicodedata
+
+from django.db import router, transaction
+
+from .models import Merchant, MerchantCategory
+
+# Mappings kept per database; the cache is emptied and refilled when it grows past this
+MAX_CACHED = 100000
+
+_APOSTROPHES = re.compile(r"['’]")
+_WORDS = re.compile(r'[^\W_]+')
+
+
+class InvalidName(ValueError):
+    pass
+
+
+def normalize(name):
+    """
+    The key `name` is matched on: NFKC-normalized and case-folded, with apostrophes
+    dropped and every other run of punctuation and whitespace made a single space.
+    """
+    folded = _APOSTROPHES.sub('', unicodedata.normalize('NFKC', name).casefold())
+    return ' '.join(_WORDS.findall(folded))
+
+
+class Interner:
+    """
+    Resolves names to the IDs of `model` (Merchant or MerchantCategory) rows in the
+    current organisation's database.
+    """
+
+    def __init__(self, model, label):
+        self.model = model
+        self.label = label
+        self.max_length = model._meta.get_field('name').max_length
+        # {database alias: {key: ID}}
+        self._ids = {}
+
+    def clean(self, name):
+        """
+        Return (display name, key) for `name`. Raises InvalidName unless it is a string of
+        at most max_length characters with a letter or digit in it.
+        """
+        if not isinstance(name, str):
+            raise InvalidName(f"Invalid {self.label} '{name}'")
+        name = ' '.join(name.split())
+        key = normalize(name)
+        if not key or len(name) > self.max_length or len(key) > self.max_length:
+            raise InvalidName(f"Invalid {self.label} '{name}'")
+        return name, key
+
+    def _remember(self, database, found):
+        cache = self._ids.setdefault(database, {})
+
+        def remember():
+            if len(cache) + len(found) > MAX_CACHED:
+                cache.clear()
+            cache.update(found)
+        transaction.on_commit(remember, using=database)
+
+    def intern_many(self, names):
+        """
+        Return {name: ID} for an iterable of names, creating rows for the new ones. Uncached
+        names are read with one query and new ones inserted with one more. Raises InvalidName.
+        """
+        database = router.db_for_write(self.model)
+        cache = self._ids.get(database, {})
+        keys = {name: self.clean(name) for name in set(names)}
+        missing = {key: display for display, key in keys.values() if key not in cache}
+        found = {}
+        if missing:
+            rows = self.model.objects.using(database)
+            found = dict(rows.filter(key__in=missing).values_list('key', 'id'))
+            new = [self.model(name=display, key=key) for key, display in missing.items() if key not in found]
+            if new:
+                # A concurrent insert of the same key wins; its ID is read back with ours
+                rows.bulk_create(new, ignore_conflicts=True)
+                found.update(rows.filter(key__in=[row.key for row in new]).values_list('key', 'id'))
+            self._remember(database, found)
+        return {name: found[key] if key in found else cache[key] for name, (_, key) in keys.items()}
+
+    def intern(self, name):
+        """
+        Return the ID for `name`, creating its row if it is new. Raises InvalidName.
+        """
+        _, key = self.clean(name)
+        interned = self._ids.get(router.db_for_write(self.model), {}).get(key)
+        return interned if interned is not None else self.intern_many([name])[name]
+
+    def lookup(self, name):
+        """
+        Return the ID for `name` without creating anything: None for a name never interned
+        or that could not be.
+        """
+        try:
+            _, key = self.clean(name)
+        except InvalidName:
+            return None
+        database = router.db_for_write(self.model)
+        interned = self._ids.get(database, {}).get(key)
+        if interned is None:
+            interned = self.model.objects.using(database).filter(key=key).values_list('id', flat=True).first()
+            if interned is not None:
+                self._remember(database, {key: interned})
+        return interned
+
+    def clear(self):
+        self._ids.clear()
+
+
+merchants = Interner(Merchant, 'merchant')
+categories = Interner(MerchantCategory, 'merchant category')
+
+
+def intern_legacy(model, names, using, batch_size=500):
+    """
+    Return {name: ID} for free-text `names` stored before interning, creating the rows of
+    `model` (Merchant or MerchantCategory, as given to a migration) that they need. Names
+    Interner.clean would reject are kept, shortened to fit, rather than failing the migration.
+    """
+    max_length = model._meta.get_field('key').max_length
+    keys = {name: normalize(name)[:max_length] for name in names}
+    spellings = {}
+    for name, key in keys.items():
+        spellings.setdefault(key, ' '.join(name.split())[:max_length])
+    ids = {}
+    rows = model.objects.using(using)
+    spellings = list(spellings.items())
+    for start in range(0, len(spellings), batch_size):
+        batch = spellings[start:start + batch_size]
+        rows.bulk_create([model(name=name, key=key) for key, name in batch], ignore_conflicts=True)
+        ids.update(rows.filter(key__in=[key for key, _ in batch]).values_list('key', 'id'))
+    return {name: ids[key] for name, key in keys.items()}
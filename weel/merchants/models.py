@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class MerchantCategory(models.Model):
+    """
+    A merchant category that transactions and category controls refer to by ID; see
+    merchants.interning. Names are matched on `key`, their normalized form, and
+    `name` keeps the first spelling seen.
+    """
+    # Four-byte IDs keep the foreign keys on every transaction small
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=50)
+    key = models.CharField(max_length=50, unique=True)
+
+    class Meta:
+        verbose_name_plural = 'merchant categories'
+
+    def __str__(self):
+        return self.name
+
+
+class Merchant(models.Model):
+    """
+    A merchant that transactions and merchant controls refer to by ID, interned like
+    MerchantCategory.
+    """
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+    key = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
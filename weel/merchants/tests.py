@@ -0,0 +1,65 @@
+from django.test import TestCase
+from .interning import InvalidName, categories, intern_legacy, merchants, normalize
+from .models import Merchant, MerchantCategory
+
+
+class NormalizeTests(TestCase):
+    def test_case_spacing_and_punctuation_are_ignored(self):
+        self.assertEqual(normalize('  AMAZON.COM '), 'amazon com')
+        self.assertEqual(normalize('Amazon   com'), 'amazon com')
+        self.assertEqual(normalize("McDonald's"), normalize('MCDONALDS'))
+        self.assertEqual(normalize('Ｃａｆé'), 'café')
+
+    def test_name_without_letters_or_digits_is_empty(self):
+        self.assertEqual(normalize(' -- '), '')
+
+
+class InterningTests(TestCase):
+    def setUp(self):
+        self.addCleanup(merchants.clear)
+        self.addCleanup(categories.clear)
+
+    def test_spellings_of_a_name_share_one_row(self):
+        woolworths = merchants.intern('Woolworths Metro')
+        self.assertEqual(merchants.intern('WOOLWORTHS-METRO'), woolworths)
+        self.assertEqual(merchants.lookup(' woolworths  metro '), woolworths)
+        self.assertEqual(Merchant.objects.get().name, 'Woolworths Metro')
+
+    def test_intern_many_creates_only_new_names(self):
+        existing = categories.intern('food')
+        with self.assertNumQueries(3):
+            ids = categories.intern_many(['Food', 'travel', 'TRAVEL'])
+        self.assertEqual(ids['Food'], existing)
+        self.assertEqual(ids['travel'], ids['TRAVEL'])
+        self.assertEqual(MerchantCategory.objects.count(), 2)
+
+    def test_mappings_are_cached_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            coles = merchants.intern('Coles')
+        with self.assertNumQueries(0):
+            self.assertEqual(merchants.intern('COLES'), coles)
+            self.assertEqual(merchants.intern_many(['coles']), {'coles': coles})
+
+    def test_rolled_back_mappings_are_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            merchants.intern('Coles')
+        with self.assertNumQueries(1):
+            merchants.lookup('Coles')
+
+    def test_lookup_does_not_create(self):
+        self.assertIsNone(merchants.lookup('Nowhere'))
+        self.assertIsNone(merchants.lookup('!!'))
+        self.assertFalse(Merchant.objects.exists())
+
+    def test_invalid_names_are_rejected(self):
+        for name in ('', ' ... ', None, 42, 'x' * 101):
+            with self.assertRaises(InvalidName):
+                merchants.intern(name)
+        with self.assertRaises(InvalidName):
+            categories.intern('x' * 51)
+
+    def test_legacy_names_are_shortened_rather_than_rejected(self):
+        ids = intern_legacy(Merchant, ['Coles', 'COLES', 'x' * 150, '...'], using='default', batch_size=2)
+        self.assertEqual(ids['Coles'], ids['COLES'])
+        self.assertEqual(Merchant.objects.get(pk=ids['x' * 150]).name, 'x' * 100)
+        self.assertEqual(Merchant.objects.get(pk=ids['...']).key, '')
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from organisations.models import Organisation
+
+
+class Command(BaseCommand):
+    help = "Create an organisation, optionally storing its data in its own database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help="Display name of the organisation.")
+        parser.add_argument('slug', help="Identifier sent by clients in the X-Organisation header.")
+        parser.add_argument('--database', default='default', help="DATABASES alias holding the organisation's cards and transactions.")
+
+    def handle(self, *args, **options):
+        if options['database'] not in settings.DATABASES:
+            raise CommandError(f"Unknown database '{options['database']}'")
+        if Organisation.objects.filter(slug=options['slug']).exists():
+            raise CommandError(f"Organisation '{options['slug']}' already exists")
+        organisation = Organisation.objects.create(name=options['name'], slug=options['slug'], database=options['database'])
+        self.stdout.write(self.style.SUCCESS(f"Created organisation '{organisation.slug}' (ID {organisation.id}) on database '{organisation.database}'"))
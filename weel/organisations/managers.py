@@ -0,0 +1,28 @@
+from django.db import models
+
+from .tenancy import current_organisation
+
+
+class TenantQuerySet(models.QuerySet):
+    def for_organisation(self, organisation):
+        return self.filter(organisation_id=organisation.id)
+
+
+class TenantManager(models.Manager.from_queryset(TenantQuerySet)):
+    """
+    Default manager for tenant models: while an organisation is current (see
+    organisations.tenancy), every query is filtered to its rows. Use unscoped()
+    for the rare cross-organisation query.
+
+    Related-object deletes go through the model's base manager and stay unscoped.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        organisation = current_organisation()
+        if organisation is not None:
+            queryset = queryset.for_organisation(organisation)
+        return queryset
+
+    def unscoped(self):
+        return super().get_queryset()
@@ -0,0 +1,50 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import JsonResponse
+
+from .models import DEFAULT_ORGANISATION_SLUG, Organisation
+from .tenancy import get_organisation, use_organisation
+
+ORGANISATION_HEADER = 'X-Organisation'
+
+
+def _unknown_organisation(slug):
+    return JsonResponse({"error": f"Unknown organisation '{slug}'"}, status=404)
+
+
+class OrganisationMiddleware:
+    """
+    Act for the organisation named by the X-Organisation header (its slug) for the
+    rest of the request, or the default organisation when the header is absent.
+
+    Sync and async capable; under ASGI the organisation is looked up in a thread
+    (it may read the database) and the rest of the request runs in its context.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        slug = request.headers.get(ORGANISATION_HEADER) or DEFAULT_ORGANISATION_SLUG
+        try:
+            organisation = get_organisation(slug)
+        except Organisation.DoesNotExist:
+            return _unknown_organisation(slug)
+        request.organisation = organisation
+        with use_organisation(organisation):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        slug = request.headers.get(ORGANISATION_HEADER) or DEFAULT_ORGANISATION_SLUG
+        try:
+            organisation = await sync_to_async(get_organisation)(slug)
+        except Organisation.DoesNotExist:
+            return _unknown_organisation(slug)
+        request.organisation = organisation
+        with use_organisation(organisation):
+            return await self.get_response(request)
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+def create_default_organisation(apps, schema_editor):
+    Organisation = apps.get_model('organisations', 'Organisation')
+    Organisation.objects.get_or_create(id=1, defaults={'name': 'Default', 'slug': 'default'})
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Organisation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('slug', models.SlugField(unique=True)),
+                ('database', models.CharField(default='default', max_length=50)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(create_default_organisation, migrations.RunPython.noop),
+    ]
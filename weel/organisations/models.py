@@ -0,0 +1,20 @@
+from django.db import models
+
+# Created by the initial migration; rows written outside of any organisation belong to it
+DEFAULT_ORGANISATION_ID = 1
+DEFAULT_ORGANISATION_SLUG = 'default'
+
+
+class Organisation(models.Model):
+    """
+    A customer. Cards, their controls and transactions belong to one organisation,
+    and every query made on its behalf is scoped to it; see organisations.tenancy.
+    """
+    name = models.CharField(max_length=100)
+    slug = models.SlugField(max_length=50, unique=True)
+    # Alias in DATABASES holding this organisation's cards and transactions
+    database = models.CharField(max_length=50, default='default')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
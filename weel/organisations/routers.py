@@ -0,0 +1,51 @@
+from .models import Organisation
+from .tenancy import current_organisation
+
+# Models stored in each organisation's database. Card numbers come from a single
+# sequence in the default database so they stay unique across all of them.
+# Merchants and categories are shared by the organisations of a database, next
+# to the transactions and controls referring to them.
+TENANT_MODELS = {
+    'cards.card',
+    'cards.cardcontrol',
+    'cards.cardspend',
+    'transactions.transaction',
+    'transactions.transactiondecline',
+    'transactions.reversal',
+    'transactions.transactionarchive',
+    'transactions.archivedcardtotal',
+    'transactions.spendrollup',
+    'ledger.ledgerentry',
+    'ledger.balancesnapshot',
+    'merchants.merchant',
+    'merchants.merchantcategory',
+}
+
+
+class TenantRouter:
+    """
+    Route tenant models to the current organisation's database.
+
+    Everything else, including the organisations themselves and the task queue,
+    stays in the default database. Every alias gets the full schema so an
+    organisation can be moved between databases.
+    """
+
+    def _route(self, model, **hints):
+        if model._meta.label_lower not in TENANT_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        organisation = current_organisation()
+        return organisation.database if organisation is not None else None
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Tenant rows point at their organisation across databases (the foreign keys
+        # have no database constraint); anything else must share a database
+        if isinstance(obj1, Organisation) or isinstance(obj2, Organisation):
+            return True
+        return None
@@ -0,0 +1,10 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Organisation
+from .tenancy import invalidate_organisation
+
+
+@receiver([post_save, post_delete], sender=Organisation)
+def organisation_changed(sender, instance, **kwargs):
+    invalidate_organisation(instance.slug)
@@ -0,0 +1,80 @@
+"""
+The organisation a request or task is acting for.
+
+OrganisationMiddleware sets the current organisation for each request and the
+task queue sets it for each task. While one is set:
+
+- TenantManager filters every Card, CardControl and Transaction query to it,
+- new rows default to it (see current_organisation_id), and
+- TenantRouter sends tenant data to its database, so a large organisation can
+  be moved to its own database alias without touching the code that queries it.
+
+Outside of any organisation (management commands, the shell, migrations) queries
+are not scoped and new rows belong to the default organisation.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+_current = ContextVar('organisation', default=None)
+
+KEY_PREFIX = 'organisation'
+
+
+def current_organisation():
+    return _current.get()
+
+
+def current_organisation_id():
+    """
+    Default for the organisation of new tenant rows.
+    """
+    from .models import DEFAULT_ORGANISATION_ID
+    organisation = _current.get()
+    return organisation.id if organisation is not None else DEFAULT_ORGANISATION_ID
+
+
+@contextmanager
+def use_organisation(organisation):
+    """
+    Act for `organisation` (an Organisation, or None for no scoping) inside the block.
+    """
+    token = _current.set(organisation)
+    try:
+        yield organisation
+    finally:
+        _current.reset(token)
+
+
+def database_for(organisation):
+    return organisation.database if organisation is not None else 'default'
+
+
+def tenant_database():
+    """
+    The database alias holding the current organisation's data, for transaction.atomic(using=...).
+    """
+    return database_for(_current.get())
+
+
+def _cache():
+    return caches[getattr(settings, 'ORGANISATION_CACHE', 'default')]
+
+
+def get_organisation(slug):
+    """
+    Return the Organisation with `slug`, cached. Raises Organisation.DoesNotExist.
+    """
+    from .models import Organisation
+    key = f"{KEY_PREFIX}:{slug}"
+    organisation = _cache().get(key)
+    if organisation is None:
+        organisation = Organisation.objects.get(slug=slug)
+        _cache().set(key, organisation)
+    return organisation
+
+
+def invalidate_organisation(slug):
+    _cache().delete(f"{KEY_PREFIX}:{slug}")
@@ -0,0 +1,108 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.urls import reverse
+from cards.cache import get_card_state
+from cards.models import Card, CardControl, CardNumberSequence
+from taskqueue.models import Task
+from taskqueue.queue import run_pending
+from transactions.models import Transaction
+from .models import DEFAULT_ORGANISATION_ID, Organisation
+from .routers import TenantRouter
+from .tenancy import current_organisation, use_organisation
+from io import StringIO
+import json
+
+
+class OrganisationScopingTests(TestCase):
+    def setUp(self):
+        self.default = Organisation.objects.get(pk=DEFAULT_ORGANISATION_ID)
+        self.acme = Organisation.objects.create(name='Acme', slug='acme')
+        self.default_card = Card.objects.create(cardholder_name='Default User', expiration_date='2030-01-01', balance=100.00)
+        with use_organisation(self.acme):
+            self.acme_card = Card.objects.create(cardholder_name='Acme User', expiration_date='2030-01-01', balance=100.00)
+
+    def post_transaction(self, card, organisation=None):
+        data = {"card": card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"}
+        headers = {'X-Organisation': organisation.slug} if organisation else {}
+        return self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json", headers=headers)
+
+    def test_new_rows_belong_to_the_current_organisation(self):
+        self.assertEqual(self.default_card.organisation_id, DEFAULT_ORGANISATION_ID)
+        self.assertEqual(self.acme_card.organisation_id, self.acme.id)
+
+    def test_lists_only_show_the_requesting_organisation(self):
+        cards = self.client.get(reverse('cards'), headers={'X-Organisation': 'acme'}).json()['cards']
+        self.assertEqual([card['cardholder_name'] for card in cards], ['Acme User'])
+        cards = self.client.get(reverse('cards')).json()['cards']
+        self.assertEqual([card['cardholder_name'] for card in cards], ['Default User'])
+
+    def test_transactions_are_scoped(self):
+        self.assertEqual(self.post_transaction(self.acme_card, self.acme).status_code, 200)
+        self.assertEqual(Transaction.objects.get().organisation_id, self.acme.id)
+        self.assertEqual(len(self.client.get(reverse('transactions'), headers={'X-Organisation': 'acme'}).json()['transactions']), 1)
+        self.assertEqual(self.client.get(reverse('transactions')).json()['transactions'], [])
+
+    def test_cannot_use_another_organisations_card(self):
+        # Warm the card state cache as acme first; the cached state must not leak to other organisations
+        self.assertEqual(self.post_transaction(self.acme_card, self.acme).status_code, 200)
+        response = self.post_transaction(self.acme_card)
+        self.assertEqual(response.json()['reasons'], ["Card not found"])
+        with use_organisation(self.default), self.assertRaises(Card.DoesNotExist):
+            get_card_state(self.acme_card.id)
+
+    def test_cannot_control_another_organisations_card(self):
+        data = {"card_id": self.acme_card.id, "control_type": "merchant", "detail": "Coles"}
+        response = self.client.post(reverse('card-controls'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardControl.objects.exists())
+
+    def test_unknown_organisation(self):
+        response = self.client.get(reverse('cards'), headers={'X-Organisation': 'nobody'})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_requests_are_scoped(self):
+        data = {"card": self.acme_card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"}
+        post = lambda **headers: self.async_client.post(reverse('transactions-authorize'), json.dumps(data), content_type="application/json", headers=headers)
+        self.assertEqual((await post(**{'X-Organisation': 'acme'})).json()['status'], 'approved')
+        self.assertEqual((await post()).json()['reasons'], ["Card not found"])
+        self.assertEqual((await post(**{'X-Organisation': 'nobody'})).status_code, 404)
+        self.assertEqual(await Transaction.objects.unscoped().filter(organisation_id=self.acme.id).acount(), 1)
+
+    def test_tasks_run_for_the_enqueuing_organisation(self):
+        data = {"card": self.acme_card.id, "amount": "500.00", "merchant": "Woolworths", "merchant_category": "food"}
+        self.client.post(reverse('transactions-authorize'), json.dumps(data), content_type="application/json", headers={'X-Organisation': 'acme'})
+        self.assertEqual(set(Task.objects.values_list('organisation_id', flat=True)), {self.acme.id})
+        with self.assertLogs('weel.notifications', 'INFO'):
+            run_pending()
+        declined = Transaction.objects.get()
+        self.assertEqual(declined.organisation_id, self.acme.id)
+        self.assertEqual(declined.declines.get().organisation_id, self.acme.id)
+        self.assertIsNone(current_organisation())
+
+
+class TenantRouterTests(TestCase):
+    def setUp(self):
+        self.router = TenantRouter()
+        self.big = Organisation.objects.create(name='Big', slug='big', database='big')
+
+    def test_routes_tenant_models_to_the_organisations_database(self):
+        with use_organisation(self.big):
+            self.assertEqual(self.router.db_for_read(Card), 'big')
+            self.assertEqual(self.router.db_for_write(Transaction), 'big')
+            self.assertIsNone(self.router.db_for_write(Organisation))
+            self.assertIsNone(self.router.db_for_write(CardNumberSequence))
+            self.assertIsNone(self.router.db_for_write(Task))
+
+    def test_no_routing_outside_an_organisation(self):
+        self.assertIsNone(self.router.db_for_read(Card))
+
+
+class CreateOrganisationCommandTests(TestCase):
+    def test_create(self):
+        call_command('create_organisation', 'Acme', 'acme', stdout=StringIO())
+        self.assertEqual(Organisation.objects.get(slug='acme').database, 'default')
+
+    def test_unknown_database(self):
+        with self.assertRaises(CommandError):
+            call_command('create_organisation', 'Acme', 'acme', '--database', 'nowhere', stdout=StringIO())
@@ -0,0 +1,54 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from taskqueue.queue import run_pending, work
+
+
+def _worker_main(batch_size, poll_interval, stop):
+    django.setup()
+    # The parent handles Ctrl-C and tells workers to stop through the event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    work(batch_size=batch_size, poll_interval=poll_interval, stop=stop)
+
+
+class Command(BaseCommand):
+    help = "Run worker processes that execute queued background tasks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2, help="Worker processes to start.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Tasks claimed per batch.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue in this process and exit.")
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--processes and --batch-size must be positive")
+
+        if options['once']:
+            total = 0
+            while count := run_pending(batch_size=options['batch_size']):
+                total += count
+            self.stdout.write(f"Ran {total} tasks")
+            return
+
+        # Children must open their own database connections
+        connections.close_all()
+        stop = multiprocessing.Event()
+        workers = [
+            multiprocessing.Process(target=_worker_main, args=(options['batch_size'], options['poll_interval'], stop), daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for process in workers:
+            process.start()
+        self.stdout.write(f"Started {len(workers)} task workers")
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for process in workers:
+                process.join()
@@ -0,0 +1,123 @@
+"""
+A database-backed queue for work that should stay off the request path.
+
+Handlers register with the @task decorator (in a `tasks` module of their app,
+which is imported at startup), callers add work with enqueue() and the
+run_task_workers management command runs worker processes that claim due tasks
+in batches. A task enqueued inside a database transaction is only visible to
+workers once that transaction commits. Tasks run for the organisation that was
+current when they were enqueued (see organisations.tenancy).
+"""
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from organisations.tenancy import current_organisation, database_for, use_organisation
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+_handlers = {}
+
+
+def task(name):
+    """
+    Register the decorated function as the handler for tasks called `name`.
+    Handlers receive the enqueued payload as keyword arguments.
+    """
+    def register(func):
+        _handlers[name] = func
+        return func
+    return register
+
+
+def enqueue(name, delay=None, **payload):
+    """
+    Queue a call to the `name` handler with `payload`, which must be JSON serializable
+    (Decimals, dates and datetimes arrive as strings).
+
+    With TASK_QUEUE_EAGER set the handler runs immediately instead.
+    """
+    if name not in _handlers:
+        raise LookupError(f"No task handler registered for '{name}'")
+    if getattr(settings, 'TASK_QUEUE_EAGER', False):
+        _handlers[name](**payload)
+        return None
+    return Task.objects.create(name=name, payload=payload, organisation=current_organisation(), run_after=timezone.now() + (delay or timedelta()))
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker, batch_size):
+    """
+    Claim up to `batch_size` due tasks for `worker`.
+
+    Tasks are claimed with a conditional UPDATE from queued to running, so two workers
+    racing for the same rows never both get them. Tasks left running by a worker
+    that died are put back on the queue after CLAIM_TIMEOUT.
+    """
+    now = timezone.now()
+    Task.objects.filter(status=Task.RUNNING, claimed_at__lt=now - CLAIM_TIMEOUT).update(status=Task.QUEUED, claimed_by='')
+    ids = list(Task.objects.filter(status=Task.QUEUED, run_after__lte=now).order_by('run_after', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    Task.objects.filter(id__in=ids, status=Task.QUEUED).update(status=Task.RUNNING, claimed_by=worker, claimed_at=now, attempts=F('attempts') + 1)
+    return list(Task.objects.filter(id__in=ids, status=Task.RUNNING, claimed_by=worker, claimed_at=now).select_related('organisation'))
+
+
+def run_task(task):
+    """
+    Run one claimed task. Successful tasks are deleted; failed ones are retried with
+    exponential backoff until MAX_ATTEMPTS, then kept as failed for inspection.
+    """
+    try:
+        handler = _handlers[task.name]
+        database = database_for(task.organisation)
+        with use_organisation(task.organisation), transaction.atomic(using=database), transaction.atomic():
+            handler(**task.payload)
+            task.delete()
+        return True
+    except Exception as e:
+        logger.exception("Task %s (%s) failed on attempt %d", task.id, task.name, task.attempts)
+        task.last_error = repr(e)
+        if task.attempts >= MAX_ATTEMPTS or task.name not in _handlers:
+            task.status = Task.FAILED
+        else:
+            task.status = Task.QUEUED
+            task.run_after = timezone.now() + timedelta(seconds=2 ** task.attempts)
+        task.save(update_fields=['status', 'run_after', 'last_error'])
+        return False
+
+
+def run_pending(worker=None, batch_size=100):
+    """
+    Claim and run one batch of due tasks. Returns the number of tasks claimed.
+    """
+    tasks = claim(worker or worker_id(), batch_size)
+    for claimed in tasks:
+        run_task(claimed)
+    return len(tasks)
+
+
+def work(batch_size=100, poll_interval=1.0, stop=None):
+    """
+    Run batches until `stop` (a threading/multiprocessing Event) is set, sleeping
+    for `poll_interval` seconds whenever the queue is empty.
+    """
+    worker = worker_id()
+    while not (stop and stop.is_set()):
+        close_old_connections()
+        if not run_pending(worker, batch_size):
+            time.sleep(poll_interval)
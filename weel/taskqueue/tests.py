@@ -0,0 +1,69 @@
+from datetime import timedelta
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import Task
+from .queue import MAX_ATTEMPTS, claim, enqueue, run_pending, task
+
+calls = []
+
+
+@task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task('tests.fail')
+def fail():
+    raise RuntimeError("boom")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_task_runs_once_and_is_deleted(self):
+        enqueue('tests.record', value=1)
+        self.assertEqual(calls, [])
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(run_pending(), 0)
+
+    def test_delayed_task_waits(self):
+        enqueue('tests.record', delay=timedelta(minutes=1), value=1)
+        self.assertEqual(run_pending(), 0)
+
+    def test_claimed_tasks_are_not_claimed_again(self):
+        enqueue('tests.record', value=1)
+        self.assertEqual(len(claim('worker-1', 10)), 1)
+        self.assertEqual(claim('worker-2', 10), [])
+
+    def test_abandoned_claims_are_requeued(self):
+        enqueue('tests.record', value=1)
+        claim('worker-1', 10)
+        Task.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(claim('worker-2', 10)), 1)
+
+    def test_failing_task_backs_off_then_fails(self):
+        enqueue('tests.fail')
+        with self.assertLogs('taskqueue.queue', 'ERROR'):
+            run_pending()
+        failed = Task.objects.get()
+        self.assertEqual((failed.status, failed.attempts), (Task.QUEUED, 1))
+        self.assertGreater(failed.run_after, timezone.now())
+
+        Task.objects.update(attempts=MAX_ATTEMPTS - 1, run_after=timezone.now())
+        with self.assertLogs('taskqueue.queue', 'ERROR'):
+            run_pending()
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+        self.assertIn("boom", Task.objects.get().last_error)
+
+    def test_unknown_task(self):
+        with self.assertRaises(LookupError):
+            enqueue('tests.missing')
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_mode_runs_inline(self):
+        enqueue('tests.record', value=2)
+        self.assertEqual(calls, [2])
+        self.assertFalse(Task.objects.exists())
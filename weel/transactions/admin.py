@@ -1,3 +1,44 @@
 from django.contrib import admin
 
-# Register your models here.
+from organisations.admin import TenantAdminMixin
+from weel.admin import DateRangeHierarchyMixin, EstimatedCountPaginator
+from .models import Transaction, TransactionDecline
+
+
+class TransactionDeclineInline(admin.TabularInline):
+    model = TransactionDecline
+    fields = ('code', 'control')
+    readonly_fields = fields
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Transaction)
+class TransactionAdmin(DateRangeHierarchyMixin, TenantAdminMixin, admin.ModelAdmin):
+    """
+    Read-only: transactions are records of authorizations and are paired with ledger entries.
+    """
+    list_display = ('id', 'timestamp', 'card', 'organisation', 'amount', 'merchant', 'merchant_category', 'approved')
+    list_select_related = ('card', 'organisation', 'merchant', 'merchant_category')
+    # approved=False is served by transaction_declined_idx
+    list_filter = ('approved', 'organisation')
+    search_fields = ('card__card_number__exact',)
+    date_hierarchy = 'timestamp'
+    # The order of transaction_time_idx, so pages need no sort
+    ordering = ('-timestamp', '-id')
+    fields = ('card', 'organisation', 'amount', 'merchant', 'merchant_category', 'approved', 'timestamp', 'idempotency_key')
+    readonly_fields = fields
+    inlines = (TransactionDeclineInline,)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
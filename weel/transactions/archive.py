@@ -0,0 +1,217 @@
+"""
+Archival of old transactions to compressed monthly files.
+
+archive_transactions moves every whole month of an organisation's transactions
+older than the retention horizon out of the Transaction table, so the table and
+its indexes only hold recent history. Each month becomes one gzipped NDJSON file
+under TRANSACTION_ARCHIVE_DIR, one line per transaction in the shape the history
+API returns, newest first, and a TransactionArchive row.
+
+A month is archived in three steps, each safe to interrupt and re-run:
+
+1. its transactions are streamed to a temporary file, which is renamed into
+   place once complete,
+2. the TransactionArchive row and an ArchivedCardTotal for every card with a
+   transaction in the month are created,
+3. the transactions and their declines are deleted in batches.
+
+The history API reads the archive once the hot table runs out of matching rows
+(see archived_history), so clients page through both without noticing the
+boundary; a card's history only opens the months with an ArchivedCardTotal for it.
+Ledger entries keep the IDs of archived transactions; the ledger check counts
+archived purchases through the ArchivedCardTotals.
+"""
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from organisations.tenancy import current_organisation_id, tenant_database
+from weel.pagination import InvalidCursor
+from weel.serialization import dumps
+from .models import ArchivedCardTotal, Transaction, TransactionArchive, TransactionDecline
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_RETENTION_DAYS = 365
+
+
+@dataclass
+class ArchiveResult:
+    months: int = 0
+    transactions: int = 0
+    seconds: float = 0.0
+
+
+def archive_dir():
+    return Path(getattr(settings, 'TRANSACTION_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _utc(month):
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def month_transactions(month):
+    """
+    The current organisation's hot transactions in `month`, a date on the first of the month.
+    """
+    return Transaction.objects.filter(timestamp__gte=_utc(month), timestamp__lt=_utc(next_month(month)))
+
+
+def _write(path, month, batch_size):
+    # Imported here as the views read the archive through this module
+    from .views import TRANSACTION_ORDERING, TRANSACTION_SERIALIZER, serialize_transactions
+
+    selection = TRANSACTION_SERIALIZER.select()
+    rows = month_transactions(month).order_by(*TRANSACTION_ORDERING).values_list(*selection.columns).iterator(chunk_size=batch_size)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+    count = 0
+    with open(partial, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+            while chunk := list(islice(rows, batch_size)):
+                compressed.write(b''.join(dumps(item) + b'\n' for item in serialize_transactions(selection, chunk)))
+                count += len(chunk)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+    return count
+
+
+def _money(value):
+    # Sums come back as floats or integers on SQLite
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def archive_month(month, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move the current organisation's transactions in `month` to its archive file, resuming
+    an interrupted run. Returns the number of transactions removed from the table.
+    """
+    using = tenant_database()
+    archive = TransactionArchive.objects.filter(month=month).first()
+    if archive is None:
+        organisation_id = current_organisation_id()
+        relative = f"{using}/{organisation_id}/transactions-{month:%Y-%m}.ndjson.gz"
+        count = _write(archive_dir() / relative, month, batch_size)
+        # Cards with only declined transactions get a row too, so their history finds the month
+        approved = Q(approved=True)
+        totals = month_transactions(month).order_by().values('card').annotate(count=Count('id', filter=approved), total=Sum('amount', filter=approved))
+        with db_transaction.atomic(using=using):
+            archive = TransactionArchive.objects.create(organisation_id=organisation_id, month=month, path=relative, transactions=count)
+            ArchivedCardTotal.objects.bulk_create([
+                ArchivedCardTotal(
+                    organisation_id=organisation_id, archive=archive, card_id=row['card'],
+                    approved_count=row['count'], approved_total=_money(row['total']),
+                )
+                for row in totals
+            ], batch_size=batch_size)
+
+    removed = 0
+    while ids := list(month_transactions(month).order_by().values_list('pk', flat=True)[:batch_size]):
+        with db_transaction.atomic(using=using):
+            TransactionDecline.objects.filter(transaction_id__in=ids).delete()
+            # Ledger entries keep the IDs of archived transactions (DO_NOTHING, no constraint)
+            Transaction.objects.filter(pk__in=ids).delete()
+        removed += len(ids)
+    return removed
+
+
+def archive_transactions(older_than_days=None, batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """
+    Archive every whole month of the current organisation's transactions that ended more
+    than `older_than_days` (default TRANSACTION_RETENTION_DAYS) ago. Returns an ArchiveResult.
+    """
+    started = time.perf_counter()
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'TRANSACTION_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    horizon = month_start((now or timezone.now()) - timedelta(days=older_than_days))
+    result = ArchiveResult()
+    oldest = Transaction.objects.filter(timestamp__lt=_utc(horizon)).order_by('timestamp').values_list('timestamp', flat=True).first()
+    month = month_start(oldest.astimezone(dt_timezone.utc)) if oldest else horizon
+    while month < horizon:
+        if month_transactions(month).exists():
+            result.transactions += archive_month(month, batch_size)
+            result.months += 1
+        month = next_month(month)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def _position(values):
+    # The (timestamp, id) of a history row, or as decoded from a client's cursor
+    try:
+        timestamp, id = values
+        if isinstance(timestamp, str):
+            timestamp = parse_datetime(timestamp)
+        id = int(id)
+    except (TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(timestamp, datetime) or timezone.is_naive(timestamp):
+        raise InvalidCursor("Invalid cursor")
+    return timestamp, id
+
+
+def _matches(item, timestamp, filters):
+    return (
+        ('card_id' not in filters or item['card_id'] == filters['card_id'])
+        and ('approved' not in filters or item['approved'] == filters['approved'])
+        and ('timestamp__gte' not in filters or timestamp >= filters['timestamp__gte'])
+        and ('timestamp__lt' not in filters or timestamp < filters['timestamp__lt'])
+    )
+
+
+def archived_history(filters, after=None):
+    """
+    Yield the current organisation's archived transactions matching the history `filters`
+    (see transactions.views.history_filters), newest first, as dicts of every history
+    field. `after` is the (timestamp, id) of the last transaction already returned;
+    InvalidCursor is raised for one that is not an aware timestamp and an ID.
+
+    Only the months that can hold matching transactions are opened, and each is read
+    as a stream. For one card, those are the months with an ArchivedCardTotal for it
+    (with approved transactions, if only those are wanted), so a card's archived history
+    costs a read of the months it was used in rather than of every month.
+    """
+    after = _position(after) if after is not None else None
+    archives = TransactionArchive.objects.order_by('-month').values_list('month', 'path')
+    if 'timestamp__gte' in filters:
+        archives = archives.filter(month__gte=month_start(filters['timestamp__gte'].astimezone(dt_timezone.utc)))
+    upper = min(
+        (value for value in (filters.get('timestamp__lt'), after and after[0]) if value is not None),
+        default=None,
+    )
+    if upper is not None:
+        archives = archives.filter(month__lte=upper.astimezone(dt_timezone.utc).date())
+    if 'card_id' in filters:
+        totals = ArchivedCardTotal.objects.filter(card_id=filters['card_id'])
+        if filters.get('approved') is True:
+            totals = totals.filter(approved_count__gt=0)
+        archives = archives.filter(pk__in=totals.values('archive_id'))
+    for month, path in archives:
+        with gzip.open(archive_dir() / path, 'rb') as lines:
+            for line in lines:
+                item = json.loads(line)
+                timestamp = parse_datetime(item['timestamp'])
+                if after is not None and (timestamp, item['id']) >= after:
+                    continue
+                if _matches(item, timestamp, filters):
+                    yield item
@@ -0,0 +1,173 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models.functions import Coalesce
+
+from cards.declines import ControlRef, Decline, DeclineCode
+from cards.expiry import is_expired
+from cards.models import Card
+from cards.velocity import get_usage, record_spend
+from ledger.balances import balance_expression, debit
+from merchants.interning import InvalidName, categories, merchants
+from organisations.tenancy import tenant_database
+from .models import Transaction, TransactionDecline
+
+_amount_field = Transaction._meta.get_field('amount')
+# Amounts are whole cents and must fit Transaction.amount
+CENT = Decimal('0.01')
+MAX_AMOUNT = Decimal(10) ** (_amount_field.max_digits - _amount_field.decimal_places) - CENT
+
+
+class InvalidTransaction(ValueError):
+    pass
+
+
+def parse_transaction(data):
+    """
+    Pull the authorization fields out of a transaction request body.
+
+    Returns (card_id, amount, merchant, merchant_category) with `amount` as a Decimal and
+    whitespace runs in the names collapsed; see lookup_names for their IDs. The amount must
+    be positive, in whole cents and at most MAX_AMOUNT.
+    """
+    if not isinstance(data, dict):
+        raise InvalidTransaction("Expected a JSON object")
+    try:
+        card_id, amount, merchant, merchant_category = data['card'], data['amount'], data['merchant'], data['merchant_category']
+    except KeyError as e:
+        raise InvalidTransaction(f"Missing field {e}")
+    try:
+        card_id = int(card_id)
+    except (TypeError, ValueError):
+        raise InvalidTransaction(f"Invalid card '{card_id}'")
+    try:
+        parsed = Decimal(str(amount))
+    except (TypeError, ValueError, InvalidOperation):
+        raise InvalidTransaction(f"Invalid amount '{amount}'")
+    if not parsed.is_finite() or not 0 < parsed <= MAX_AMOUNT or parsed != parsed.quantize(CENT):
+        raise InvalidTransaction(f"Invalid amount '{amount}'")
+    amount = parsed.quantize(CENT)
+    try:
+        merchant, _ = merchants.clean(merchant)
+        merchant_category, _ = categories.clean(merchant_category)
+    except InvalidName as e:
+        raise InvalidTransaction(str(e))
+    return card_id, amount, merchant, merchant_category
+
+
+def lookup_names(merchant, merchant_category):
+    """
+    Return the (merchant ID, merchant category ID) of a parsed transaction to decide it on,
+    without creating anything: None for a name never interned, which no control can name.
+    """
+    return merchants.lookup(merchant), categories.lookup(merchant_category)
+
+
+def intern_names(merchant, merchant_category):
+    """
+    Return the (merchant ID, merchant category ID) of a parsed transaction being written,
+    creating the Merchant and MerchantCategory rows of names not seen before (see
+    merchants.interning). Only called with the Transaction's write, so attempts that are
+    never recorded leave no rows behind.
+    """
+    return merchants.intern(merchant), categories.intern(merchant_category)
+
+
+def approved_result(transaction_id):
+    return {"status": "approved", "message": "Transaction approved", "transaction_id": transaction_id}
+
+
+def declined_result(reasons, error="Transaction declined"):
+    return {"status": "declined", "error": error, "reasons": reasons}
+
+
+def decline_reasons(balance, is_active, expiration_date, compiled, amount, merchant_id, merchant_category_id, today=None):
+    """
+    Apply the approval rules to a transaction and return the Declines it fails, empty if approved.
+
+    `balance` is the balance the card would be debited from, or None to leave the funds
+    check to the debit itself, and `compiled` is the card's CompiledControls. Cards are
+    valid through their expiration date, compared with `today` (default: the current date).
+    The merchant and category are given by their interned IDs, see lookup_names.
+    """
+    reasons = []
+    if balance is not None and (balance < amount or balance == 0):
+        reasons.append(Decline(DeclineCode.INSUFFICIENT_FUNDS))
+    if not is_active:
+        reasons.append(Decline(DeclineCode.CARD_INACTIVE))
+    if is_expired(expiration_date, today):
+        reasons.append(Decline(DeclineCode.CARD_EXPIRED))
+    reasons.extend(compiled.evaluate(amount, merchant_id, merchant_category_id))
+    return reasons
+
+
+def approve(approved, controls):
+    """
+    Save the unsaved, approved Transaction `approved`, debit the card's ledger for it and add
+    it to the card's rolling spend counters as one unit.
+
+    Returns False, with nothing written and `approved` left unsaved, if the debit is refused
+    (insufficient funds or an inactive card) or a rolling limit in `controls` would be exceeded.
+    """
+    database = tenant_database()
+    with transaction.atomic(using=database):
+        if record_spend(approved.card_id, approved.amount, limits=controls.velocity_limits):
+            approved.save()
+            if debit(approved.card_id, approved.amount, transaction=approved, organisation_id=approved.organisation_id):
+                return True
+        transaction.set_rollback(True, using=database)
+    approved.pk = None
+    return False
+
+
+def current_decline_reasons(card_id, controls, amount, merchant_id, merchant_category_id):
+    """
+    Build the full list of Declines from the card's current row and spend counters.
+
+    Used once a transaction is known to be declined, so the hot approval path never has
+    to read the balance or the counters.
+    """
+    card = Card.objects.filter(pk=card_id).annotate(current_balance=balance_expression())
+    is_active, expiration_date, balance = card.values_list('is_active', 'expiration_date', 'current_balance').get()
+    reasons = decline_reasons(balance, is_active, expiration_date, controls, amount, merchant_id, merchant_category_id)
+    if controls.limits:
+        reasons.extend(controls.evaluate_velocity(amount, get_usage([card_id])[card_id]))
+    # The counters or balance may have moved again since the approval was refused
+    return reasons or [Decline(DeclineCode.INSUFFICIENT_FUNDS)]
+
+
+def decline_rows(transaction, declines):
+    """
+    Build the TransactionDecline rows recording `declines` of a saved `transaction`,
+    one per code and control.
+    """
+    return [
+        TransactionDecline(transaction=transaction, organisation_id=transaction.organisation_id, code=code, control_id=control.id)
+        for code, controls in declines
+        for control in controls
+    ] + [
+        TransactionDecline(transaction=transaction, organisation_id=transaction.organisation_id, code=code)
+        for code, controls in declines
+        if not controls
+    ]
+
+
+def load_declines(transaction_ids):
+    """
+    Return {transaction_id: [Decline]} for the given transactions, with one query.
+    Declines come back in code order.
+    """
+    declines = {}
+    rows = (
+        TransactionDecline.objects.filter(transaction_id__in=transaction_ids)
+        .order_by('transaction_id', 'code', 'id')
+        .annotate(detail=Coalesce('control__merchant_category__name', 'control__merchant__name'))
+        .values_list('transaction_id', 'code', 'control_id', 'control__control_type', 'detail', 'control__amount')
+    )
+    for transaction_id, code, control_id, control_type, detail, amount in rows:
+        reasons = declines.setdefault(transaction_id, [])
+        if not reasons or reasons[-1].code != code:
+            reasons.append(Decline(code))
+        if control_id is not None:
+            reasons[-1] = Decline(code, reasons[-1].controls + (ControlRef(control_id, control_type, detail, amount),))
+    return declines
@@ -0,0 +1,107 @@
+"""
+Idempotency keys for transaction authorization.
+
+A client retrying a POST to transactions/ or transactions/authorize/ (e.g. after
+a timeout) sends the same Idempotency-Key header with every attempt. The first
+attempt stores the key on its Transaction, where the transaction_idempotency_key constraint keeps it
+unique per organisation, and a retry gets the original result back without the
+controls being evaluated or the card debited again.
+
+Results are also cached for IDEMPOTENCY_CACHE_TIMEOUT seconds under
+IDEMPOTENCY_CACHE (the 'default' cache unless configured), so a storm of retries
+is answered from memory. After that the result is rebuilt from the stored
+transaction with one indexed lookup. A retry may spell the merchant and category
+differently, as long as they normalize to the same names (see merchants.interning).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from cards.declines import describe_all
+from merchants.interning import normalize
+from organisations.tenancy import current_organisation_id, tenant_database
+from .authorization import InvalidTransaction, approved_result, declined_result, load_declines
+from .models import Transaction
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = Transaction._meta.get_field('idempotency_key').max_length
+KEY_PREFIX = 'idempotency'
+DEFAULT_TIMEOUT = 600
+
+
+class IdempotencyConflict(ValueError):
+    """
+    An idempotency key was reused for a different transaction.
+    """
+
+
+def _cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE', 'default')]
+
+
+def _cache_key(key):
+    # Client keys may hold characters some cache backends reject in keys
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f"{KEY_PREFIX}:{tenant_database()}:{current_organisation_id()}:{digest}"
+
+
+def get_key(request):
+    """
+    Return the request's idempotency key, or None if it has none. Raises InvalidTransaction
+    for an empty, overlong or non-printable key.
+    """
+    key = request.headers.get(HEADER)
+    if key is not None and not (0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()):
+        raise InvalidTransaction(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} printable characters")
+    return key
+
+
+def _fingerprint(request):
+    card_id, amount, merchant, merchant_category = request
+    return card_id, amount, normalize(merchant), normalize(merchant_category)
+
+
+def _store(key, fingerprint, result, status):
+    _cache().set(_cache_key(key), (fingerprint, result, status), getattr(settings, 'IDEMPOTENCY_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def remember(key, request, result, status):
+    """
+    Cache the response to the first attempt with `key`. `request` is the parsed
+    (card_id, amount, merchant, merchant_category) it was for.
+    """
+    _store(key, _fingerprint(request), result, status)
+
+
+def _stored(key):
+    rows = list(
+        Transaction.objects.filter(idempotency_key=key)
+        .values_list('id', 'card_id', 'amount', 'merchant__name', 'merchant__key', 'merchant_category__name', 'merchant_category__key', 'approved')[:1]
+    )
+    if not rows:
+        return None
+    transaction_id, card_id, amount, merchant, merchant_key, merchant_category, merchant_category_key, approved = rows[0]
+    if approved:
+        result, status = approved_result(transaction_id), 200
+    else:
+        declines = load_declines([transaction_id]).get(transaction_id, ())
+        result, status = declined_result(describe_all(declines, amount, merchant, merchant_category)), 400
+    return (card_id, amount, merchant_key, merchant_category_key), result, status
+
+
+def recall(key, request):
+    """
+    Return (result, status) of the earlier attempt with `key`, or None if there was none.
+    Raises IdempotencyConflict if that attempt was for a different `request`.
+    """
+    stored = _cache().get(_cache_key(key))
+    if stored is None:
+        stored = _stored(key)
+        if stored is None:
+            return None
+        _store(key, *stored)
+    original, result, status = stored
+    if original != _fingerprint(request):
+        raise IdempotencyConflict(f"{HEADER} '{key}' was already used for a different transaction")
+    return result, status
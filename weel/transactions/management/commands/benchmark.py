@@ -0,0 +1,247 @@
+import json
+import logging
+import random
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from cards.issuance import issue_cards
+from organisations.middleware import ORGANISATION_HEADER
+from organisations.models import DEFAULT_ORGANISATION_SLUG, Organisation
+from organisations.tenancy import get_organisation, use_organisation
+
+MERCHANTS = ['Woolworths', 'Coles', 'Aldi', 'Amazon', 'Target', 'Kmart', 'Bunnings', 'JB Hi-Fi']
+CATEGORIES = ['5411', '5311', '5732', '5912']
+CONTROL_CYCLE = ['max_amount', 'min_amount', 'merchant', 'category']
+
+
+def control_templates(count):
+    """
+    Build `count` control templates cycling through every control type, widening
+    the allowed merchant and category sets as the count grows.
+    """
+    templates = []
+    for i in range(count):
+        control_type = CONTROL_CYCLE[i % len(CONTROL_CYCLE)]
+        if control_type == 'max_amount':
+            templates.append({'control_type': control_type, 'amount': 500 - i})
+        elif control_type == 'min_amount':
+            templates.append({'control_type': control_type, 'amount': 1})
+        elif control_type == 'merchant':
+            templates.append({'control_type': control_type, 'detail': MERCHANTS[(i // len(CONTROL_CYCLE)) % len(MERCHANTS)]})
+        else:
+            templates.append({'control_type': control_type, 'detail': CATEGORIES[(i // len(CONTROL_CYCLE)) % len(CATEGORIES)]})
+    return templates
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, wall_time, queries, statuses):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "wall_seconds": round(wall_time, 4),
+        "throughput_rps": round(len(latencies) / wall_time, 1) if wall_time else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "statuses": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed cards with controls and benchmark the transaction authorization and list endpoints, "
+        "either in-process through the test client or against a running server, and report "
+        "latency percentiles, throughput and queries per request as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=100, help="Cards to seed.")
+        parser.add_argument('--controls', type=int, default=4, help="Controls per seeded card.")
+        parser.add_argument('--requests', type=int, default=1000, help="Authorization requests to send.")
+        parser.add_argument('--list-requests', type=int, default=50, help="Requests to send to each list endpoint.")
+        parser.add_argument('--page-size', type=int, help="`limit` sent to the list endpoints; their default page size when omitted.")
+        parser.add_argument('--url', help="Base URL of a running server, e.g. http://127.0.0.1:8000. Runs in-process when omitted.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Parallel clients when benchmarking a running server.")
+        parser.add_argument('--current-database', action='store_true', help="Run in-process against the configured database instead of a throwaway test database.")
+        parser.add_argument('--organisation', default=DEFAULT_ORGANISATION_SLUG, help="Slug of the organisation to seed cards for and send requests as.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the generated traffic.")
+        parser.add_argument('--output', help="Write the JSON results to this file as well as stdout.")
+
+    def handle(self, *args, **options):
+        if options['cards'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--cards and --concurrency must be positive")
+        self.random = random.Random(options['seed'])
+        # Declines are logged as 4xx warnings by django.request; don't flood the output with them
+        request_logger = logging.getLogger('django.request')
+        log_level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            scenarios = self.run(options)
+        finally:
+            request_logger.setLevel(log_level)
+
+        results = {
+            "meta": {
+                "revision": git_revision(),
+                "started": datetime.now(timezone.utc).isoformat(),
+                "mode": "remote" if options['url'] else "in-process",
+                **{key: options[key] for key in ('cards', 'controls', 'requests', 'list_requests', 'page_size', 'concurrency', 'organisation', 'seed')},
+            },
+            "scenarios": scenarios,
+        }
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def run(self, options):
+        if options['url']:
+            return self.run_remote(options)
+        if options['current_database']:
+            return self.run_in_process(options)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            return self.run_in_process(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def transaction_payloads(self, card_ids, templates, count):
+        """
+        Generate authorization requests that mostly satisfy the seeded controls,
+        with roughly one in ten drawn from outside the allowed merchants and categories.
+        """
+        merchants = [t['detail'] for t in templates if t['control_type'] == 'merchant'] or MERCHANTS
+        categories = [t['detail'] for t in templates if t['control_type'] == 'category'] or CATEGORIES
+        payloads = []
+        for _ in range(count):
+            allowed = self.random.random() >= 0.1
+            payloads.append({
+                "card": self.random.choice(card_ids),
+                "amount": f"{self.random.uniform(1, 150):.2f}",
+                "merchant": self.random.choice(merchants if allowed else MERCHANTS),
+                "merchant_category": self.random.choice(categories if allowed else CATEGORIES),
+            })
+        return payloads
+
+    def list_urls(self, options):
+        """
+        The list endpoints to measure, including the card list narrowed with `fields`.
+        """
+        limit = f"limit={options['page_size']}&" if options['page_size'] else ""
+        return [
+            ('cards_list', f"{reverse('cards')}?{limit}"),
+            ('cards_list_fields', f"{reverse('cards')}?{limit}fields=card_number,balance"),
+            ('card_controls_list', f"{reverse('card-controls')}?{limit}"),
+            ('transactions_list', f"{reverse('transactions')}?{limit}"),
+        ]
+
+    def seed_rows(self, count):
+        return [{"cardholder_name": f"Benchmark {i}", "expiration_date": str(date(date.today().year + 3, 1, 1)), "balance": 1000000} for i in range(count)]
+
+    # In-process
+
+    def run_in_process(self, options):
+        try:
+            organisation = get_organisation(options['organisation'])
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+        templates = control_templates(options['controls'])
+        with use_organisation(organisation):
+            card_ids = issue_cards(self.seed_rows(options['cards']), templates).card_ids
+        client = Client(headers={ORGANISATION_HEADER: organisation.slug})
+        scenarios = {}
+
+        payloads = [json.dumps(payload) for payload in self.transaction_payloads(card_ids, templates, options['requests'])]
+        scenarios['transactions_post'] = self.measure_in_process(
+            lambda body: client.post(reverse('transactions'), body, content_type="application/json"), payloads)
+        for name, url in self.list_urls(options):
+            scenarios[name] = self.measure_in_process(lambda _: client.get(url), range(options['list_requests']))
+        return scenarios
+
+    def measure_in_process(self, send, inputs):
+        latencies, queries, statuses = [], [], []
+        started = time.perf_counter()
+        for value in inputs:
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = send(value)
+                latencies.append(time.perf_counter() - request_started)
+            queries.append(len(captured))
+            statuses.append(response.status_code)
+        return summarize(latencies, time.perf_counter() - started, queries, statuses)
+
+    # Running server
+
+    def run_remote(self, options):
+        base = options['url'].rstrip('/')
+        templates = control_templates(options['controls'])
+        self.organisation = options['organisation']
+        status, body = self.request(base + reverse('cards-bulk'), {"cards": self.seed_rows(options['cards']), "controls": templates})
+        if status != 201:
+            raise CommandError(f"Seeding cards failed with {status}: {body[:200]}")
+        card_ids = json.loads(body)['card_ids']
+
+        scenarios = {}
+        payloads = self.transaction_payloads(card_ids, templates, options['requests'])
+        scenarios['transactions_post'] = self.measure_remote(lambda payload: self.request(base + reverse('transactions'), payload), payloads, options['concurrency'])
+        for name, path in self.list_urls(options):
+            scenarios[name] = self.measure_remote(lambda _: self.request(base + path), range(options['list_requests']), options['concurrency'])
+        return scenarios
+
+    def request(self, url, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        headers = {ORGANISATION_HEADER: self.organisation}
+        if data:
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url, data=data, headers=headers)
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def measure_remote(self, send, inputs, concurrency):
+        def timed(value):
+            request_started = time.perf_counter()
+            status, _ = send(value)
+            return time.perf_counter() - request_started, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(timed, inputs))
+        # Query counts are not visible from outside the server process
+        return summarize([latency for latency, _ in timings], time.perf_counter() - started, [], [status for _, status in timings])
@@ -0,0 +1,49 @@
+import csv
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from organisations.models import Organisation
+from organisations.tenancy import get_organisation, use_organisation
+from transactions.reversals import DEFAULT_BATCH_SIZE, ingest_settlement
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the reversals, refunds and partial captures in a settlement file: a CSV with the "
+        "columns transaction, kind, amount and reference (see transactions.reversals.parse_reversal). "
+        "Rows already applied are skipped, so a file can be ingested again after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The settlement file, or - for standard input.")
+        parser.add_argument('--organisation', help="Slug of the organisation the file is for; transactions in the default database if omitted.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Rows applied per database transaction.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            organisation = get_organisation(options['organisation']) if options['organisation'] else None
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+
+        try:
+            file = nullcontext(sys.stdin) if options['path'] == '-' else open(options['path'], newline='')
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e.strerror}")
+        with file as lines, use_organisation(organisation) if organisation else nullcontext():
+            reader = csv.DictReader(lines)
+            rows = ((reader.line_num, row) for row in reader)
+            result = ingest_settlement(rows, batch_size=options['batch_size'])
+
+        for line, error in result.rejected:
+            self.stdout.write(f"Line {line}: {error}")
+        rows = result.applied + result.replayed + len(result.rejected)
+        self.stdout.write(self.style.SUCCESS(
+            f"Applied {result.applied} reversals returning {result.total} and skipped {result.replayed} already applied "
+            f"of {rows} rows in {result.seconds:.3f}s ({rows / max(result.seconds, 1e-6):.0f} rows/s)"
+        ))
+        if result.rejected:
+            raise CommandError(f"Rejected {len(result.rejected)} rows")
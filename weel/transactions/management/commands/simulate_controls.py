@@ -0,0 +1,58 @@
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from organisations.models import Organisation
+from organisations.tenancy import get_organisation, use_organisation
+from transactions.simulation import DEFAULT_BATCH_SIZE, InvalidProposal, history_window, parse_proposal, simulate
+from transactions.views import history_filters
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the past transactions that proposed card control changes would newly decline or allow. "
+        "Proposals are read from a JSON file holding a list of objects as for the transactions/simulate/ endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('proposals', help="The JSON file of proposals, or - for standard input.")
+        parser.add_argument('--organisation', help="Slug of the organisation to simulate; every card in the default database if omitted.")
+        parser.add_argument('--card', help="Replay only this card's transactions.")
+        parser.add_argument('--since', help="Replay transactions from this time on (ISO 8601; default a year ago).")
+        parser.add_argument('--until', help="Replay transactions before this time (ISO 8601).")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Transactions evaluated per batch.")
+        parser.add_argument('--no-numpy', action='store_true', help="Evaluate without NumPy even if it is installed.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        try:
+            organisation = get_organisation(options['organisation']) if options['organisation'] else None
+        except Organisation.DoesNotExist:
+            raise CommandError(f"Unknown organisation '{options['organisation']}'")
+        try:
+            with nullcontext(sys.stdin) if options['proposals'] == '-' else open(options['proposals']) as file:
+                data = json.load(file)
+            proposals = [parse_proposal(proposal, index) for index, proposal in enumerate(data if isinstance(data, list) else [data])]
+            filters = history_window(history_filters({name: options[name] for name in ('card', 'since', 'until')}))
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['proposals']}: {e.strerror}")
+        except (ValueError, InvalidProposal) as e:
+            raise CommandError(str(e))
+
+        with use_organisation(organisation) if organisation else nullcontext():
+            result = simulate(proposals, filters, batch_size=options['batch_size'], use_numpy=False if options['no_numpy'] else None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {result.transactions} transactions in {result.seconds:.3f}s ({result.engine}); "
+            f"the current controls decline {result.current.declined}"
+        ))
+        for proposal in result.proposals:
+            summary = proposal.as_dict()
+            self.stdout.write(
+                f"{proposal.name}: declines {proposal.declined}, "
+                f"newly declined {proposal.newly_declined} ({summary['newly_declined']['amount']}), "
+                f"newly allowed {proposal.newly_allowed} ({summary['newly_allowed']['amount']}), "
+                f"approved but declined {proposal.approved_declined} ({summary['approved_declined']['amount']})"
+            )
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0004_authorization_and_history_indexes'),
+        ('transactions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['card', '-timestamp', '-id'], name='transaction_card_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['-timestamp', '-id'], name='transaction_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('approved', False)), fields=['timestamp'], name='transaction_declined_idx'),
+        ),
+        # Drop the plain FK index only once the composite index leading with card exists
+        migrations.AlterField(
+            model_name='transaction',
+            name='card',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='cards.card'),
+        ),
+    ]
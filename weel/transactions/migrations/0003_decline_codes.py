@@ -0,0 +1,59 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Codes for the messages the authorization code used to store, matched by substring;
+# anything else becomes OTHER. The controls behind old declines are not recoverable.
+LEGACY_MESSAGES = [
+    ("Insufficient funds", 1),
+    ("Card is not active", 2),
+    ("Transaction category", 3),
+    ("Transaction merchant", 4),
+    ("exceeds the maximum allowed amount", 5),
+    ("less than the minimum required amount", 6),
+    ("spend limit", 7),
+    ("transactions.", 8),
+]
+
+
+def convert_reasons(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    TransactionDecline = apps.get_model('transactions', 'TransactionDecline')
+    declines = []
+    for transaction_id, reason in Transaction.objects.filter(approved=False).values_list('id', 'reason_declined').iterator(chunk_size=2000):
+        codes = [code for message, code in LEGACY_MESSAGES if message in (reason or '')] or [0]
+        declines.extend(TransactionDecline(transaction_id=transaction_id, code=code) for code in codes)
+        if len(declines) >= 2000:
+            TransactionDecline.objects.bulk_create(declines)
+            declines = []
+    TransactionDecline.objects.bulk_create(declines)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0005_card_spend'),
+        ('transactions', '0002_authorization_and_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionDecline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.PositiveSmallIntegerField(choices=[(0, 'Declined'), (1, 'Insufficient funds'), (2, 'Card is not active'), (3, 'Category not allowed'), (4, 'Merchant not allowed'), (5, 'Above maximum amount'), (6, 'Below minimum amount'), (7, 'Spend limit exceeded'), (8, 'Transaction limit reached')])),
+                ('control', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='declines', to='cards.cardcontrol')),
+                ('transaction', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='declines', to='transactions.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['transaction', 'code'], name='transaction_decline_idx'), models.Index(fields=['code', 'transaction'], name='decline_code_idx')],
+            },
+        ),
+        migrations.RunPython(convert_reasons, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='reason_declined',
+        ),
+    ]
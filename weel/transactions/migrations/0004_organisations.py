@@ -0,0 +1,64 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:45
+
+import django.db.models.deletion
+import organisations.tenancy
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0006_organisations'),
+        ('organisations', '0001_initial'),
+        ('transactions', '0003_decline_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='organisation',
+            field=models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='organisations.organisation'),
+        ),
+        migrations.AddField(
+            model_name='transactiondecline',
+            name='organisation',
+            field=models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='transaction_declines', to='organisations.organisation'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='card',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='cards.card'),
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_card_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_declined_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='transactiondecline',
+            name='decline_code_idx',
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['organisation', 'card', '-timestamp', '-id'], name='transaction_card_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['organisation', '-timestamp', '-id'], name='transaction_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('approved', False)), fields=['organisation', 'timestamp'], name='transaction_declined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactiondecline',
+            index=models.Index(fields=['organisation', 'code', 'transaction'], name='decline_code_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:10
+
+import django.db.models.deletion
+import organisations.tenancy
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0007_ledger_balances'),
+        ('organisations', '0001_initial'),
+        ('transactions', '0005_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('path', models.CharField(max_length=255)),
+                ('transactions', models.PositiveIntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='transaction_archives', to='organisations.organisation')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedCardTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('approved_count', models.PositiveIntegerField()),
+                ('approved_total', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('card', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_totals', to='cards.card')),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='archived_card_totals', to='organisations.organisation')),
+                ('archive', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='card_totals', to='transactions.transactionarchive')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transactionarchive',
+            constraint=models.UniqueConstraint(fields=('organisation', 'month'), name='transaction_archive_month'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedcardtotal',
+            index=models.Index(fields=['card', 'archive'], name='archived_card_total_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedcardtotal',
+            constraint=models.UniqueConstraint(fields=('archive', 'card'), name='archived_card_total_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0006_transaction_archives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactiondecline',
+            name='code',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Declined'), (1, 'Insufficient funds'), (2, 'Card is not active'), (3, 'Category not allowed'), (4, 'Merchant not allowed'), (5, 'Above maximum amount'), (6, 'Below minimum amount'), (7, 'Spend limit exceeded'), (8, 'Transaction limit reached'), (9, 'Card has expired')]),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:27
+
+import django.db.models.deletion
+import django.utils.timezone
+import organisations.tenancy
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0008_card_expiry'),
+        ('organisations', '0001_initial'),
+        ('transactions', '0007_card_expired_decline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reversal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Reversal'), (2, 'Refund'), (3, 'Partial capture')])),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reference', models.CharField(blank=True, max_length=255, null=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('card', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reversals', to='cards.card')),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='reversals', to='organisations.organisation')),
+                ('transaction', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='reversals', to='transactions.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['transaction', 'amount'], name='reversal_transaction_idx'), models.Index(fields=['card', 'amount'], name='reversal_card_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reversal',
+            constraint=models.UniqueConstraint(condition=models.Q(('reference__isnull', False)), fields=('organisation', 'reference'), name='reversal_reference'),
+        ),
+    ]
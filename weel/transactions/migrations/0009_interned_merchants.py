@@ -0,0 +1,84 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from merchants.interning import intern_legacy
+
+# The interned fields and the models they refer to
+NAMES = {'merchant': 'Merchant', 'merchant_category': 'MerchantCategory'}
+
+
+def intern_names(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    db = schema_editor.connection.alias
+    table = Transaction._meta.db_table
+    for field, model_name in NAMES.items():
+        names = list(Transaction.objects.using(db).order_by().values_list(f'{field}_name', flat=True).distinct())
+        interned = intern_legacy(apps.get_model('merchants', model_name), names, db)
+        # Every row is updated in a single pass through a name -> ID table, rather than a scan per name
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMPORARY TABLE interned_{field} (name varchar(100) PRIMARY KEY, id integer NOT NULL)")
+            cursor.executemany(f"INSERT INTO interned_{field} (name, id) VALUES (%s, %s)", list(interned.items()))
+            cursor.execute(f"UPDATE {table} SET {field}_id = (SELECT id FROM interned_{field} WHERE name = {table}.{field}_name)")
+            cursor.execute(f"DROP TABLE interned_{field}")
+
+
+def restore_names(apps, schema_editor):
+    Transaction = apps.get_model('transactions', 'Transaction')
+    db = schema_editor.connection.alias
+    table = Transaction._meta.db_table
+    for field, model_name in NAMES.items():
+        names = apps.get_model('merchants', model_name)._meta.db_table
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {table} SET {field}_name = (SELECT name FROM {names} WHERE id = {table}.{field}_id)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0008_reversals'),
+        ('merchants', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='transaction',
+            old_name='merchant',
+            new_name='merchant_name',
+        ),
+        migrations.RenameField(
+            model_name='transaction',
+            old_name='merchant_category',
+            new_name='merchant_category_name',
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='merchant',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchant'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='merchant_category',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchantcategory'),
+        ),
+        migrations.RunPython(intern_names, restore_names),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='merchant_name',
+        ),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='merchant_category_name',
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='merchant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchant'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='merchant_category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='merchants.merchantcategory'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 11:57
+
+import django.db.models.deletion
+import organisations.tenancy
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisations', '0001_initial'),
+        ('transactions', '0009_interned_merchants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpendRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.PositiveSmallIntegerField(choices=[(1, 'Card'), (2, 'Merchant category'), (3, 'Merchant')])),
+                ('key', models.BigIntegerField()),
+                ('period', models.PositiveSmallIntegerField(choices=[(1, 'Hour'), (2, 'Day')])),
+                ('start', models.DateTimeField()),
+                ('approved_count', models.PositiveIntegerField(default=0)),
+                ('approved_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('declined_count', models.PositiveIntegerField(default=0)),
+                ('declined_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, default=organisations.tenancy.current_organisation_id, on_delete=django.db.models.deletion.PROTECT, related_name='spend_rollups', to='organisations.organisation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organisation', 'dimension', 'key', 'period', 'start'], name='spend_rollup_key_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='spendrollup',
+            constraint=models.UniqueConstraint(fields=('organisation', 'dimension', 'period', 'start', 'key'), name='spend_rollup_bucket'),
+        ),
+    ]
@@ -1,15 +1,207 @@
 from django.db import models
-from cards.models import Card
+from django.utils import timezone
+from cards.declines import DeclineCode
+from cards.models import Card, CardControl, organisation_field
+from merchants.models import Merchant, MerchantCategory
+from organisations.managers import TenantManager
 
 class Transaction(models.Model):
+    organisation = organisation_field('transactions')
     card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='transactions')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    merchant = models.CharField(max_length=100)
-    merchant_category = models.CharField(max_length=50)
+    # Interned names, see merchants.interning
+    merchant = models.ForeignKey(Merchant, on_delete=models.PROTECT, related_name='+', db_index=False)
+    merchant_category = models.ForeignKey(MerchantCategory, on_delete=models.PROTECT, related_name='+', db_index=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     approved = models.BooleanField(default=False)
-    reason_declined = models.CharField(max_length=255, blank=True, null=True)
+    # The client's Idempotency-Key header, see transactions.idempotency
+    idempotency_key = models.CharField(max_length=255, null=True, blank=True)
+
+    objects = TenantManager()
+
+    class Meta:
+        constraints = [
+            # One transaction per key and organisation; also the index a retry is looked up with
+            models.UniqueConstraint(
+                fields=['organisation', 'idempotency_key'],
+                condition=models.Q(idempotency_key__isnull=False),
+                name='transaction_idempotency_key',
+            ),
+        ]
+        indexes = [
+            # Card history, newest first. Lookups by card alone (cascading deletes) use the FK index
+            models.Index(fields=['organisation', 'card', '-timestamp', '-id'], name='transaction_card_time_idx'),
+            # An organisation's history list, newest first
+            models.Index(fields=['organisation', '-timestamp', '-id'], name='transaction_time_idx'),
+            # Recent declines; approved rows are the vast majority and stay out of this index
+            models.Index(fields=['organisation', 'timestamp'], condition=models.Q(approved=False), name='transaction_declined_idx'),
+        ]
 
     def __str__(self):
         return f"Transaction on {self.card.card_number} for {self.amount}"
 
+
+
+class TransactionDecline(models.Model):
+    """
+    One reason a transaction was declined: a DeclineCode and, for control failures, a
+    control that caused it. A transaction failing one category or merchant check against
+    several controls gets a row per control; messages are rendered by
+    cards.declines.describe when the transaction is read.
+    """
+    organisation = organisation_field('transaction_declines')
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='declines', db_index=False)  # Covered by transaction_decline_idx
+    code = models.PositiveSmallIntegerField(choices=DeclineCode.choices)
+    control = models.ForeignKey(CardControl, on_delete=models.SET_NULL, null=True, blank=True, related_name='declines')
+
+    objects = TenantManager()
+
+    class Meta:
+        indexes = [
+            # The reasons for a page of transactions
+            models.Index(fields=['transaction', 'code'], name='transaction_decline_idx'),
+            # An organisation's decline counts by code, read from the index alone
+            models.Index(fields=['organisation', 'code', 'transaction'], name='decline_code_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_code_display()} on transaction {self.transaction_id}"
+
+
+
+class ReversalKind(models.IntegerChoices):
+    REVERSAL = 1, "Reversal"
+    REFUND = 2, "Refund"
+    # The authorized amount left over when a transaction settles for less
+    PARTIAL_CAPTURE = 3, "Partial capture"
+
+
+class Reversal(models.Model):
+    """
+    Money returned to a card against one of its approved transactions, credited to the
+    card's ledger with a REVERSAL entry; see transactions.reversals. The amounts returned
+    against a transaction never add up to more than its amount.
+    """
+    organisation = organisation_field('reversals')
+    # Kept as a plain reference, like the ledger's, so archiving the transaction leaves its reversals alone
+    transaction = models.ForeignKey(Transaction, on_delete=models.DO_NOTHING, related_name='reversals', db_constraint=False, db_index=False)  # Covered by reversal_transaction_idx
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='reversals', db_index=False)  # Covered by reversal_card_idx
+    kind = models.PositiveSmallIntegerField(choices=ReversalKind.choices)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    # The processor's reference, which makes a resubmitted reversal or settlement row a no-op
+    reference = models.CharField(max_length=255, null=True, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = TenantManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organisation', 'reference'],
+                condition=models.Q(reference__isnull=False),
+                name='reversal_reference',
+            ),
+        ]
+        indexes = [
+            # The amount already returned against a transaction
+            models.Index(fields=['transaction', 'amount'], name='reversal_transaction_idx'),
+            # A card's reversals, for the ledger check
+            models.Index(fields=['card', 'amount'], name='reversal_card_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.amount} on transaction {self.transaction_id}"
+
+
+class TransactionArchive(models.Model):
+    """
+    A month of an organisation's transactions, moved out of the Transaction table into a
+    gzipped NDJSON file by transactions.archive. `path` is relative to TRANSACTION_ARCHIVE_DIR.
+    """
+    organisation = organisation_field('transaction_archives')
+    month = models.DateField()  # The first day of the month
+    path = models.CharField(max_length=255)
+    transactions = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = TenantManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['organisation', 'month'], name='transaction_archive_month'),
+        ]
+
+    def __str__(self):
+        return f"Transactions of {self.month:%Y-%m}"
+
+
+class ArchivedCardTotal(models.Model):
+    """
+    The number and total of a card's approved transactions in an archive, so its ledger
+    can still be checked against them (see ledger.maintenance.check_cards). Every card with
+    a transaction in the archive has one, zero for a card with only declined transactions,
+    so the card's history skips the archives without it (see archive.archived_history).
+    """
+    organisation = organisation_field('archived_card_totals')
+    archive = models.ForeignKey(TransactionArchive, on_delete=models.CASCADE, related_name='card_totals', db_index=False)
+    card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='archived_totals', db_index=False)
+    approved_count = models.PositiveIntegerField()
+    approved_total = models.DecimalField(max_digits=14, decimal_places=2)
+
+    objects = TenantManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['card', 'archive'], name='archived_card_total_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['archive', 'card'], name='archived_card_total_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.approved_count} approved transactions on card {self.card_id}"
+
+
+class RollupDimension(models.IntegerChoices):
+    CARD = 1, "Card"
+    CATEGORY = 2, "Merchant category"
+    MERCHANT = 3, "Merchant"
+
+
+class RollupPeriod(models.IntegerChoices):
+    HOUR = 1, "Hour"
+    DAY = 2, "Day"
+
+
+class SpendRollup(models.Model):
+    """
+    The number and total of an organisation's approved and declined transactions on one
+    card, merchant category or merchant in an hour or a day, kept up to date as
+    transactions are written and rebuilt by backfill_rollups; see transactions.rollups.
+    """
+    organisation = organisation_field('spend_rollups')
+    dimension = models.PositiveSmallIntegerField(choices=RollupDimension.choices)
+    # The ID of the card, merchant category or merchant
+    key = models.BigIntegerField()
+    period = models.PositiveSmallIntegerField(choices=RollupPeriod.choices)
+    # The start of the UTC hour, or of the day in the current time zone
+    start = models.DateTimeField()
+    approved_count = models.PositiveIntegerField(default=0)
+    approved_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    declined_count = models.PositiveIntegerField(default=0)
+    declined_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = TenantManager()
+
+    class Meta:
+        constraints = [
+            # Also the index every key's buckets in a window are read with
+            models.UniqueConstraint(fields=['organisation', 'dimension', 'period', 'start', 'key'], name='spend_rollup_bucket'),
+        ]
+        indexes = [
+            # One card's, category's or merchant's buckets
+            models.Index(fields=['organisation', 'dimension', 'key', 'period', 'start'], name='spend_rollup_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_dimension_display()} {self.key} from {self.start}"
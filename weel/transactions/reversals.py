@@ -0,0 +1,248 @@
+"""
+Reversals, refunds and partial captures: money returned to a card against one of
+its approved transactions.
+
+Each is a Reversal row linked to the original Transaction plus a REVERSAL credit
+in the card's ledger, so the card row is never rewritten. What has already been
+returned against each transaction is read under the cards' posting locks (see
+ledger.balances.posting_lock) in the database transaction that writes the new
+rows, so concurrent refunds can never return more than the transaction's amount.
+
+reverse_transactions applies a whole chunk with a few bulk reads and inserts
+rather than a round trip per row, which is how the ingest_settlement command
+gets through the processor's end-of-day file. A `reference`, the processor's ID
+for the movement, makes every request safe to resubmit: a reference already
+applied to the same transaction returns the existing Reversal.
+"""
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connections, transaction as db_transaction
+from django.db.models import Sum
+
+from ledger.balances import posting_lock
+from ledger.models import EntryKind, LedgerEntry
+from organisations.tenancy import tenant_database
+from .models import Reversal, ReversalKind, Transaction
+
+DEFAULT_BATCH_SIZE = 1000
+# Reversals credited per INSERT, well within every database's limit on parameters
+CREDIT_BATCH_SIZE = 500
+
+KINDS = {
+    'reversal': ReversalKind.REVERSAL,
+    'refund': ReversalKind.REFUND,
+    'capture': ReversalKind.PARTIAL_CAPTURE,
+}
+
+
+class InvalidReversal(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ReversalRequest:
+    transaction_id: int
+    kind: int
+    # The amount to return, or everything not yet returned if None. For a partial
+    # capture, the amount captured; the rest of the authorization is returned.
+    amount: Decimal = None
+    reference: str = None
+
+
+@dataclass
+class ReversalOutcome:
+    reversal: Reversal = None
+    # False when the reference had already been applied
+    created: bool = False
+    error: str = None
+
+
+@dataclass
+class SettlementResult:
+    applied: int = 0
+    replayed: int = 0
+    rejected: list = field(default_factory=list)
+    total: Decimal = Decimal('0.00')
+    seconds: float = 0.0
+
+
+def _amount(value, name='amount'):
+    try:
+        amount = Decimal(str(value))
+    except (TypeError, ValueError, InvalidOperation):
+        raise InvalidReversal(f"Invalid {name} '{value}'")
+    if not amount.is_finite() or amount < 0 or amount != amount.quantize(Decimal('0.01')):
+        raise InvalidReversal(f"Invalid {name} '{value}'")
+    return amount.quantize(Decimal('0.01'))
+
+
+def parse_reversal(data, transaction_id=None):
+    """
+    Pull a ReversalRequest out of a request body or settlement row.
+
+    Reads 'transaction' (unless `transaction_id` is given), 'kind' ('reversal', the default,
+    'refund' or 'capture'), 'amount' (optional, except for captures) and 'reference' (optional).
+    """
+    if not isinstance(data, dict):
+        raise InvalidReversal("Expected a JSON object")
+    if transaction_id is None:
+        try:
+            transaction_id = int(data['transaction'])
+        except KeyError as e:
+            raise InvalidReversal(f"Missing field {e}")
+        except (TypeError, ValueError):
+            raise InvalidReversal(f"Invalid transaction '{data['transaction']}'")
+    kind = data.get('kind') or 'reversal'
+    if kind not in KINDS:
+        raise InvalidReversal(f"Invalid kind '{kind}', expected one of {', '.join(KINDS)}")
+    amount = data.get('amount')
+    if amount in (None, ''):
+        if kind == 'capture':
+            raise InvalidReversal("Missing field 'amount'")
+        amount = None
+    else:
+        amount = _amount(amount)
+        if amount == 0 and kind != 'capture':
+            raise InvalidReversal(f"Invalid amount '{data['amount']}'")
+    reference = data.get('reference') or None
+    if reference is not None and (not isinstance(reference, str) or len(reference) > Reversal._meta.get_field('reference').max_length):
+        raise InvalidReversal("Invalid reference")
+    return ReversalRequest(transaction_id, KINDS[kind], amount, reference)
+
+
+def _money(value):
+    # Sums come back as floats or integers on SQLite
+    return Decimal(str(value or 0)).quantize(Decimal('0.01'))
+
+
+def _returnable(request, original, returned):
+    """
+    The amount `request` returns against `original`, of which `returned` was already returned.
+    """
+    remaining = original.amount - returned
+    if request.kind == ReversalKind.PARTIAL_CAPTURE:
+        if request.amount > remaining:
+            raise InvalidReversal(f"Captured {request.amount} but only {remaining} of transaction {original.pk} is outstanding")
+        return remaining - request.amount
+    if remaining <= 0:
+        raise InvalidReversal(f"Transaction {original.pk} has already been fully reversed")
+    if request.amount is not None and request.amount > remaining:
+        raise InvalidReversal(f"Only {remaining} of transaction {original.pk} can be returned")
+    return remaining if request.amount is None else request.amount
+
+
+def _credit(reversal_ids, using):
+    """
+    Append the REVERSAL ledger entries of the new reversals `reversal_ids`.
+
+    Each batch is copied from the reversal rows by a single INSERT ... SELECT rather than
+    built as model instances, which is most of the cost of a large settlement file.
+    """
+    for start in range(0, len(reversal_ids), CREDIT_BATCH_SIZE):
+        batch = reversal_ids[start:start + CREDIT_BATCH_SIZE]
+        sql = (
+            f"INSERT INTO {LedgerEntry._meta.db_table} (organisation_id, card_id, kind, amount, transaction_id, created) "
+            f"SELECT organisation_id, card_id, %s, amount, transaction_id, created FROM {Reversal._meta.db_table} "
+            f"WHERE id IN ({', '.join(['%s'] * len(batch))})"
+        )
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, [EntryKind.REVERSAL, *batch])
+
+
+def _reverse(requests):
+    using = tenant_database()
+    originals = Transaction.objects.only('organisation_id', 'card_id', 'amount', 'approved').in_bulk({request.transaction_id for request in requests})
+    with db_transaction.atomic(using=using), posting_lock({original.card_id for original in originals.values()}, using):
+        references = {request.reference for request in requests if request.reference is not None}
+        existing = {
+            (reversal.organisation_id, reversal.reference): reversal
+            for reversal in (Reversal.objects.filter(reference__in=references) if references else ())
+        }
+        returned = defaultdict(Decimal, {
+            transaction_id: _money(total)
+            for transaction_id, total in Reversal.objects.filter(transaction_id__in=originals.keys()).order_by()
+            .values('transaction').annotate(total=Sum('amount')).values_list('transaction', 'total')
+        })
+
+        outcomes, reversals = [], []
+        for request in requests:
+            original = originals.get(request.transaction_id)
+            try:
+                if original is None:
+                    raise InvalidReversal(f"Transaction {request.transaction_id} not found")
+                applied = existing.get((original.organisation_id, request.reference)) if request.reference is not None else None
+                if applied is not None:
+                    if applied.transaction_id != original.pk:
+                        raise InvalidReversal(f"Reference '{request.reference}' was already used for transaction {applied.transaction_id}")
+                    outcomes.append(ReversalOutcome(applied))
+                    continue
+                if not original.approved:
+                    raise InvalidReversal(f"Transaction {original.pk} was declined")
+                amount = _returnable(request, original, returned[original.pk])
+            except InvalidReversal as e:
+                outcomes.append(ReversalOutcome(error=str(e)))
+                continue
+            reversal = Reversal(
+                organisation_id=original.organisation_id, transaction_id=original.pk, card_id=original.card_id,
+                kind=request.kind, amount=amount, reference=request.reference,
+            )
+            returned[original.pk] += amount
+            if request.reference is not None:
+                existing[(original.organisation_id, request.reference)] = reversal
+            reversals.append(reversal)
+            outcomes.append(ReversalOutcome(reversal, created=True))
+
+        Reversal.objects.bulk_create(reversals)
+        # A transaction captured in full returns nothing
+        _credit([reversal.pk for reversal in reversals if reversal.amount], using)
+    return outcomes
+
+
+def reverse_transactions(requests):
+    """
+    Apply a list of ReversalRequests in one database transaction and return a
+    ReversalOutcome for each, in order. Requests that cannot be applied get an error and
+    the others go ahead.
+    """
+    try:
+        return _reverse(requests)
+    except IntegrityError:
+        # A concurrent request committed one of the references first; it is now replayed
+        return _reverse(requests)
+
+
+def ingest_settlement(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Apply an iterable of (line, settlement row) pairs, each row a dict as read by
+    parse_reversal, in chunks of `batch_size`, one database transaction each. Returns a
+    SettlementResult listing the rejected rows as (line, error) pairs.
+    """
+    started = time.perf_counter()
+    result = SettlementResult()
+
+    def apply(chunk):
+        for (line, _), outcome in zip(chunk, reverse_transactions([request for _, request in chunk])):
+            if outcome.error is not None:
+                result.rejected.append((line, outcome.error))
+            elif outcome.created:
+                result.applied += 1
+                result.total += outcome.reversal.amount
+            else:
+                result.replayed += 1
+
+    chunk = []
+    for line, row in rows:
+        try:
+            chunk.append((line, parse_reversal(row)))
+        except InvalidReversal as e:
+            result.rejected.append((line, str(e)))
+        if len(chunk) == batch_size:
+            apply(chunk)
+            chunk = []
+    if chunk:
+        apply(chunk)
+    result.seconds = time.perf_counter() - started
+    return result
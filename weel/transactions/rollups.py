@@ -0,0 +1,232 @@
+"""
+Spend rollups: per-hour and per-day counts and totals of approved and declined
+transactions for every card, merchant category and merchant.
+
+Every write path adds its transactions to their SpendRollup rows with one
+INSERT ... ON CONFLICT DO UPDATE (add_to_rollups), in the database transaction
+that records them, so the rollups never disagree with the table. Every
+transaction at a merchant updates the same row for the hour, so the upsert is
+the last statement before the commit and rows are written in a fixed order,
+which keeps those row locks short and free of deadlocks.
+
+The analytics API reads only the rollups (see spend_totals and spend_series):
+a window costs at most its days plus the hours of its two partial days per card,
+category or merchant, however many transactions it holds. Hours are UTC hours
+and days those of the current time zone, which must be a whole number of hours
+from UTC for the two to line up.
+
+backfill_rollups rebuilds whole past days from the Transaction table, one day
+per database transaction, for a new deployment or after a repair. Today is left
+to the live updates and days in archived months are left alone, as their
+transactions are no longer in the table.
+"""
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import connections, transaction as db_transaction
+from django.db.models import Count, DateTimeField, F, Q, Sum, Value
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from organisations.tenancy import tenant_database
+from .archive import next_month
+from .models import RollupDimension, RollupPeriod, SpendRollup, Transaction, TransactionArchive
+
+# The Transaction field each dimension is keyed on
+DIMENSION_FIELDS = {
+    RollupDimension.CARD: 'card_id',
+    RollupDimension.CATEGORY: 'merchant_category_id',
+    RollupDimension.MERCHANT: 'merchant_id',
+}
+
+_COLUMNS = ('organisation_id', 'dimension', 'key', 'period', 'start', 'approved_count', 'approved_amount', 'declined_count', 'declined_amount')
+_TOTALS = ('approved_count', 'approved_amount', 'declined_count', 'declined_amount')
+
+
+@dataclass
+class BackfillResult:
+    days: int = 0
+    transactions: int = 0
+    seconds: float = 0.0
+
+
+def hour_start(value):
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(value):
+    """
+    The start of the day holding `value`, an aware datetime or a date, in the current time zone.
+    """
+    if isinstance(value, datetime):
+        value = timezone.localtime(value).date()
+    return timezone.make_aware(datetime.combine(value, dt_time.min))
+
+
+def _next_day(start):
+    return day_start(start.date() + timedelta(days=1))
+
+
+def _upsert(rows, using):
+    """
+    Add `rows`, {(organisation_id, dimension, key, period, start): [approved count,
+    approved amount, declined count, declined amount]}, to their SpendRollup rows.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(SpendRollup._meta.db_table)
+    conflict = ', '.join(quote(column) for column in ('organisation_id', 'dimension', 'period', 'start', 'key'))
+    updates = ', '.join(f"{quote(column)} = {table}.{quote(column)} + excluded.{quote(column)}" for column in _TOTALS)
+    keys = sorted(rows)
+    batch_size = connection.ops.bulk_batch_size(_COLUMNS, keys)
+    for first in range(0, len(keys), batch_size):
+        batch = keys[first:first + batch_size]
+        values = ', '.join([f"({', '.join(['%s'] * len(_COLUMNS))})"] * len(batch))
+        params = []
+        for organisation_id, dimension, key, period, start in batch:
+            params += [organisation_id, dimension, key, period, connection.ops.adapt_datetimefield_value(start), *rows[organisation_id, dimension, key, period, start]]
+        sql = (
+            f"INSERT INTO {table} ({', '.join(quote(column) for column in _COLUMNS)}) VALUES {values} "
+            f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def add_to_rollups(transactions):
+    """
+    Add saved Transactions to their hour and day rollups. Call it inside the database
+    transaction that wrote them, after everything else it does.
+    """
+    rows = defaultdict(lambda: [0, Decimal('0.00'), 0, Decimal('0.00')])
+    for transaction in transactions:
+        offset = 0 if transaction.approved else 2
+        for period, start in ((RollupPeriod.HOUR, hour_start(transaction.timestamp)), (RollupPeriod.DAY, day_start(transaction.timestamp))):
+            for dimension, field in DIMENSION_FIELDS.items():
+                row = rows[transaction.organisation_id, dimension, getattr(transaction, field), period, start]
+                row[offset] += 1
+                row[offset + 1] += transaction.amount
+    if rows:
+        _upsert(rows, tenant_database())
+
+
+def _ranges(since, until):
+    """
+    The (period, start, end) ranges of rollups covering [since, until), both hour-aligned:
+    the days wholly inside it and the hours before and after them.
+    """
+    first_day = since if since == day_start(since) else _next_day(since)
+    last_day = day_start(until)
+    if first_day >= last_day:
+        return [(RollupPeriod.HOUR, since, until)]
+    ranges = [(RollupPeriod.HOUR, since, first_day), (RollupPeriod.DAY, first_day, last_day), (RollupPeriod.HOUR, last_day, until)]
+    return [(period, start, end) for period, start, end in ranges if start < end]
+
+
+def spend_totals(dimension, since, until, key=None, limit=None):
+    """
+    Return dicts with the 'key' and the totals of every card, category or merchant
+    (`dimension`) with transactions in [since, until), which must be hour-aligned, most
+    approved spend first. `key` narrows to one of them and `limit` caps the number returned.
+    """
+    totals = {}
+    # A query per range, each a range of spend_rollup_bucket (or spend_rollup_key_idx for
+    # one key); with the ranges ORed together the planner reads every bucket of the dimension
+    for period, start, end in _ranges(since, until):
+        rollups = SpendRollup.objects.filter(dimension=dimension, period=period, start__gte=start, start__lt=end)
+        if key is not None:
+            rollups = rollups.filter(key=key)
+        for row in rollups.order_by().values('key').annotate(**{total: Sum(total) for total in _TOTALS}):
+            merged = totals.setdefault(row['key'], {'key': row['key'], **dict.fromkeys(_TOTALS, 0)})
+            for total in _TOTALS:
+                merged[total] += row[total]
+    ranked = sorted(totals.values(), key=lambda row: (-row['approved_amount'], row['key']))
+    return ranked[:limit] if limit is not None else ranked
+
+
+def spend_series(dimension, period, since, until, key=None):
+    """
+    A queryset of the `period` rollups of every card, category or merchant (`dimension`)
+    starting in [since, until), as dicts with the 'key', the 'start' and the totals.
+    """
+    rollups = SpendRollup.objects.filter(dimension=dimension, period=period, start__gte=since, start__lt=until)
+    if key is not None:
+        rollups = rollups.filter(key=key)
+    return rollups.values('key', 'start', *_TOTALS)
+
+
+def _insert_select(queryset, dimension, period, using):
+    """
+    Insert a SpendRollup row of `dimension` and `period` for each row of `queryset`, a
+    values() queryset with 'organisation_id', 'key', 'start' and the totals, with one
+    INSERT ... SELECT rather than building the rows in Python.
+    """
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    columns = ('organisation_id', 'key', 'start', *_TOTALS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(SpendRollup._meta.db_table)} ({quote('dimension')}, {quote('period')}, {', '.join(quote(column) for column in columns)}) "
+            f"SELECT %s, %s, {', '.join(f'grouped.{quote(column)}' for column in columns)} FROM ({sql}) grouped",
+            [dimension, period, *params],
+        )
+
+
+def rebuild_day(day):
+    """
+    Recompute the current organisation's rollups of `day`, the start of a day, from its
+    transactions in one database transaction. Returns the number of transactions.
+    """
+    using = tenant_database()
+    end = _next_day(day)
+    transactions = Transaction.objects.filter(timestamp__gte=day, timestamp__lt=end).order_by()
+    totals = {
+        'approved_count': Count('id', filter=Q(approved=True)),
+        'approved_amount': Sum('amount', filter=Q(approved=True), default=0),
+        'declined_count': Count('id', filter=Q(approved=False)),
+        'declined_amount': Sum('amount', filter=Q(approved=False), default=0),
+    }
+    with db_transaction.atomic(using=using):
+        for dimension, field in DIMENSION_FIELDS.items():
+            # By dimension and period, so the delete is a range of spend_rollup_bucket
+            SpendRollup.objects.filter(dimension=dimension, period__in=RollupPeriod.values, start__gte=day, start__lt=end).delete()
+            keyed = transactions.annotate(key=F(field))
+            hours = keyed.annotate(start=TruncHour('timestamp', tzinfo=dt_timezone.utc)).values('organisation_id', 'key', 'start').annotate(**totals)
+            _insert_select(hours, dimension, RollupPeriod.HOUR, using)
+            days = keyed.values('organisation_id', 'key').annotate(**totals, start=Value(day, output_field=DateTimeField()))
+            _insert_select(days, dimension, RollupPeriod.DAY, using)
+        return transactions.count()
+
+
+def backfill_rollups(since=None, until=None, now=None):
+    """
+    Rebuild the current organisation's rollups of the days from `since` up to `until`
+    (dates; by default from its oldest transaction up to today, which is never rebuilt).
+    Returns a BackfillResult.
+    """
+    started = time.perf_counter()
+    result = BackfillResult()
+    today = day_start(now or timezone.now())
+    end = min(day_start(until), today) if until is not None else today
+    if since is None:
+        oldest = Transaction.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if oldest is None:
+            return result
+        since = oldest
+    day = day_start(since)
+    archived = TransactionArchive.objects.order_by('-month').values_list('month', flat=True).first()
+    if archived is not None:
+        # Archives hold whole months in UTC
+        archived_until = datetime.combine(next_month(archived), dt_time.min, tzinfo=dt_timezone.utc)
+        if day < archived_until:
+            day = day_start(archived_until) if archived_until == day_start(archived_until) else _next_day(archived_until)
+    while day < end:
+        result.transactions += rebuild_day(day)
+        result.days += 1
+        day = _next_day(day)
+    result.seconds = time.perf_counter() - started
+    return result
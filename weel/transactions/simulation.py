@@ -0,0 +1,393 @@
+"""
+What-if simulation of card control changes against the transaction history.
+
+simulate() replays the history of one card or of the whole organisation,
+archived months included, under the cards' current controls and under each
+proposed change, and counts the transactions every change would newly decline
+or allow. Only the static controls are simulated: allowed categories and
+merchants and the amount window. Rolling limits depend on the order and timing
+of earlier approvals, and funds on the balance at the time, so both are left out.
+
+The history is read in columnar batches of card IDs, interned category and
+merchant IDs (see merchants.interning), amounts in cents and approval flags.
+Every control set is compiled once per card (see cards.controls.CompiledControls)
+into allowed-ID sets and an amount window in cents, and each batch is checked
+against them a column at a time. With NumPy installed the checks are array
+operations; without it the same tables are applied in one tight loop per control
+set. Neither goes through the authorization path.
+"""
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+from functools import cache
+from itertools import islice
+from operator import itemgetter
+from typing import NamedTuple
+
+from django.db import connections
+from django.db.models import F, IntegerField
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from cards.controls import CompiledControls, InvalidControl, clean_control_amount
+from cards.declines import DeclineCode
+from cards.models import CardControl
+from merchants.interning import categories, merchants
+from .archive import archived_history
+from .models import Transaction
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional
+    numpy = None
+
+DEFAULT_BATCH_SIZE = 50000
+DEFAULT_HISTORY_DAYS = 365
+
+# The control types that can be simulated, and the bit each sets in a transaction's decline flags
+STATIC_CONTROLS = ('category', 'merchant', 'max_amount', 'min_amount')
+CATEGORY, MERCHANT, ABOVE_MAXIMUM, BELOW_MINIMUM = 1, 2, 4, 8
+FLAG_CODES = {
+    CATEGORY: DeclineCode.CATEGORY_NOT_ALLOWED,
+    MERCHANT: DeclineCode.MERCHANT_NOT_ALLOWED,
+    ABOVE_MAXIMUM: DeclineCode.ABOVE_MAXIMUM_AMOUNT,
+    BELOW_MINIMUM: DeclineCode.BELOW_MINIMUM_AMOUNT,
+}
+
+
+class InvalidProposal(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class Proposal:
+    """
+    A change to the controls of every card simulated: the controls of each type in
+    `replaces` are dropped and `controls`, (control_type, merchant category ID, merchant
+    ID, amount) tuples, added.
+    Category and merchant controls are allow-lists, so restricting them means replacing them.
+    """
+    name: str
+    controls: tuple = ()
+    replaces: frozenset = frozenset()
+
+    def apply(self, controls):
+        return [control for control in controls if control[0] not in self.replaces] + list(self.controls)
+
+
+def parse_proposal(data, index=0):
+    """
+    Pull a Proposal out of a JSON object with a 'controls' list, shaped like the bodies
+    of POSTs to the card-controls endpoint without the 'card', an optional 'remove' list
+    of control types to drop and an optional 'name'. A category or merchant that was never
+    interned matches no transaction.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('controls', []), list) or not isinstance(data.get('remove', []), list):
+        raise InvalidProposal("Expected an object with a list of 'controls'")
+    controls = []
+    for control in data.get('controls', []):
+        control_type = control.get('control_type') if isinstance(control, dict) else None
+        if control_type not in STATIC_CONTROLS:
+            raise InvalidProposal(f"Cannot simulate controls of type '{control_type}', only {', '.join(STATIC_CONTROLS)}")
+        if control_type in ('category', 'merchant'):
+            if not control.get('detail') or not isinstance(control['detail'], str):
+                raise InvalidProposal(f"A {control_type} control needs a 'detail'")
+            if control_type == 'category':
+                controls.append((control_type, categories.lookup(control['detail']), None, None))
+            else:
+                controls.append((control_type, None, merchants.lookup(control['detail']), None))
+        else:
+            try:
+                amount = clean_control_amount(control_type, control.get('amount'))
+            except InvalidControl as e:
+                raise InvalidProposal(str(e))
+            controls.append((control_type, None, None, amount))
+    removed = data.get('remove', [])
+    # Checked entry by entry, as a list may hold unhashable values
+    if not all(isinstance(control_type, str) and control_type in STATIC_CONTROLS for control_type in removed):
+        raise InvalidProposal(f"Can only remove controls of type {', '.join(STATIC_CONTROLS)}")
+    removed = set(removed)
+    return Proposal(
+        name=str(data.get('name') or f"proposal {index + 1}"),
+        controls=tuple(controls),
+        replaces=frozenset(removed | {control[0] for control in controls}),
+    )
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    # Transactions declined by the controls of this scenario
+    declined: int = 0
+    by_code: Counter = field(default_factory=Counter)
+    # Compared with the current controls; amounts in cents
+    newly_declined: int = 0
+    newly_declined_amount: int = 0
+    newly_allowed: int = 0
+    newly_allowed_amount: int = 0
+    # Transactions that were approved and would have been declined
+    approved_declined: int = 0
+    approved_declined_amount: int = 0
+
+    def as_dict(self):
+        money = lambda cents: str(Decimal(cents).scaleb(-2).quantize(Decimal('0.01')))
+        return {
+            "name": self.name,
+            "declined": self.declined,
+            "declined_by_code": {DeclineCode(code).name.lower(): count for code, count in sorted(self.by_code.items())},
+            "newly_declined": {"count": self.newly_declined, "amount": money(self.newly_declined_amount)},
+            "newly_allowed": {"count": self.newly_allowed, "amount": money(self.newly_allowed_amount)},
+            "approved_declined": {"count": self.approved_declined, "amount": money(self.approved_declined_amount)},
+        }
+
+
+@dataclass
+class SimulationResult:
+    current: ScenarioResult
+    proposals: list
+    transactions: int = 0
+    engine: str = 'python'
+    seconds: float = 0.0
+
+
+def history_window(filters, now=None):
+    """
+    Default the history `filters` (see transactions.views.history_filters) to the last
+    DEFAULT_HISTORY_DAYS days.
+    """
+    if 'timestamp__gte' not in filters:
+        filters = {**filters, 'timestamp__gte': (now or timezone.now()) - timedelta(days=DEFAULT_HISTORY_DAYS)}
+    return filters
+
+
+def _cents(amount):
+    return None if amount is None else int(amount * 100)
+
+
+def history_batches(filters, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield lists of up to `batch_size` (card_id, merchant_category_id, merchant_id, cents,
+    approved) rows for every transaction of the current organisation matching the history
+    `filters`, then for the archived ones. `approved` is 1 or 0.
+    """
+    hot = (
+        Transaction.objects.filter(**filters).order_by()
+        .annotate(cents=Cast(Round(F('amount') * 100), IntegerField()), approved_flag=Cast('approved', IntegerField()))
+        .values_list('card_id', 'merchant_category_id', 'merchant_id', 'cents', 'approved_flag')
+    )
+    # Fetched as plain tuples, skipping the queryset's per-row conversions; a
+    # server-side cursor where the database has them
+    sql, params = hot.query.sql_with_params()
+    with connections[hot.db].chunked_cursor() as cursor:
+        cursor.execute(sql, params)
+        while batch := cursor.fetchmany(batch_size):
+            yield batch
+    # Archives keep the names, each looked up once; one that was never interned gets -1,
+    # which no control allows
+    category_id = cache(lambda name: categories.lookup(name) or -1)
+    merchant_id = cache(lambda name: merchants.lookup(name) or -1)
+    archived = (
+        (item['card_id'], category_id(item['merchant_category']), merchant_id(item['merchant']), _cents(Decimal(item['amount'])), int(item['approved']))
+        for item in archived_history(filters)
+    )
+    while batch := list(islice(archived, batch_size)):
+        yield batch
+
+
+class _Control(NamedTuple):
+    # Stands in for a CardControl in CompiledControls
+    id: int
+    control_type: str
+    merchant_category_id: int
+    merchant_id: int
+    amount: Decimal
+    detail: str = None
+
+
+def _rules(controls):
+    """
+    Compile (control_type, merchant category ID, merchant ID, amount) tuples into the lookup
+    tables a batch is checked against: (allowed category IDs, allowed merchant IDs, minimum
+    cents, maximum cents), with None where there is no restriction.
+    """
+    compiled = CompiledControls(_Control(None, *control) for control in controls)
+    return frozenset(compiled.categories) or None, frozenset(compiled.merchants) or None, _cents(compiled.min_amount), _cents(compiled.max_amount)
+
+
+def _load_rules(card_ids, proposals, rules, compiled):
+    """
+    Add the lookup tables of each new card in `card_ids` to `rules`, {card_id: [current,
+    *proposed]}, reading their controls with one query per thousand cards. Cards with the
+    same controls share their tables through `compiled`. Returns the new card IDs.
+    """
+    new = [card_id for card_id in card_ids if card_id not in rules]
+    controls = {card_id: [] for card_id in new}
+    for start in range(0, len(new), 1000):
+        rows = CardControl.objects.filter(card_id__in=new[start:start + 1000]).values_list('card_id', 'control_type', 'merchant_category_id', 'merchant_id', 'amount')
+        for card_id, *control in rows:
+            controls[card_id].append(tuple(control))
+    for card_id, current in controls.items():
+        key = tuple(sorted(current, key=str))
+        if key not in compiled:
+            compiled[key] = [_rules(current)] + [_rules(proposal.apply(current)) for proposal in proposals]
+        rules[card_id] = compiled[key]
+    return new
+
+
+class _PythonEngine:
+    """
+    Checks each batch row by row against the cards' lookup tables.
+    """
+    name = 'python'
+
+    def __init__(self, scenarios):
+        self.rules = {}
+
+    def add_cards(self, card_ids, rules):
+        self.rules = rules
+
+    def flags(self, rows, scenario):
+        rules = self.rules
+        flags = bytearray(len(rows))
+        for index, (card_id, category, merchant, cents, _) in enumerate(rows):
+            categories, merchants, low, high = rules[card_id][scenario]
+            flags[index] = (
+                (categories is not None and category not in categories)
+                | (merchants is not None and merchant not in merchants) << 1
+                | (high is not None and cents > high) << 2
+                | (low is not None and cents < low) << 3
+            )
+        return flags
+
+    def evaluate(self, rows, results):
+        current = self.flags(rows, 0)
+        for scenario, result in enumerate(results):
+            after = current if scenario == 0 else self.flags(rows, scenario)
+            for (_, _, _, cents, approved), was, will in zip(rows, current, after):
+                if will:
+                    result.declined += 1
+                    for flag, code in FLAG_CODES.items():
+                        if will & flag:
+                            result.by_code[code] += 1
+                    if not was:
+                        result.newly_declined += 1
+                        result.newly_declined_amount += cents
+                    if approved:
+                        result.approved_declined += 1
+                        result.approved_declined_amount += cents
+                elif was:
+                    result.newly_allowed += 1
+                    result.newly_allowed_amount += cents
+
+
+class _NumpyEngine:
+    """
+    Checks each batch a column at a time with NumPy.
+
+    Cards are given dense integer codes as they are first seen, and each scenario's lookup
+    tables become arrays indexed by card code: the amount window, whether the card restricts
+    categories (or merchants), and the sorted allowed (card, category or merchant ID) pairs
+    packed into one integer each, which a whole batch is binary-searched in.
+    """
+    name = 'numpy'
+
+    def __init__(self, scenarios):
+        self.cards = {}
+        self.tables = [[] for _ in range(scenarios)]
+        self.arrays = []
+
+    @staticmethod
+    def _allowed(tables, column):
+        restricted = numpy.array([table[column] is not None for table in tables], dtype=bool)
+        # A control without a known category or merchant allows ID 0, which nothing has
+        pairs = sorted(
+            card << 32 | (value or 0)
+            for card, table in enumerate(tables) if table[column] is not None
+            for value in table[column]
+        )
+        return restricted, numpy.array(pairs, dtype=numpy.int64)
+
+    def add_cards(self, card_ids, rules):
+        for card_id in card_ids:
+            self.cards[card_id] = len(self.cards)
+            for scenario, table in enumerate(rules[card_id]):
+                self.tables[scenario].append(table)
+        if card_ids or not self.arrays:
+            limits = numpy.iinfo(numpy.int64)
+            self.arrays = [
+                (
+                    numpy.array([table[2] if table[2] is not None else limits.min for table in tables], dtype=numpy.int64),
+                    numpy.array([table[3] if table[3] is not None else limits.max for table in tables], dtype=numpy.int64),
+                    self._allowed(tables, 0),
+                    self._allowed(tables, 1),
+                )
+                for tables in self.tables
+            ]
+
+    @staticmethod
+    def _contains(pairs, keys):
+        # Binary search of the sorted pairs, without sorting the keys as np.isin would
+        if not len(pairs):
+            return numpy.zeros(len(keys), dtype=bool)
+        return pairs[numpy.minimum(numpy.searchsorted(pairs, keys), len(pairs) - 1)] == keys
+
+    def flags(self, columns, scenario):
+        cards, categories, merchants, cents = columns
+        low, high, (category_restricted, category_pairs), (merchant_restricted, merchant_pairs) = self.arrays[scenario]
+        flags = (category_restricted[cards] & ~self._contains(category_pairs, cards << 32 | categories)).astype(numpy.uint8)
+        flags |= (merchant_restricted[cards] & ~self._contains(merchant_pairs, cards << 32 | merchants)).astype(numpy.uint8) << 1
+        flags |= (cents > high[cards]).astype(numpy.uint8) << 2
+        flags |= (cents < low[cards]).astype(numpy.uint8) << 3
+        return flags
+
+    def evaluate(self, rows, results):
+        card_ids, categories, merchants, cents, approved = zip(*rows)
+        cents = numpy.array(cents, dtype=numpy.int64)
+        columns = (
+            numpy.fromiter(map(self.cards.__getitem__, card_ids), dtype=numpy.int64, count=len(card_ids)),
+            numpy.array(categories, dtype=numpy.int64),
+            numpy.array(merchants, dtype=numpy.int64),
+            cents,
+        )
+        approved = numpy.array(approved, dtype=bool)
+        current = self.flags(columns, 0)
+        was_declined = current != 0
+        for scenario, result in enumerate(results):
+            after = current if scenario == 0 else self.flags(columns, scenario)
+            declined = after != 0
+            for flag, code in FLAG_CODES.items():
+                count = int(numpy.count_nonzero(after & flag))
+                if count:
+                    result.by_code[code] += count
+            for mask, count, amount in (
+                (declined, 'declined', None),
+                (declined & ~was_declined, 'newly_declined', 'newly_declined_amount'),
+                (was_declined & ~declined, 'newly_allowed', 'newly_allowed_amount'),
+                (declined & approved, 'approved_declined', 'approved_declined_amount'),
+            ):
+                setattr(result, count, getattr(result, count) + int(numpy.count_nonzero(mask)))
+                if amount is not None:
+                    setattr(result, amount, getattr(result, amount) + int(cents[mask].sum()))
+
+
+def simulate(proposals, filters, batch_size=DEFAULT_BATCH_SIZE, use_numpy=None):
+    """
+    Replay the current organisation's transactions matching the history `filters` under
+    the current controls and each of `proposals`. Returns a SimulationResult.
+
+    NumPy is used when it is installed unless `use_numpy` is False.
+    """
+    started = time.perf_counter()
+    use_numpy = numpy is not None if use_numpy is None else use_numpy
+    engine = (_NumpyEngine if use_numpy else _PythonEngine)(len(proposals) + 1)
+    result = SimulationResult(ScenarioResult('current'), [ScenarioResult(proposal.name) for proposal in proposals], engine=engine.name)
+
+    rules, compiled = {}, {}
+    for batch in history_batches(filters, batch_size):
+        engine.add_cards(_load_rules(list(dict.fromkeys(map(itemgetter(0), batch))), proposals, rules, compiled), rules)
+        engine.evaluate(batch, [result.current] + result.proposals)
+        result.transactions += len(batch)
+    result.seconds = time.perf_counter() - started
+    return result
@@ -0,0 +1,54 @@
+import logging
+from decimal import Decimal
+
+from taskqueue.queue import task
+from cards.models import CardControl
+from merchants.interning import categories, merchants
+from .authorization import decline_rows
+from .models import Transaction, TransactionDecline
+from .rollups import add_to_rollups
+
+notification_logger = logging.getLogger('weel.notifications')
+
+
+@task('transactions.record_declined')
+def record_declined(card_id, amount, merchant, merchant_category, declines, idempotency_key=None):
+    """
+    Write the record of a transaction declined by the async authorization path.
+
+    `declines` holds [code, [control IDs]] pairs. Controls deleted since the decline
+    are dropped from it rather than failing the task. The merchant and category arrive
+    as names and are only interned here, as the decline is recorded. A decline whose
+    idempotency key is already recorded was a retry and is skipped.
+    """
+    if idempotency_key is not None and Transaction.objects.filter(idempotency_key=idempotency_key).exists():
+        return
+    transaction = Transaction.objects.create(
+        idempotency_key=idempotency_key,
+        card_id=card_id,
+        # Decimals arrive as strings
+        amount=Decimal(amount),
+        merchant_id=merchants.intern(merchant),
+        merchant_category_id=categories.intern(merchant_category),
+        approved=False,
+    )
+    existing = set(CardControl.objects.filter(id__in=[i for _, ids in declines for i in ids]).values_list('id', flat=True))
+    rows = decline_rows(transaction, [
+        (code, [CardControl(id=i) for i in ids if i in existing])
+        for code, ids in declines
+    ])
+    TransactionDecline.objects.bulk_create(rows)
+    add_to_rollups([transaction])
+
+
+@task('transactions.notify')
+def notify(card_id, status, amount, merchant, transaction_id=None, reasons=()):
+    """
+    Tell the cardholder about an authorization. Notifications go to the
+    'weel.notifications' logger until a delivery channel is wired up.
+    """
+    notification_logger.info(
+        "Card %s: %s transaction of %s at %s%s",
+        card_id, status, amount, merchant, f" ({'; '.join(reasons)})" if reasons else "",
+        extra={'transaction_id': transaction_id},
+    )
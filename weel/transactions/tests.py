@@ -1,13 +1,44 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
 from django.urls import reverse
 from cards.models import Card, CardControl
+from cards.declines import DeclineCode
+from organisations.models import Organisation
+from organisations.tenancy import use_organisation
+from . import idempotency
+from .models import ArchivedCardTotal, Reversal, ReversalKind, SpendRollup, Transaction, TransactionArchive, TransactionDecline
+from .archive import archived_history
+from .reversals import ReversalRequest, reverse_transactions
+from .rollups import backfill_rollups
+from .simulation import numpy, parse_proposal, simulate
+from cards.controls import CompiledControls
+from weel.pagination import InvalidCursor, encode_cursor
+from merchants.interning import categories, merchants
+from merchants.models import Merchant, MerchantCategory
+from ledger.models import EntryKind, LedgerEntry
+from taskqueue.models import Task
+from taskqueue.queue import run_pending
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import skipUnless
+import gzip
+from io import StringIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
 import json
+import os
 
 class TransactionViewsTests(TestCase):
     def setUp(self):
         self.card = Card.objects.create(
             cardholder_name='John Doe',
-            expiration_date='2023-01-01',
+            expiration_date='2030-01-01',
             balance=10000.00,
             is_active=True
         )
@@ -40,6 +71,47 @@ class TransactionViewsTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("approved", response.json()['status'])
 
+    def test_approval_with_warm_cache_reads_no_card_or_controls(self):
+        data = {"card": self.card.id, "amount": "50.00", "merchant": "Woolworths", "merchant_category": "food"}
+        # Interned names are only cached once the transaction that read them commits
+        self.addCleanup(merchants.clear)
+        self.addCleanup(categories.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.json()['status'], 'approved')
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('SELECT')])
+
+    def test_spellings_of_a_merchant_match_its_control(self):
+        data = {"card": self.card.id, "amount": "50.00", "merchant": " WOOLWORTHS. ", "merchant_category": "Food"}
+        response = self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        transaction = Transaction.objects.select_related('merchant').get()
+        self.assertEqual(transaction.merchant_id, self.merchant_control.merchant_id)
+        self.assertEqual(transaction.merchant.name, 'Woolworths')
+
+    def test_unrecorded_attempts_intern_no_names(self):
+        data = {"card": 999999, "amount": "50.00", "merchant": "Aldi", "merchant_category": "groceries"}
+        response = self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.json()['reasons'], ["Card not found"])
+        self.assertFalse(Merchant.objects.filter(key='aldi').exists())
+        self.assertFalse(MerchantCategory.objects.filter(key='groceries').exists())
+
+    def test_invalid_merchant_is_rejected(self):
+        data = {"card": self.card.id, "amount": "50.00", "merchant": "...", "merchant_category": "food"}
+        response = self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_invalid_amounts_are_rejected(self):
+        for amount in ("-10.00", "0", "NaN", "Infinity", "10.001", "100000000.00", "1e100"):
+            data = {"card": self.card.id, "amount": amount, "merchant": "Woolworths", "merchant_category": "food"}
+            response = self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+            self.assertEqual(response.status_code, 400, amount)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(self.card.balance, Decimal('10000.00'))
+
     # Declined scenarios
     def test_transaction_declined_by_category_control(self):
         data = {"card": self.card.id, "amount": "20.00", "merchant": "Woolworths", "merchant_category": "1234"}
@@ -94,3 +166,883 @@ class TransactionViewsTests(TestCase):
         self.assertEqual(len(response.json()['reasons']), 4)
 
 
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+        for amount in range(1, 6):
+            Transaction.objects.create(card=self.card, amount=amount, merchant_id=merchants.intern('Woolworths'), merchant_category_id=categories.intern('food'), approved=True)
+
+    def test_pages_newest_first(self):
+        first = self.client.get(reverse('transactions'), {'limit': 3}).json()
+        self.assertEqual([t['amount'] for t in first['transactions']], ['5.00', '4.00', '3.00'])
+        second = self.client.get(reverse('transactions'), {'limit': 3, 'cursor': first['next_cursor']}).json()
+        self.assertEqual([t['amount'] for t in second['transactions']], ['2.00', '1.00'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_tampered_cursor_is_rejected(self):
+        for values in (["not a timestamp", 1], ["2025-03-10T09:00:00+00:00", "x"], [None, 1], [{"a": 1}, [2]]):
+            response = self.client.get(reverse('transactions'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+
+    def test_ndjson_export(self):
+        response = self.client.get(reverse('transactions'), {'format': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+
+
+class TransactionBatchTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        self.other_card = Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=50.00)
+        CardControl.objects.create(card=self.other_card, control_type='merchant', detail='Woolworths')
+
+    def post_batch(self, items):
+        return self.client.post(reverse('transactions-batch'), json.dumps(items), content_type="application/json")
+
+    def test_batch_uses_running_balances(self):
+        items = [
+            {"card": self.card.id, "amount": "60.00", "merchant": "Woolworths", "merchant_category": "food"},
+            {"card": self.card.id, "amount": "60.00", "merchant": "Woolworths", "merchant_category": "food"},
+            {"card": self.card.id, "amount": "40.00", "merchant": "Woolworths", "merchant_category": "food"},
+        ]
+        results = self.post_batch(items).json()['results']
+        self.assertEqual([r['status'] for r in results], ['approved', 'declined', 'approved'])
+        self.assertIn("Insufficient funds", results[1]['reasons'])
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('0.00'))
+        self.assertEqual(Transaction.objects.filter(card=self.card).count(), 3)
+
+    def test_batch_applies_controls_per_card(self):
+        items = [
+            {"card": self.other_card.id, "amount": "10.00", "merchant": "Target", "merchant_category": "food"},
+            {"card": self.other_card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food"},
+        ]
+        results = self.post_batch(items).json()['results']
+        self.assertEqual([r['status'] for r in results], ['declined', 'approved'])
+        self.other_card.refresh_from_db()
+        self.assertEqual(self.other_card.balance, Decimal('40.00'))
+
+    def test_batch_reports_invalid_items_in_place(self):
+        items = [
+            {"card": 999999, "amount": "10.00", "merchant": "Aldi", "merchant_category": "food"},
+            {"card": self.card.id, "merchant": "Coles", "merchant_category": "food"},
+            {"card": self.card.id, "amount": "10.00", "merchant": "Target", "merchant_category": "food"},
+        ]
+        results = self.post_batch(items).json()['results']
+        self.assertEqual(results[0]['reasons'], ["Card not found"])
+        self.assertEqual(results[1]['status'], 'declined')
+        self.assertEqual(results[2]['status'], 'approved')
+        # Only the recorded transaction's names are interned
+        self.assertEqual(list(Merchant.objects.exclude(key='woolworths').values_list('key', flat=True)), ['target'])
+
+    def test_batch_rejects_invalid_amounts_in_place(self):
+        amounts = ["-10.00", "NaN", "100000000.00", "10.00"]
+        items = [{"card": self.card.id, "amount": amount, "merchant": "Target", "merchant_category": "food"} for amount in amounts]
+        response = self.post_batch(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in response.json()['results']], ['declined', 'declined', 'declined', 'approved'])
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('90.00'))
+
+    def test_batch_must_be_an_array(self):
+        response = self.post_batch({"card": self.card.id})
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_benchmark_reports_latency_and_queries(self):
+        with NamedTemporaryFile(suffix='.json') as f:
+            call_command('benchmark', '--current-database', '--cards', 3, '--controls', 4, '--requests', 20, '--list-requests', 2, '--output', f.name, stdout=StringIO())
+            results = json.load(f)
+        post = results['scenarios']['transactions_post']
+        self.assertEqual(post['requests'], 20)
+        self.assertEqual(set(post['latency_ms']), {'p50', 'p95', 'p99', 'max'})
+        self.assertGreater(post['queries_per_request'], 0)
+        self.assertEqual(set(results['scenarios']), {'transactions_post', 'cards_list', 'cards_list_fields', 'card_controls_list', 'transactions_list'})
+
+
+@skipUnless(connection.vendor == 'sqlite', "Plans are asserted against SQLite's EXPLAIN QUERY PLAN output")
+class TransactionQueryPlanTests(TestCase):
+    """
+    Each history query must be answered from its index, without a table scan or a
+    temporary B-tree for the ORDER BY.
+    """
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=10.00)
+        self.since = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        # Queries made for a request are scoped to its organisation
+        self.transactions = Transaction.objects.for_organisation(self.card.organisation)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {index}", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_card_history_newest_first(self):
+        self.assertUsesIndex(self.transactions.filter(card=self.card).order_by('-timestamp', '-id'), 'transaction_card_time_idx')
+
+    def test_card_history_in_time_range(self):
+        queryset = self.transactions.filter(card=self.card, timestamp__gte=self.since).order_by('-timestamp', '-id')
+        self.assertUsesIndex(queryset, 'transaction_card_time_idx')
+
+    def test_recent_declines(self):
+        self.assertUsesIndex(self.transactions.filter(approved=False, timestamp__gte=self.since), 'transaction_declined_idx')
+
+    def test_history_list_newest_first(self):
+        self.assertUsesIndex(self.transactions.order_by('-timestamp', '-id')[:100], 'transaction_time_idx')
+
+    def test_card_controls_lookup(self):
+        self.assertUsesIndex(CardControl.objects.filter(card=self.card), 'card_control_type_idx')
+
+    def test_decline_counts_by_code(self):
+        queryset = TransactionDecline.objects.for_organisation(self.card.organisation).values('code').annotate(count=Count('transaction', distinct=True))
+        plan = queryset.explain()
+        self.assertIn("USING COVERING INDEX decline_code_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_declines_for_a_page(self):
+        self.assertUsesIndex(TransactionDecline.objects.filter(transaction_id__in=[1, 2, 3]).order_by('transaction_id', 'code', 'id'), 'transaction_decline_idx')
+
+    def test_idempotency_key_lookup(self):
+        self.assertUsesIndex(self.transactions.filter(idempotency_key='retry-1')[:1], 'transaction_idempotency_key')
+
+
+class TransactionHistoryFilterTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+        self.other_card = Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=1000.00)
+        Transaction.objects.create(card=self.card, amount=1, merchant_id=merchants.intern('Woolworths'), merchant_category_id=categories.intern('food'), approved=True)
+        declined = Transaction.objects.create(card=self.card, amount=2, merchant_id=merchants.intern('Woolworths'), merchant_category_id=categories.intern('food'), approved=False)
+        TransactionDecline.objects.create(transaction=declined, code=DeclineCode.INSUFFICIENT_FUNDS)
+        Transaction.objects.create(card=self.other_card, amount=3, merchant_id=merchants.intern('Woolworths'), merchant_category_id=categories.intern('food'), approved=False)
+
+    def test_filter_by_card_and_approval(self):
+        body = self.client.get(reverse('transactions'), {'card': self.card.id, 'approved': 'false'}).json()
+        self.assertEqual([t['amount'] for t in body['transactions']], ['2.00'])
+        self.assertEqual(body['transactions'][0]['reason_declined'], "Insufficient funds")
+        self.assertEqual(body['transactions'][0]['decline_codes'], ['insufficient_funds'])
+
+    def test_filter_by_time_range(self):
+        self.assertEqual(len(self.client.get(reverse('transactions'), {'since': '2000-01-01T00:00:00'}).json()['transactions']), 3)
+        self.assertEqual(len(self.client.get(reverse('transactions'), {'until': '2000-01-01T00:00:00'}).json()['transactions']), 0)
+
+    def test_invalid_filter(self):
+        self.assertEqual(self.client.get(reverse('transactions'), {'since': 'yesterday'}).status_code, 400)
+
+
+class AsyncAuthorizationTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        self.control = CardControl.objects.create(card=self.card, control_type='merchant', detail='Woolworths')
+
+    def authorize(self, **data):
+        data = {"card": self.card.id, "amount": "50.00", "merchant": "Woolworths", "merchant_category": "food", **data}
+        return self.client.post(reverse('transactions-authorize'), json.dumps(data), content_type="application/json")
+
+    def test_approval_debits_and_records_on_the_request_path(self):
+        response = self.authorize()
+        self.assertEqual(response.json()['status'], 'approved')
+        self.assertTrue(Transaction.objects.filter(id=response.json()['transaction_id'], approved=True).exists())
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('50.00'))
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['transactions.notify'])
+
+    def test_decline_is_recorded_in_the_background(self):
+        response = self.authorize(merchant="Target", amount="500.00")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Insufficient funds", response.json()['reasons'])
+        self.assertFalse(Transaction.objects.exists())
+        # Names are interned when the decline is recorded
+        self.assertFalse(Merchant.objects.filter(key='target').exists())
+
+        with self.assertLogs('weel.notifications', 'INFO'):
+            run_pending()
+        declined = Transaction.objects.get()
+        self.assertFalse(declined.approved)
+        self.assertEqual(declined.amount, Decimal('500.00'))
+        self.assertEqual(declined.merchant.name, 'Target')
+        self.assertEqual(
+            sorted(declined.declines.values_list('code', 'control_id')),
+            [(DeclineCode.INSUFFICIENT_FUNDS, None), (DeclineCode.MERCHANT_NOT_ALLOWED, self.control.id)],
+        )
+
+    def test_invalid_amounts_are_rejected(self):
+        for amount in ("-10.00", "NaN", "100000000.00"):
+            self.assertEqual(self.authorize(amount=amount).status_code, 400, amount)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Task.objects.exists())
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('100.00'))
+
+    def test_unknown_card(self):
+        response = self.authorize(card=999999, merchant="Aldi")
+        self.assertEqual(response.json()['reasons'], ["Card not found"])
+        self.assertFalse(Merchant.objects.filter(key='aldi').exists())
+
+
+class VelocityControlTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+        CardControl.objects.create(card=self.card, control_type='daily_amount', amount=100)
+        CardControl.objects.create(card=self.card, control_type='hourly_count', amount=3)
+
+    def post(self, amount):
+        data = {"card": self.card.id, "amount": amount, "merchant": "Woolworths", "merchant_category": "food"}
+        return self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+
+    def test_daily_spend_limit(self):
+        self.assertEqual(self.post("60.00").status_code, 200)
+        response = self.post("50.00")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("daily spend limit", response.json()['reasons'][0])
+        self.assertEqual(self.post("40.00").status_code, 200)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('900.00'))
+
+    def test_hourly_transaction_count(self):
+        for _ in range(3):
+            self.assertEqual(self.post("1.00").status_code, 200)
+        response = self.post("1.00")
+        self.assertIn("hourly limit of 3 transactions", response.json()['reasons'][0])
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.balance, Decimal('997.00'))
+
+    def test_batch_applies_limits_with_running_counters(self):
+        items = [{"card": self.card.id, "amount": "40.00", "merchant": "Woolworths", "merchant_category": "food"}] * 4
+        results = self.client.post(reverse('transactions-batch'), json.dumps(items), content_type="application/json").json()['results']
+        self.assertEqual([r['status'] for r in results], ['approved', 'approved', 'declined', 'declined'])
+        self.assertEqual(self.post("20.00").status_code, 200)
+        self.assertEqual(self.post("1.00").status_code, 400)
+
+
+class DeclineCodeTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        self.controls = [
+            CardControl.objects.create(card=self.card, control_type='merchant', detail='Woolworths'),
+            CardControl.objects.create(card=self.card, control_type='merchant', detail='Coles'),
+            CardControl.objects.create(card=self.card, control_type='max_amount', amount=50),
+        ]
+
+    def post(self, **data):
+        data = {"card": self.card.id, "amount": "10.00", "merchant": "Woolworths", "merchant_category": "food", **data}
+        return self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+
+    def test_declines_are_stored_as_codes_and_rendered_on_read(self):
+        response = self.post(merchant="Target", amount="60.00")
+        self.assertEqual(response.json()['reasons'], [
+            "Transaction merchant 'Target' does not match required merchant 'Coles' or 'Woolworths'.",
+            "Transaction amount '60.00' exceeds the maximum allowed amount of '50.00'.",
+        ])
+        declines = TransactionDecline.objects.order_by('code', 'control_id')
+        self.assertEqual(
+            [(decline.code, decline.control_id) for decline in declines],
+            [(DeclineCode.MERCHANT_NOT_ALLOWED, self.controls[0].id), (DeclineCode.MERCHANT_NOT_ALLOWED, self.controls[1].id), (DeclineCode.ABOVE_MAXIMUM_AMOUNT, self.controls[2].id)],
+        )
+        transaction = self.client.get(reverse('transactions')).json()['transactions'][0]
+        self.assertEqual(transaction['reason_declined'], ", ".join(response.json()['reasons']))
+        self.assertEqual(transaction['decline_codes'], ['merchant_not_allowed', 'above_maximum_amount'])
+
+    def test_deleted_control_falls_back_to_generic_message(self):
+        self.post(amount="60.00")
+        self.controls[2].delete()
+        transaction = self.client.get(reverse('transactions'), {'format': 'ndjson'})
+        row = json.loads(b''.join(transaction.streaming_content))
+        self.assertEqual(row['reason_declined'], "Transaction amount '60.00' exceeds the maximum allowed amount.")
+
+    def test_batch_records_codes(self):
+        items = [{"card": self.card.id, "amount": "80.00", "merchant": "Coles", "merchant_category": "food"}] * 2
+        self.client.post(reverse('transactions-batch'), json.dumps(items), content_type="application/json")
+        self.assertEqual(TransactionDecline.objects.filter(code=DeclineCode.ABOVE_MAXIMUM_AMOUNT).count(), 2)
+
+    def test_decline_summary(self):
+        self.post(merchant="Target")
+        self.post(merchant="Target", amount="60.00")
+        self.post(amount="500.00")
+        body = self.client.get(reverse('transactions-declines')).json()
+        self.assertEqual(body['declines'], [
+            {"code": "merchant_not_allowed", "description": "Merchant not allowed", "count": 2},
+            {"code": "above_maximum_amount", "description": "Above maximum amount", "count": 2},
+            {"code": "insufficient_funds", "description": "Insufficient funds", "count": 1},
+        ])
+        self.assertEqual(self.client.get(reverse('transactions-declines'), {'until': '2000-01-01T00:00:00'}).json()['declines'], [])
+        self.assertEqual(self.client.get(reverse('transactions-declines'), {'card': 'x'}).status_code, 400)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+        self.data = {"card": self.card.id, "amount": "60.00", "merchant": "Woolworths", "merchant_category": "food"}
+
+    def post(self, key, **data):
+        return self.client.post(
+            reverse('transactions'), json.dumps({**self.data, **data}), content_type="application/json", headers={"Idempotency-Key": key},
+        )
+
+    def test_retry_returns_the_original_result_without_debiting_again(self):
+        first = self.post('retry-1')
+        with self.assertNumQueries(0):
+            retry = self.post('retry-1')
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.card.balance, Decimal('40.00'))
+        # A new key is a new transaction, declined for want of funds
+        self.assertEqual(self.post('retry-2').status_code, 400)
+
+    def test_retry_after_the_cache_expires_reads_the_stored_transaction(self):
+        self.post('retry-1', amount="500.00")
+        caches['default'].clear()
+        # The organisation, the transaction by its key and its declines
+        with self.assertNumQueries(3):
+            retry = self.post('retry-1', amount="500.00")
+        self.assertEqual((retry.status_code, retry.json()['reasons']), (400, ["Insufficient funds"]))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_concurrent_attempt_loses_to_the_committed_one(self):
+        first = self.post('retry-1')
+        caches['default'].clear()
+        # The first lookup misses, as if it ran before the first attempt committed
+        lookups = []
+        def recall(key, parsed):
+            lookups.append(key)
+            return idempotency.recall(key, parsed) if len(lookups) > 1 else None
+        with mock.patch('transactions.views.recall', recall):
+            retry = self.post('retry-1')
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(LedgerEntry.objects.filter(card=self.card).count(), 2)
+        self.assertEqual(self.card.balance, Decimal('40.00'))
+
+    def test_key_reused_for_a_different_transaction(self):
+        self.post('retry-1')
+        response = self.post('retry-1', amount="10.00")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def authorize(self, key, **data):
+        return self.client.post(
+            reverse('transactions-authorize'), json.dumps({**self.data, **data}), content_type="application/json", headers={"Idempotency-Key": key},
+        )
+
+    def test_async_retry_is_not_debited_again(self):
+        first = self.authorize('retry-1')
+        retry = self.authorize('retry-1')
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.get().idempotency_key, 'retry-1')
+        self.assertEqual(self.card.balance, Decimal('40.00'))
+        # The synchronous endpoint shares the keys
+        self.assertEqual(self.post('retry-1').json(), first.json())
+        self.assertEqual(self.authorize('retry-1', amount="10.00").status_code, 422)
+
+    def test_async_decline_is_recorded_once_under_its_key(self):
+        first = self.authorize('retry-1', amount="500.00")
+        # Answered from the cache before the decline is recorded
+        self.assertEqual(self.authorize('retry-1', amount="500.00").json(), first.json())
+        with self.assertLogs('weel.notifications', 'INFO'):
+            run_pending()
+        declined = Transaction.objects.get()
+        self.assertEqual((declined.approved, declined.idempotency_key), (False, 'retry-1'))
+        caches['default'].clear()
+        retry = self.authorize('retry-1', amount="500.00")
+        self.assertEqual((retry.status_code, retry.json()['reasons']), (400, ["Insufficient funds"]))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_async_concurrent_attempt_loses_to_the_committed_one(self):
+        first = self.authorize('retry-1')
+        caches['default'].clear()
+        lookups = []
+        def recall(key, parsed):
+            lookups.append(key)
+            return idempotency.recall(key, parsed) if len(lookups) > 1 else None
+        with mock.patch('transactions.views.recall', recall):
+            retry = self.authorize('retry-1')
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(self.card.balance, Decimal('40.00'))
+
+    def test_batches_reject_keys(self):
+        response = self.client.post(reverse('transactions-batch'), json.dumps([self.data]), content_type="application/json", headers={"Idempotency-Key": 'retry-1'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_invalid_key(self):
+        response = self.post('x' * 256)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(TRANSACTION_ARCHIVE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = directory.name
+
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+        self.other = Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=1000.00)
+        CardControl.objects.create(card=self.card, control_type='merchant', detail='Woolworths')
+        for card, amount, merchant, timestamp in [
+            (self.card, "10.00", "Woolworths", datetime(2025, 1, 5, tzinfo=timezone.utc)),
+            (self.other, "20.00", "Coles", datetime(2025, 1, 20, tzinfo=timezone.utc)),
+            (self.card, "30.00", "Target", datetime(2025, 2, 3, tzinfo=timezone.utc)),
+            (self.card, "40.00", "Woolworths", datetime(2025, 2, 28, 23, 59, tzinfo=timezone.utc)),
+            (self.card, "50.00", "Woolworths", None),
+            (self.other, "60.00", "Coles", None),
+        ]:
+            data = {"card": card.id, "amount": amount, "merchant": merchant, "merchant_category": "food"}
+            self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+            if timestamp is not None:
+                Transaction.objects.filter(pk=Transaction.objects.latest('id').pk).update(timestamp=timestamp)
+
+    def archive(self):
+        out = StringIO()
+        call_command('archive_transactions', '--older-than', '365', '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def history(self, query=''):
+        pages, cursor = [], None
+        while True:
+            params = f"?limit=2&{query}" + (f"&cursor={cursor}" if cursor else '')
+            body = self.client.get(reverse('transactions') + params).json()
+            pages.append(body['transactions'])
+            if not (cursor := body['next_cursor']):
+                return pages
+
+    def test_old_months_are_moved_to_files(self):
+        self.assertIn("default: archived 4 transactions in 2 months", self.archive())
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertFalse(TransactionDecline.objects.exists())
+        self.assertEqual(
+            sorted(TransactionArchive.objects.values_list('month', 'transactions')),
+            [(datetime(2025, 1, 1).date(), 2), (datetime(2025, 2, 1).date(), 2)],
+        )
+        for archive in TransactionArchive.objects.all():
+            self.assertTrue(os.path.exists(os.path.join(self.directory, archive.path)))
+        self.assertEqual(
+            sorted(ArchivedCardTotal.objects.values_list('card_id', 'approved_count', 'approved_total')),
+            [(self.card.pk, 1, Decimal('10.00')), (self.card.pk, 1, Decimal('40.00')), (self.other.pk, 1, Decimal('20.00'))],
+        )
+        self.assertIn("archived 0 transactions in 0 months", self.archive())
+
+    def test_history_reads_through_to_the_archive(self):
+        queries = ['', 'approved=false', f'card={self.card.pk}', 'since=2025-02-01&fields=id,reason_declined', 'until=2025-02-01']
+        before = {query: self.history(query) for query in queries}
+        self.archive()
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertEqual(self.history(query), before[query])
+        self.assertEqual([len(page) for page in before['']], [2, 2, 2])
+        self.assertEqual(before['approved=false'][0][0]['reason_declined'], "Transaction merchant 'Target' does not match required merchant 'Woolworths'.")
+
+    def test_card_history_only_opens_the_card_s_months(self):
+        declined_only = Card.objects.create(cardholder_name='Jim Doe', expiration_date='2030-01-01', balance=1.00)
+        data = {"card": declined_only.id, "amount": "5.00", "merchant": "Coles", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+        Transaction.objects.filter(card=declined_only).update(timestamp=datetime(2025, 2, 10, tzinfo=timezone.utc))
+        self.archive()
+        for filters, months, count in [
+            ({'card_id': self.other.pk}, ['2025-01'], 1),
+            ({'card_id': declined_only.pk}, ['2025-02'], 1),
+            ({'card_id': declined_only.pk, 'approved': True}, [], 0),
+            ({'card_id': self.card.pk, 'approved': True}, ['2025-02', '2025-01'], 2),
+        ]:
+            with self.subTest(filters=filters), mock.patch.object(gzip, 'open', wraps=gzip.open) as opened:
+                self.assertEqual(len(list(archived_history(filters))), count)
+                self.assertEqual([call.args[0].name for call in opened.call_args_list], [f'transactions-{month}.ndjson.gz' for month in months])
+
+    def test_invalid_archive_cursor_is_rejected(self):
+        self.archive()
+        # Sorts before every recent transaction, so the page continues straight into the archive
+        for values in (["2025-03-01T00:00:00", 999999], ["2025-03-01T00:00:00+00:00", "x"]):
+            response = self.client.get(reverse('transactions'), {'cursor': encode_cursor(values)})
+            self.assertEqual(response.status_code, 400, values)
+        for after in (["not a timestamp", 1], [None, 1], ["2025-03-01T00:00:00+00:00"]):
+            with self.assertRaises(InvalidCursor):
+                next(archived_history({}, after))
+
+    def test_export_includes_the_archive(self):
+        export = lambda: b''.join(self.client.get(reverse('transactions') + '?format=ndjson').streaming_content)
+        before = export()
+        self.archive()
+        self.assertEqual(export(), before)
+
+    def test_ledger_still_balances(self):
+        self.archive()
+        out = StringIO()
+        call_command('check_ledger', stdout=out)
+        self.assertIn("Checked 2 cards", out.getvalue())
+
+
+class ReversalTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=100.00)
+
+    def purchase(self, amount="60.00"):
+        data = {"card": self.card.id, "amount": amount, "merchant": "Woolworths", "merchant_category": "food"}
+        return self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json").json().get('transaction_id')
+
+    def reverse(self, transaction_id, **data):
+        return self.client.post(reverse('transactions-reversals', args=[transaction_id]), json.dumps(data), content_type="application/json")
+
+    def test_reversal_credits_the_card_and_links_the_transaction(self):
+        transaction_id = self.purchase()
+        response = self.reverse(transaction_id)
+        self.assertEqual(response.status_code, 200)
+        reversal = Reversal.objects.get()
+        self.assertEqual(response.json(), {
+            "status": "reversed", "reversal_id": reversal.id, "transaction_id": transaction_id, "kind": "reversal", "amount": "60.00",
+        })
+        self.assertEqual(list(Transaction.objects.get().reversals.all()), [reversal])
+        self.assertEqual(LedgerEntry.objects.filter(kind=EntryKind.REVERSAL).values_list('amount', 'transaction_id').get(), (Decimal('60.00'), transaction_id))
+        self.assertEqual(self.card.balance, Decimal('100.00'))
+        self.assertEqual(self.reverse(transaction_id).json(), {"error": f"Transaction {transaction_id} has already been fully reversed"})
+
+    def test_refunds_never_exceed_the_transaction(self):
+        transaction_id = self.purchase()
+        self.assertEqual(self.reverse(transaction_id, kind='refund', amount='25.00').status_code, 200)
+        self.assertEqual(self.reverse(transaction_id, kind='refund', amount='35.01').json(), {"error": f"Only 35.00 of transaction {transaction_id} can be returned"})
+        self.assertEqual(self.reverse(transaction_id, kind='refund').json()['amount'], "35.00")
+        self.assertEqual(self.card.balance, Decimal('100.00'))
+
+    def test_partial_capture_returns_the_rest_of_the_authorization(self):
+        transaction_id = self.purchase()
+        self.assertEqual(self.reverse(transaction_id, kind='capture', amount='45.50').json()['amount'], "14.50")
+        self.assertEqual(self.card.balance, Decimal('54.50'))
+        self.assertEqual(self.reverse(transaction_id, kind='capture', amount='50.00').status_code, 400)
+        # Captured in full: recorded, with nothing to credit
+        self.assertEqual(self.reverse(self.purchase("10.00"), kind='capture', amount='10.00').json()['amount'], "0.00")
+        self.assertEqual(LedgerEntry.objects.filter(kind=EntryKind.REVERSAL).count(), 1)
+
+    def test_invalid_reversals(self):
+        transaction_id = self.purchase()
+        declined_id = Transaction.objects.create(card=self.card, amount=5, merchant_id=merchants.intern('Coles'), merchant_category_id=categories.intern('food')).id
+        for args, data, error in (
+            ([declined_id], {}, f"Transaction {declined_id} was declined"),
+            ([transaction_id + 100], {}, f"Transaction {transaction_id + 100} not found"),
+            ([transaction_id], {'amount': '-1'}, "Invalid amount '-1'"),
+            ([transaction_id], {'amount': '1.001'}, "Invalid amount '1.001'"),
+            ([transaction_id], {'kind': 'chargeback'}, "Invalid kind 'chargeback', expected one of reversal, refund, capture"),
+            ([transaction_id], {'kind': 'capture'}, "Missing field 'amount'"),
+        ):
+            with self.subTest(data=data):
+                response = self.reverse(*args, **data)
+                self.assertEqual((response.status_code, response.json()), (400, {"error": error}))
+        self.assertFalse(Reversal.objects.exists())
+
+    def test_repeated_reference_returns_the_original_reversal(self):
+        transaction_id = self.purchase("20.00")
+        first = self.reverse(transaction_id, kind='refund', amount='5.00', reference='rf-1')
+        retry = self.reverse(transaction_id, kind='refund', amount='5.00', reference='rf-1')
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.card.balance, Decimal('85.00'))
+        other = self.purchase("20.00")
+        self.assertEqual(self.reverse(other, reference='rf-1').json(), {"error": f"Reference 'rf-1' was already used for transaction {transaction_id}"})
+
+    def test_chunk_is_applied_with_a_fixed_number_of_queries(self):
+        ids = [self.purchase("1.00") for _ in range(20)]
+        requests = [ReversalRequest(id, ReversalKind.REFUND, Decimal('0.50'), f"rf-{id}") for id in ids]
+        # Savepoint, transactions, applied references, amounts returned, reversals, ledger entries, release
+        with self.assertNumQueries(7):
+            outcomes = reverse_transactions(requests + requests[:1])
+        self.assertEqual([outcome.created for outcome in outcomes], [True] * 20 + [False])
+        self.assertEqual(self.card.balance, Decimal('90.00'))
+
+    def test_ingest_settlement_command(self):
+        ids = [self.purchase("10.00") for _ in range(3)]
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("transaction,kind,amount,reference\n")
+            file.write(f"{ids[0]},reversal,,s-1\n{ids[1]},refund,2.50,s-2\n{ids[2]},capture,7.00,s-3\n{ids[2]},refund,50.00,s-4\nx,refund,1,s-5\n")
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        with self.assertRaisesMessage(CommandError, "Rejected 2 rows"):
+            call_command('ingest_settlement', file.name, '--batch-size', '2', stdout=out)
+        self.assertIn(f"Line 5: Only 7.00 of transaction {ids[2]} can be returned", out.getvalue())
+        self.assertIn("Line 6: Invalid transaction 'x'", out.getvalue())
+        self.assertIn("Applied 3 reversals returning 15.50 and skipped 0 already applied of 5 rows", out.getvalue())
+        self.assertEqual(self.card.balance, Decimal('85.50'))
+
+        with self.assertRaises(CommandError):
+            call_command('ingest_settlement', file.name, stdout=out)
+        self.assertIn("Applied 0 reversals returning 0.00 and skipped 3 already applied", out.getvalue())
+        call_command('check_ledger', stdout=StringIO())
+
+
+class SimulationTests(TestCase):
+    def setUp(self):
+        self.food_card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=0)
+        CardControl.objects.create(card=self.food_card, control_type='category', detail='food')
+        self.card = Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=0)
+        CardControl.objects.create(card=self.card, control_type='max_amount', amount=100)
+        for card, amount, merchant, category, approved in (
+            (self.food_card, 20, 'Woolworths', 'food', True),
+            (self.food_card, 80, 'Coles', 'food', True),
+            (self.food_card, 30, 'Qantas', 'travel', False),
+            (self.card, 40, 'Qantas', 'travel', True),
+            (self.card, 150, 'Qantas', 'travel', False),
+        ):
+            Transaction.objects.create(card=card, amount=amount, merchant_id=merchants.intern(merchant), merchant_category_id=categories.intern(category), approved=approved)
+
+    def simulate(self, *proposals, **filters):
+        return simulate([parse_proposal(proposal, index) for index, proposal in enumerate(proposals)], filters, use_numpy=False)
+
+    def test_proposals_report_the_declines_they_add_and_remove(self):
+        result = self.simulate(
+            {"name": "lower max", "controls": [{"control_type": "max_amount", "amount": "50.00"}]},
+            {"controls": [{"control_type": "merchant", "detail": "Woolworths"}], "remove": ["category", "max_amount"]},
+        )
+        self.assertEqual((result.transactions, result.current.declined, result.current.approved_declined), (5, 2, 0))
+        lower, woolworths = [proposal.as_dict() for proposal in result.proposals]
+        self.assertEqual(lower, {
+            "name": "lower max",
+            "declined": 3,
+            "declined_by_code": {"category_not_allowed": 1, "above_maximum_amount": 2},
+            "newly_declined": {"count": 1, "amount": "80.00"},
+            "newly_allowed": {"count": 0, "amount": "0.00"},
+            "approved_declined": {"count": 1, "amount": "80.00"},
+        })
+        self.assertEqual(woolworths['name'], "proposal 2")
+        self.assertEqual(woolworths['declined_by_code'], {"merchant_not_allowed": 4})
+        self.assertEqual((woolworths['newly_declined'], woolworths['newly_allowed']), ({"count": 2, "amount": "120.00"}, {"count": 0, "amount": "0.00"}))
+
+    def test_narrowed_to_a_card_and_a_window(self):
+        proposal = {"controls": [], "remove": ["max_amount"]}
+        self.assertEqual(self.simulate(proposal, card_id=self.card.id).proposals[0].newly_allowed_amount, 15000)
+        self.assertEqual(self.simulate(proposal, timestamp__lt=datetime(2020, 1, 1, tzinfo=timezone.utc)).transactions, 0)
+
+    def test_matches_the_authorization_rules(self):
+        proposal = {"controls": [{"control_type": "min_amount", "amount": "25"}, {"control_type": "category", "detail": "travel"}]}
+        result = self.simulate(proposal)
+        controls = {
+            card.id: CompiledControls(
+                [control for control in card.controls.all() if control.control_type not in ('min_amount', 'category')]
+                + [CardControl(control_type='min_amount', amount=Decimal('25')), CardControl(control_type='category', detail='travel')]
+            )
+            for card in (self.food_card, self.card)
+        }
+        expected = sum(
+            bool(controls[t.card_id].evaluate(t.amount, t.merchant_id, t.merchant_category_id))
+            for t in Transaction.objects.all()
+        )
+        self.assertEqual(result.proposals[0].declined, expected)
+
+    @skipUnless(numpy is not None, "NumPy is not installed")
+    def test_numpy_matches_python(self):
+        proposals = [parse_proposal({"controls": [{"control_type": "max_amount", "amount": "30"}, {"control_type": "merchant", "detail": "Qantas"}]})]
+        vectorized, looped = (simulate(proposals, {}, batch_size=2, use_numpy=use) for use in (True, False))
+        self.assertEqual(vectorized.engine, 'numpy')
+        self.assertEqual(vectorized.proposals, looped.proposals)
+        self.assertEqual(vectorized.current, looped.current)
+
+    def test_endpoint(self):
+        url = reverse('transactions-simulate')
+        body = {"card": self.food_card.id, "proposals": [{"controls": [{"control_type": "max_amount", "amount": "50"}]}]}
+        response = self.client.post(url, json.dumps(body), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['transactions'], 3)
+        self.assertEqual(response.json()['proposals'][0]['approved_declined'], {"count": 1, "amount": "80.00"})
+        for body, error in (
+            ({"proposals": []}, "Expected an object with a list of 'proposals'"),
+            ({"proposals": [{"controls": [{"control_type": "daily_amount", "amount": 5}]}]}, "Cannot simulate controls of type 'daily_amount'"),
+            ({"proposals": [{"controls": [{"control_type": "max_amount"}]}]}, "A max_amount control needs an 'amount'"),
+            ({"since": "yesterday", "proposals": [{"controls": []}]}, "Invalid timestamp 'yesterday'"),
+            ({"proposals": [{"controls": [{"control_type": "max_amount", "amount": "NaN"}]}]}, "Invalid amount 'NaN'"),
+            ({"proposals": [{"controls": [{"control_type": "min_amount", "amount": "-5"}]}]}, "Invalid amount '-5'"),
+            ({"proposals": [{"controls": [{"control_type": "merchant", "detail": ["Qantas"]}]}]}, "A merchant control needs a 'detail'"),
+            ({"proposals": [{"remove": [{}]}]}, "Can only remove controls of type"),
+            ({"proposals": [{"remove": ["daily_amount"]}]}, "Can only remove controls of type"),
+        ):
+            with self.subTest(body=body):
+                response = self.client.post(url, json.dumps(body), content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(error, response.json()['error'])
+
+    def test_command(self):
+        with NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            json.dump([{"name": "no travel", "controls": [{"control_type": "category", "detail": "food"}]}], file)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('simulate_controls', file.name, '--no-numpy', stdout=out)
+        self.assertIn("Replayed 5 transactions", out.getvalue())
+        self.assertIn("no travel: declines 3, newly declined 1 (40.00), newly allowed 0 (0.00), approved but declined 1 (40.00)", out.getvalue())
+
+
+class SpendRollupTests(TestCase):
+    def setUp(self):
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+        self.other = Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=1000.00)
+        CardControl.objects.create(card=self.other, control_type='max_amount', amount=100)
+
+    def authorize(self, card, amount, merchant='Woolworths', category='food'):
+        data = {"card": card.id, "amount": amount, "merchant": merchant, "merchant_category": category}
+        return self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+
+    def spend(self, dimension, **params):
+        response = self.client.get(reverse('transactions-spend', args=[dimension]), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def rollups(self):
+        return sorted(SpendRollup.objects.values_list('dimension', 'key', 'period', 'start', 'approved_count', 'approved_amount', 'declined_count', 'declined_amount'))
+
+    def test_every_write_path_updates_the_rollups(self):
+        self.authorize(self.card, "10.00")
+        self.authorize(self.other, "500.00", merchant='Qantas', category='travel')
+        items = [{"card": self.other.id, "amount": "20.00", "merchant": "Coles", "merchant_category": "Food"}] * 2
+        self.client.post(reverse('transactions-batch'), json.dumps(items), content_type="application/json")
+        data = {"card": self.other.id, "amount": "200.00", "merchant": "Qantas", "merchant_category": "travel"}
+        self.client.post(reverse('transactions-authorize'), json.dumps(data), content_type="application/json")
+        run_pending()
+
+        food, travel = self.spend('categories')['results']
+        self.assertEqual(food, {
+            "id": categories.intern('food'), "name": "food", "approved_count": 3, "approved_amount": "50.00",
+            "declined_count": 0, "declined_amount": "0.00", "approval_rate": 1.0,
+        })
+        self.assertEqual((travel['name'], travel['declined_count'], travel['declined_amount'], travel['approval_rate']), ('travel', 2, '700.00', 0.0))
+        cards = {row['id']: row for row in self.spend('cards')['results']}
+        self.assertEqual((cards[self.other.id]['approved_count'], cards[self.other.id]['declined_count']), (2, 2))
+        self.assertEqual([row['name'] for row in self.spend('merchants')['results']], ['Coles', 'Woolworths', 'Qantas'])
+
+    def test_declined_and_replayed_requests_roll_back_with_their_transaction(self):
+        self.authorize(self.card, "10.00")
+        self.client.post(
+            reverse('transactions'), json.dumps({"card": self.card.id, "amount": "5.00", "merchant": "Coles", "merchant_category": "food"}),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY='key-1',
+        )
+        self.client.post(
+            reverse('transactions'), json.dumps({"card": self.card.id, "amount": "5.00", "merchant": "Coles", "merchant_category": "food"}),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY='key-1',
+        )
+        [card] = self.spend('cards')['results']
+        self.assertEqual((card['approved_count'], card['approved_amount']), (2, '15.00'))
+
+    def test_backfill_rebuilds_the_live_rollups(self):
+        self.authorize(self.card, "10.00")
+        self.authorize(self.card, "20.00", merchant='Coles')
+        self.authorize(self.other, "500.00")
+        live = self.rollups()
+        SpendRollup.objects.all().delete()
+        result = backfill_rollups(now=datetime.now(timezone.utc) + timedelta(days=1))
+        self.assertEqual((result.days, result.transactions), (1, 3))
+        self.assertEqual(self.rollups(), live)
+
+    def test_totals_combine_whole_days_with_edge_hours(self):
+        for amount, timestamp in (
+            ("1.00", datetime(2025, 3, 10, 21, 30, tzinfo=timezone.utc)),
+            ("2.00", datetime(2025, 3, 10, 22, 15, tzinfo=timezone.utc)),
+            ("4.00", datetime(2025, 3, 11, 12, 0, tzinfo=timezone.utc)),
+            ("8.00", datetime(2025, 3, 12, 23, 59, tzinfo=timezone.utc)),
+            ("16.00", datetime(2025, 3, 13, 0, 30, tzinfo=timezone.utc)),
+            ("32.00", datetime(2025, 3, 13, 1, 0, tzinfo=timezone.utc)),
+        ):
+            self.authorize(self.card, amount)
+            Transaction.objects.filter(pk=Transaction.objects.latest('id').pk).update(timestamp=timestamp)
+        out = StringIO()
+        call_command('backfill_rollups', '--since', '2025-03-01', '--until', '2025-04-01', stdout=out)
+        self.assertIn("default: rebuilt 31 days from 6 transactions", out.getvalue())
+
+        # A query for each of the days and the hours either side, and one for the names
+        with self.assertNumQueries(4):
+            [food] = self.spend('categories', since='2025-03-10T22:00:00', until='2025-03-13T00:59:00')['results']
+        self.assertEqual((food['approved_count'], food['approved_amount']), (4, '30.00'))
+        self.assertEqual(self.spend('categories', since='2025-03-10T21:45:00', until='2025-03-10T22:00:00')['results'][0]['approved_amount'], '1.00')
+        self.assertEqual(self.spend('cards', id=self.other.id, since='2025-03-01', until='2025-04-01')['results'], [])
+
+    def test_series_are_paged_by_bucket(self):
+        for amount, timestamp in (
+            ("1.00", datetime(2025, 3, 10, 9, tzinfo=timezone.utc)),
+            ("2.00", datetime(2025, 3, 10, 9, 59, tzinfo=timezone.utc)),
+            ("4.00", datetime(2025, 3, 10, 10, tzinfo=timezone.utc)),
+            ("8.00", datetime(2025, 3, 12, 10, tzinfo=timezone.utc)),
+        ):
+            self.authorize(self.card, amount)
+            Transaction.objects.filter(pk=Transaction.objects.latest('id').pk).update(timestamp=timestamp)
+        backfill_rollups(since=datetime(2025, 3, 1).date(), until=datetime(2025, 4, 1).date())
+
+        params = {"bucket": "day", "since": "2025-03-10T12:00:00", "until": "2025-03-13", "limit": 1}
+        first = self.spend('merchants', **params)
+        self.assertEqual(first['since'], '2025-03-10T00:00:00+00:00')
+        second = self.spend('merchants', **params, cursor=first['next_cursor'])
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(
+            [(row['start'], row['approved_amount']) for row in first['results'] + second['results']],
+            [('2025-03-10T00:00:00+00:00', '7.00'), ('2025-03-12T00:00:00+00:00', '8.00')],
+        )
+        hours = self.spend('cards', bucket='hour', since='2025-03-10', until='2025-03-11')['results']
+        self.assertEqual([(row['start'], row['approved_count']) for row in hours], [('2025-03-10T09:00:00+00:00', 2), ('2025-03-10T10:00:00+00:00', 1)])
+
+    def test_backfill_leaves_today_and_archived_months_alone(self):
+        self.authorize(self.card, "10.00")
+        live = self.rollups()
+        TransactionArchive.objects.create(month=datetime(2025, 1, 1).date(), path='archive.ndjson.gz', transactions=0)
+        result = backfill_rollups(since=datetime(2025, 1, 15).date(), until=datetime(2025, 2, 3).date())
+        self.assertEqual(result.days, 2)
+        self.assertEqual(backfill_rollups().days, 0)
+        self.assertEqual(self.rollups(), live)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(reverse('transactions-spend', args=['cardholders'])).status_code, 404)
+        tampered = encode_cursor(["yesterday", 1])
+        for params in ({"bucket": "week"}, {"since": "2025-03-02", "until": "2025-03-01"}, {"id": "x"}, {"since": "yesterday"}, {"bucket": "hour", "cursor": tampered}):
+            self.assertEqual(self.client.get(reverse('transactions-spend', args=['cards']), params).status_code, 400, params)
+        with self.assertRaises(CommandError):
+            call_command('backfill_rollups', '--since', '2025-02-30')
+
+
+class TransactionAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('ops', 'ops@example.com', 'password'))
+        self.card = Card.objects.create(cardholder_name='John Doe', expiration_date='2030-01-01', balance=1000.00)
+
+    def post(self, count, card=None):
+        data = {"card": (card or self.card).id, "amount": "1.00", "merchant": "Coles", "merchant_category": "food"}
+        for _ in range(count):
+            self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json")
+
+    def test_changelist_queries_do_not_grow_with_the_rows(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        self.post(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        # Read now; the log is cleared by the next request
+        few = queries.captured_queries
+        self.post(3, card=Card.objects.create(cardholder_name='Jane Doe', expiration_date='2030-01-01', balance=10.00))
+        with self.assertNumQueries(len(few)):
+            response = self.client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 5)
+        self.assertNotIn('SELECT DISTINCT', ' '.join(query['sql'] for query in few))
+
+    def test_every_organisation_is_listed(self):
+        acme = Organisation.objects.create(name='Acme', slug='acme')
+        with use_organisation(acme):
+            card = Card.objects.create(cardholder_name='Acme User', expiration_date='2030-01-01', balance=10.00)
+        data = {"card": card.id, "amount": "1.00", "merchant": "Coles", "merchant_category": "food"}
+        self.client.post(reverse('transactions'), json.dumps(data), content_type="application/json", headers={'X-Organisation': 'acme'})
+        self.post(1)
+        url = reverse('admin:transactions_transaction_changelist')
+        self.assertEqual(self.client.get(url).context['cl'].result_count, 2)
+        self.assertEqual(self.client.get(url, {'organisation__id__exact': acme.id}).context['cl'].result_count, 1)
+        transaction = Transaction.objects.unscoped().get(organisation=acme)
+        self.assertEqual(self.client.get(reverse('admin:transactions_transaction_change', args=[transaction.pk])).status_code, 200)
+
+    def test_filters_and_drilldown(self):
+        self.post(1)
+        now = datetime.now(timezone.utc)
+        url = reverse('admin:transactions_transaction_changelist')
+        for params in ({'approved__exact': '1'}, {'q': self.card.card_number}, {'timestamp__year': now.year, 'timestamp__month': now.month}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).context['cl'].result_count, 1)
+
+    def test_transactions_are_read_only(self):
+        self.post(1)
+        transaction = Transaction.objects.get()
+        self.assertEqual(self.client.get(reverse('admin:transactions_transaction_change', args=[transaction.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:transactions_transaction_add')).status_code, 403)
+        self.client.post(reverse('admin:transactions_transaction_delete', args=[transaction.pk]), {'post': 'yes'})
+        self.assertTrue(Transaction.objects.exists())
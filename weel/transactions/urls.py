@@ -1,6 +1,12 @@
 from django.urls import path
-from .views import transactions
+from .views import authorize, decline_summary, reversals, simulate_controls, spend, transactions, transactions_batch
 
 urlpatterns = [
     path('transactions/', transactions, name='transactions'),
+    path('transactions/batch/', transactions_batch, name='transactions-batch'),
+    path('transactions/authorize/', authorize, name='transactions-authorize'),
+    path('transactions/<int:transaction_id>/reversals/', reversals, name='transactions-reversals'),
+    path('transactions/declines/', decline_summary, name='transactions-declines'),
+    path('transactions/simulate/', simulate_controls, name='transactions-simulate'),
+    path('transactions/spend/<str:dimension>/', spend, name='transactions-spend'),
 ]
@@ -1,28 +1,143 @@
+from asgiref.sync import sync_to_async
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from itertools import islice
+from django.db.models import Count
+from django.db import IntegrityError, transaction as db_transaction
 from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, localdate, make_aware
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from .models import Transaction
+from weel.metrics import timed
+from weel.routers import replica_reads, use_replica
+from weel.pagination import InvalidCursor, decode_cursor, encode_cursor, get_page_size, ndjson_response, paginate, wants_export
+from weel.serialization import Field, InvalidFields, Serializer, json_response
+from .authorization import (
+    InvalidTransaction, approve, approved_result, current_decline_reasons, decline_reasons, decline_rows, declined_result,
+    intern_names, load_declines, lookup_names, parse_transaction,
+)
+from .archive import archived_history
+from . import idempotency
+from .idempotency import IdempotencyConflict, get_key, recall, remember
+from .models import ReversalKind, RollupDimension, RollupPeriod, Transaction, TransactionDecline
+from .reversals import InvalidReversal, parse_reversal, reverse_transactions
+from .rollups import add_to_rollups, day_start, hour_start, spend_series, spend_totals
+from .simulation import InvalidProposal, history_window, parse_proposal, simulate
+from cards.declines import DeclineCode, describe_all
 from cards.models import Card
+from cards.cache import get_card_state, get_card_states
+from cards.velocity import get_usage, record_spend
+from ledger.balances import debit_many, get_accounts
+from ledger.models import EntryKind, LedgerEntry
+from merchants.interning import categories, merchants
+from merchants.models import Merchant, MerchantCategory
+from organisations.tenancy import tenant_database
+from taskqueue.queue import enqueue
 import json
 
+
+TRANSACTION_ORDERING = ('-timestamp', '-id')
+
+
+def _reason_declined(declines, id, approved, amount, merchant, merchant_category):
+    if approved:
+        return None
+    return ", ".join(describe_all(declines.get(id, ()), amount, merchant, merchant_category)) or None
+
+
+def _decline_codes(declines, id, approved):
+    return [DeclineCode(code).name.lower() for code, _ in declines.get(id, ())] if not approved else []
+
+
+TRANSACTION_SERIALIZER = Serializer(
+    Field('id'),
+    Field('card_id'),
+    Field('amount', str),
+    # Names are joined in from the interned rows
+    Field('merchant', sources=('merchant__name',)),
+    Field('merchant_category', sources=('merchant_category__name',)),
+    Field('approved'),
+    # Rendered from the decline codes loaded for the page, see serialize_transactions
+    Field('reason_declined', _reason_declined, sources=('id', 'approved', 'amount', 'merchant__name', 'merchant_category__name'), contextual=True),
+    Field('decline_codes', _decline_codes, sources=('id', 'approved'), contextual=True),
+    Field('timestamp', datetime.isoformat),
+)
+
+
+def serialize_transactions(selection, rows):
+    """
+    Serialize a page or export batch of transactions, loading the decline codes of the
+    declined ones with one query when the selection includes the decline fields.
+    """
+    declines = {}
+    if 'reason_declined' in selection or 'decline_codes' in selection:
+        id_and_approved = selection.getter('id', 'approved')
+        declines = load_declines([id for id, approved in map(id_and_approved, rows) if not approved])
+    return selection.serialize(rows, declines)
+
+
+def _parse_time(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp '{value}'")
+    return make_aware(parsed, timezone.utc) if is_naive(parsed) else parsed
+
+
+def history_filters(params):
+    """
+    Translate the history query parameters into queryset filters.
+
+    `card` narrows to one card and `since`/`until` (ISO 8601, naive values are UTC) bound
+    the timestamp, which together hit transaction_card_time_idx. `approved=false` selects
+    declines through the partial transaction_declined_idx.
+    """
+    filters = {}
+    if params.get('card'):
+        try:
+            filters['card_id'] = int(params['card'])
+        except ValueError:
+            raise ValueError(f"Invalid card '{params['card']}'")
+    if params.get('since'):
+        filters['timestamp__gte'] = _parse_time(params['since'])
+    if params.get('until'):
+        filters['timestamp__lt'] = _parse_time(params['until'])
+    if params.get('approved') in ('true', 'false'):
+        filters['approved'] = params['approved'] == 'true'
+    return filters
+
+
 @csrf_exempt
 @require_http_methods(["GET", "POST"])
+@replica_reads
 def transactions(request):
     """
     Handle the GET and POST requests for transactions.
 
-    If the request method is GET, return a list of all transactions in the database.
+    If the request method is GET, return a page of transactions, newest first.
     Each transaction is represented as a dictionary with the following keys: 
-    'id', 'card_id', 'amount', 'merchant', 'merchant_category', 'approved', 'reason_declined', and 'timestamp'.
+    'id', 'card_id', 'amount', 'merchant', 'merchant_category', 'approved', 'reason_declined', 'decline_codes' and 'timestamp'.
+    Decline reasons are stored as codes and rendered into 'reason_declined' as each page is read.
+    Pages are keyed on (timestamp, id): pass the returned `next_cursor` back as `cursor` to continue,
+    and `limit` to set the page size. `format=ndjson` streams every transaction instead.
+    The history can be narrowed with `card`, `since`, `until` and `approved` (see history_filters),
+    and `fields` selects the keys returned as for the card list. Once the recent transactions run out,
+    pages and exports continue into the monthly archives of older ones (see transactions.archive).
 
     If the request method is POST, create a new transaction with the data provided in the request body.
     The request body should be a JSON object with the following keys: 
     'card', 'amount', 'merchant', and 'merchant_category'.
-    The 'card' key should be the ID of the card to use for the transaction.
+    The 'card' key should be the ID of the card to use for the transaction. The merchant and category
+    are stored as interned IDs, matched against the card's controls ignoring case, spacing and
+    punctuation (see merchants.interning).
 
-    The function checks if the card has sufficient balance and is active, and applies any card controls.
-    If the transaction is approved, the card's balance is updated.
+    The function checks if the card has sufficient balance and is active, and applies the card's compiled controls.
+    If the transaction is approved, a debit is appended to the card's ledger in the same database transaction as the insert,
+    which also adds the transaction to the spend rollups (see transactions.rollups).
+    Send an `Idempotency-Key` header to make retries safe: a repeated key returns the original
+    response, marked with `Idempotent-Replayed: true`, and reusing a key for a different transaction
+    is rejected with status 422 (see transactions.idempotency).
 
     Returns:
         JsonResponse: A JSON response with the list of transactions (for GET requests) or a success message 
@@ -31,60 +146,542 @@ def transactions(request):
     """
     # GET path
     if request.method == 'GET':
-        transactions = Transaction.objects.all()
-        data = [{
-            "id": transaction.id,
-            "card_id": transaction.card_id,
-            "amount": str(transaction.amount),
-            "merchant": transaction.merchant,
-            "merchant_category": transaction.merchant_category,
-            "approved": transaction.approved,
-            "reason_declined": transaction.reason_declined if not transaction.approved else None,
-            "timestamp": transaction.timestamp.isoformat()
-        } for transaction in transactions]
-        return JsonResponse({"transactions": data}, safe=False)
+        try:
+            selection = TRANSACTION_SERIALIZER.select(request, extra_columns=('timestamp', 'id'))
+            filters = history_filters(request.GET)
+            transactions = Transaction.objects.filter(**filters).values_list(*selection.columns)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        serialize_rows = lambda rows: serialize_transactions(selection, rows)
+        pick = lambda item: {name: value for name, value in item.items() if name in selection}
+        if wants_export(request):
+            archived = map(pick, archived_history(filters))
+            return ndjson_response(transactions.order_by(*TRANSACTION_ORDERING), serialize_rows, 'transactions.ndjson', more=archived)
+        try:
+            rows, next_cursor = paginate(request, transactions, TRANSACTION_ORDERING, cursor_values=selection.getter('timestamp', 'id'))
+            archived = []
+            if next_cursor is None:
+                # The hot table has no more matching rows; continue into the archive
+                limit = get_page_size(request) - len(rows)
+                if rows:
+                    after = selection.getter('timestamp', 'id')(rows[-1])
+                else:
+                    after = decode_cursor(request.GET['cursor'], 2) if request.GET.get('cursor') else None
+                archived = list(islice(archived_history(filters, after), limit + 1))
+                if len(archived) > limit:
+                    archived = archived[:limit]
+                    # A full page of hot rows continues into the archive on the next page
+                    next_cursor = encode_cursor([archived[-1]['timestamp'], archived[-1]['id']] if archived else after)
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        with timed(request, 'serialization'):
+            page = serialize_rows(rows) + [pick(item) for item in archived]
+            return json_response({"transactions": page, "next_cursor": next_cursor})
     # POST path
     elif request.method == 'POST':
         try:
             data = json.loads(request.body)
-            card = Card.objects.get(id=data['card'])
-            amount = Decimal(data['amount'])
-            merchant = data['merchant']
-            merchant_category = data['merchant_category']
-
-            failed_controls = []
-
-            # Check card balance and status
-            if card.balance < amount or card.balance == 0:
-                failed_controls.append("Insufficient funds")
-            if card.is_active == False:
-                failed_controls.append("Card is not active")
-
-            # Apply card controls
-            for control in card.controls.all():
-                passed, failure_reason = control.apply_control(data)
-                if not passed:
-                    failed_controls.append(failure_reason)
-
-            # Create transaction object regardless of control results
-            transaction = Transaction.objects.create(
-                card=card,
-                amount=amount,
-                merchant=merchant,
-                merchant_category=merchant_category,
-                approved=len(failed_controls) == 0,  # Transaction is approved if no failed controls
-                reason_declined=", ".join(failed_controls) if failed_controls else None
-            )
-
-            # Update card balance if transaction is approved
+            key = get_key(request)
+            parsed = parse_transaction(data)
+            card_id, amount, merchant, merchant_category = parsed
+            if key is not None:
+                # A retry gets the original result; nothing is evaluated or debited again
+                replayed = recall(key, parsed)
+                if replayed is not None:
+                    return _replayed(*replayed)
+            state = get_card_state(card_id)
+            merchant_id, merchant_category_id = lookup_names(merchant, merchant_category)
+
+            # Check card status and apply card controls from the cached card state;
+            # the balance is only ever checked in the database
+            failed_controls = decline_reasons(None, state.is_active, state.expiration_date, state.controls, amount, merchant_id, merchant_category_id)
+
+            try:
+                with db_transaction.atomic(using=tenant_database()):
+                    # Transaction object is recorded regardless of control results
+                    transaction = Transaction(
+                        organisation_id=state.organisation_id,
+                        card_id=card_id,
+                        amount=amount,
+                        approved=True,
+                        idempotency_key=key,
+                    )
+                    # Names are only interned for a transaction being recorded
+                    transaction.merchant_id, transaction.merchant_category_id = intern_names(merchant, merchant_category)
+                    # Debit the card's ledger and its rolling spend counters with guarded writes, which
+                    # also catch a concurrent authorization draining the balance or using up a limit
+                    if failed_controls or not approve(transaction, state.controls):
+                        failed_controls = current_decline_reasons(card_id, state.controls, amount, merchant_id, merchant_category_id)
+                        transaction.approved = False
+                        transaction.save()
+                        TransactionDecline.objects.bulk_create(decline_rows(transaction, failed_controls))
+                    add_to_rollups([transaction])
+            except IntegrityError:
+                # A concurrent attempt with the same key committed first; everything here was rolled back
+                replayed = recall(key, parsed) if key is not None else None
+                if replayed is None:
+                    raise
+                return _replayed(*replayed)
+
             if transaction.approved:
-                card.balance -= amount
-                card.save()
-                return JsonResponse({"status": "approved", "message": "Transaction approved", "transaction_id": transaction.id}, status=200)
+                result, status = approved_result(transaction.id), 200
             else:
-                return JsonResponse({"status": "declined", "error": "Transaction declined", "reasons": failed_controls or ["Unknown reason"]}, status=400)
+                result, status = declined_result(describe_all(failed_controls, amount, merchant, merchant_category)), 400
+            if key is not None:
+                remember(key, parsed, result, status)
+            return JsonResponse(result, status=status)
 
+        except IdempotencyConflict as e:
+            return JsonResponse(declined_result([str(e)], error=str(e)), status=422)
         except Card.DoesNotExist:
-            return JsonResponse({"status": "declined", "error": "Card not found", "reasons": ["Card not found"]}, status=400)
+            return JsonResponse(declined_result(["Card not found"], error="Card not found"), status=400)
         except Exception as e:
-            return JsonResponse({"status": "declined", "error": str(e), "reasons": [str(e)]}, status=400)
+            return JsonResponse(declined_result([str(e)], error=str(e)), status=400)
+
+
+def _replayed(result, status):
+    response = JsonResponse(result, status=status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def reversals(request, transaction_id):
+    """
+    Handle the POST request for returning money to a card against one of its approved transactions.
+
+    The request body should be a JSON object with the optional keys 'kind', 'amount' and 'reference'.
+    'kind' is 'reversal' (the default) or 'refund', which return 'amount', or everything not yet
+    returned if it is omitted, or 'capture', for a transaction settled for less than it was
+    authorized: 'amount' is then the amount captured and the rest is returned. The amounts returned
+    against a transaction never add up to more than its amount.
+
+    The card is credited with a ledger entry, and the reversal is recorded against the original
+    transaction, in one database transaction (see transactions.reversals). A repeated 'reference',
+    the processor's ID for the reversal, returns the original reversal, marked with
+    `Idempotent-Replayed: true`.
+
+    Returns:
+        JsonResponse: A JSON response with the 'reversal_id', 'transaction_id', 'kind' and 'amount'
+        returned. If the reversal cannot be applied, an error message is returned instead.
+    """
+    try:
+        [outcome] = reverse_transactions([parse_reversal(json.loads(request.body), transaction_id)])
+    except (ValueError, InvalidReversal) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if outcome.error is not None:
+        return JsonResponse({"error": outcome.error}, status=400)
+    reversal = outcome.reversal
+    result = {
+        "status": "reversed",
+        "reversal_id": reversal.id,
+        "transaction_id": reversal.transaction_id,
+        "kind": ReversalKind(reversal.kind).name.lower(),
+        "amount": str(reversal.amount),
+    }
+    return JsonResponse(result) if outcome.created else _replayed(result, 200)
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@replica_reads
+def decline_summary(request):
+    """
+    Handle the GET request for decline counts by reason.
+
+    Counts the declined transactions carrying each decline code, most frequent first, as a
+    GROUP BY over the stored codes; the unfiltered count is read from decline_code_idx alone.
+    The transactions counted can be narrowed with `card`, `since` and `until` as for the history.
+
+    Returns:
+        JsonResponse: A JSON response with a 'declines' list of objects with the 'code', its
+        'description' and the 'count' of declined transactions. If a filter is invalid, an
+        error message is returned.
+    """
+    try:
+        filters = history_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    filters.pop('approved', None)
+    declines = TransactionDecline.objects.filter(**{f"transaction__{name}": value for name, value in filters.items()})
+    counts = declines.values('code').annotate(count=Count('transaction', distinct=True)).order_by('-count', 'code')
+    return JsonResponse({"declines": [
+        {"code": DeclineCode(row['code']).name.lower(), "description": DeclineCode(row['code']).label, "count": row['count']}
+        for row in counts
+    ]})
+
+
+SPEND_DIMENSIONS = {
+    'cards': RollupDimension.CARD,
+    'categories': RollupDimension.CATEGORY,
+    'merchants': RollupDimension.MERCHANT,
+}
+SPEND_BUCKETS = {'hour': RollupPeriod.HOUR, 'day': RollupPeriod.DAY}
+DEFAULT_SPEND_DAYS = 30
+
+
+def _spend_window(params, bucket):
+    """
+    The [since, until) window of a spend query, widened to whole buckets: hours, or days
+    for daily series. Defaults to the last DEFAULT_SPEND_DAYS days.
+    """
+    until = _parse_time(params['until']) if params.get('until') else datetime.now(timezone.utc)
+    since = _parse_time(params['since']) if params.get('since') else until - timedelta(days=DEFAULT_SPEND_DAYS)
+    start = day_start if bucket == RollupPeriod.DAY else hour_start
+    since, rounded = start(since), start(until)
+    if rounded != until:
+        rounded = day_start(rounded.date() + timedelta(days=1)) if bucket == RollupPeriod.DAY else rounded + timedelta(hours=1)
+    if since >= rounded:
+        raise ValueError("'since' must be before 'until'")
+    return since, rounded
+
+
+def _spend_row(row, names):
+    total = row['approved_count'] + row['declined_count']
+    item = {"id": row['key']}
+    if names is not None:
+        item["name"] = names.get(row['key'])
+    if 'start' in row:
+        item["start"] = row['start'].isoformat()
+    return {
+        **item,
+        "approved_count": row['approved_count'],
+        "approved_amount": f"{row['approved_amount']:.2f}",
+        "declined_count": row['declined_count'],
+        "declined_amount": f"{row['declined_amount']:.2f}",
+        "approval_rate": round(row['approved_count'] / total, 4) if total else None,
+    }
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@replica_reads
+def spend(request, dimension):
+    """
+    Handle the GET request for spend analytics by card, merchant category or merchant
+    (`dimension` is 'cards', 'categories' or 'merchants').
+
+    Reads only the hourly and daily rollups kept as transactions are written (see
+    transactions.rollups), so a query costs the same however much history there is.
+    `since` and `until` (ISO 8601, naive values are UTC) bound the window, widened to whole
+    hours, and default to the last DEFAULT_SPEND_DAYS days; `id` narrows to one card,
+    category or merchant. Without `bucket`, the totals over the window are returned, most
+    approved spend first, up to `limit`. With `bucket=hour` or `bucket=day`, a series with
+    a row per bucket is returned a page at a time, oldest first; pass `next_cursor` back as
+    `cursor` to continue. Days are those of the current time zone. Amounts are as
+    authorized; reversals are not netted out.
+
+    Returns:
+        JsonResponse: A JSON response with the 'since' and 'until' of the window and a 'results'
+        list of objects with the 'id' (and 'name' for categories and merchants), the 'start' of
+        the bucket for series, the 'approved_count', 'approved_amount', 'declined_count',
+        'declined_amount' and 'approval_rate', and a 'next_cursor' for series. If a parameter
+        is invalid, an error message is returned.
+    """
+    if dimension not in SPEND_DIMENSIONS:
+        return JsonResponse({"error": f"Unknown dimension '{dimension}', expected one of {', '.join(SPEND_DIMENSIONS)}"}, status=404)
+    bucket = request.GET.get('bucket') or None
+    try:
+        if bucket is not None and bucket not in SPEND_BUCKETS:
+            raise ValueError(f"Invalid bucket '{bucket}', expected hour or day")
+        period = SPEND_BUCKETS.get(bucket)
+        since, until = _spend_window(request.GET, period)
+        try:
+            key = int(request.GET['id']) if request.GET.get('id') else None
+        except ValueError:
+            raise ValueError(f"Invalid id '{request.GET['id']}'")
+        if period is None:
+            rows, next_cursor = spend_totals(SPEND_DIMENSIONS[dimension], since, until, key, limit=get_page_size(request)), None
+        else:
+            rows, next_cursor = paginate(request, spend_series(SPEND_DIMENSIONS[dimension], period, since, until, key), ('start', 'key'))
+    except (ValueError, InvalidCursor) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    names = None
+    if dimension != 'cards':
+        model = Merchant if dimension == 'merchants' else MerchantCategory
+        names = dict(model.objects.filter(pk__in={row['key'] for row in rows}).values_list('id', 'name'))
+    return json_response({
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "results": [_spend_row(row, names) for row in rows],
+        "next_cursor": next_cursor,
+    })
+
+
+MAX_PROPOSALS = 10
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def simulate_controls(request):
+    """
+    Handle the POST request for simulating card control changes against the transaction history.
+
+    The request body should be a JSON object with a 'proposals' list of at most MAX_PROPOSALS control
+    changes, each an object with a 'controls' list shaped like card-controls POST bodies without the
+    'card' (category, merchant, max_amount and min_amount controls only), an optional 'remove' list
+    of control types to drop and an optional 'name'. A proposal replaces each card's controls of
+    the types it names. The history replayed can be narrowed with 'card', 'since' and 'until' as
+    for the transaction history, and defaults to the last year, archived months included.
+
+    Every transaction is checked against the cards' current controls and each proposal in columnar
+    batches (see transactions.simulation), reading from the replica if there is one.
+
+    Returns:
+        JsonResponse: A JSON response with the number of 'transactions' replayed, the 'current'
+        controls' declines and a 'proposals' list with, for each, its declines by code and the count
+        and amount of transactions it would newly decline or allow and of the approved transactions
+        it would have declined. If the body is invalid, an error message is returned.
+    """
+    try:
+        data = json.loads(request.body)
+        if not isinstance(data, dict) or not isinstance(data.get('proposals'), list) or not data['proposals']:
+            raise InvalidProposal("Expected an object with a list of 'proposals'")
+        if len(data['proposals']) > MAX_PROPOSALS:
+            raise InvalidProposal(f"Simulations are limited to {MAX_PROPOSALS} proposals")
+        proposals = [parse_proposal(proposal, index) for index, proposal in enumerate(data['proposals'])]
+        filters = history_window({name: value for name, value in history_filters(data).items() if name != 'approved'})
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    with use_replica():
+        result = simulate(proposals, filters)
+    return json_response({
+        "transactions": result.transactions,
+        "current": result.current.as_dict(),
+        "proposals": [proposal.as_dict() for proposal in result.proposals],
+    })
+
+
+def _prepare(card_id, merchant, merchant_category):
+    # The card's cached state and the names' IDs, in one trip to a worker thread
+    return (get_card_state(card_id), *lookup_names(merchant, merchant_category))
+
+
+def _approve(card_id, amount, merchant, merchant_category, controls, key=None):
+    """
+    Debit the card and record the approved transaction under the idempotency `key`,
+    returning its ID, or None if the debit was refused. Raises IntegrityError if an
+    attempt with the same key was recorded first.
+    """
+    with db_transaction.atomic(using=tenant_database()):
+        merchant_id, merchant_category_id = intern_names(merchant, merchant_category)
+        transaction = Transaction(
+            card_id=card_id, amount=amount, merchant_id=merchant_id, merchant_category_id=merchant_category_id, approved=True, idempotency_key=key,
+        )
+        if not approve(transaction, controls):
+            return None
+        add_to_rollups([transaction])
+        enqueue('transactions.notify', card_id=card_id, status='approved', amount=amount, merchant=merchant, transaction_id=transaction.id)
+    return transaction.id
+
+
+def _decline(card_id, amount, merchant, merchant_category, declines, key=None):
+    # Declines travel as [code, [control IDs]] pairs; the message is rendered for the notification now
+    encoded = [[code, [control.id for control in controls]] for code, controls in declines]
+    reasons = describe_all(declines, amount, merchant, merchant_category)
+    enqueue(
+        'transactions.record_declined',
+        card_id=card_id, amount=amount, merchant=merchant, merchant_category=merchant_category, declines=encoded, idempotency_key=key,
+    )
+    enqueue('transactions.notify', card_id=card_id, status='declined', amount=amount, merchant=merchant, reasons=reasons)
+    return reasons
+
+
+async def _respond(key, parsed, result, status):
+    if key is not None:
+        await sync_to_async(remember)(key, parsed, result, status)
+    return JsonResponse(result, status=status)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def authorize(request):
+    """
+    Handle the POST request for authorizing a transaction asynchronously.
+
+    The request body is the same as for a POST to the transactions endpoint. Only the
+    approve/decline decision and the balance debit happen on the request path: the
+    record of a declined transaction and the cardholder notification are queued as
+    background tasks for the run_task_workers processes. Serve it through weel.asgi
+    to get the benefit of the async view.
+
+    An Idempotency-Key header works as for the transactions endpoint: a retry gets the
+    original result back without being evaluated or debited again. The key is stored on
+    the approved transaction, or on the declined one once its background task runs; until
+    then a retry is answered from the idempotency cache.
+
+    Returns:
+        JsonResponse: The same responses as the transactions endpoint. Declined transactions
+        are recorded once their background task runs.
+    """
+    try:
+        key = get_key(request)
+        parsed = parse_transaction(json.loads(request.body))
+        card_id, amount, merchant, merchant_category = parsed
+        if key is not None:
+            replayed = await sync_to_async(recall)(key, parsed)
+            if replayed is not None:
+                return _replayed(*replayed)
+        state, merchant_id, merchant_category_id = await sync_to_async(_prepare)(card_id, merchant, merchant_category)
+        failed_controls = decline_reasons(None, state.is_active, state.expiration_date, state.controls, amount, merchant_id, merchant_category_id)
+
+        if not failed_controls:
+            try:
+                transaction_id = await sync_to_async(_approve)(card_id, amount, merchant, merchant_category, state.controls, key)
+            except IntegrityError:
+                # A concurrent attempt with the same key committed first; everything here was rolled back
+                replayed = await sync_to_async(recall)(key, parsed) if key is not None else None
+                if replayed is None:
+                    raise
+                return _replayed(*replayed)
+            if transaction_id is not None:
+                return await _respond(key, parsed, approved_result(transaction_id), 200)
+
+        failed_controls = await sync_to_async(current_decline_reasons)(card_id, state.controls, amount, merchant_id, merchant_category_id)
+        reasons = await sync_to_async(_decline)(card_id, amount, merchant, merchant_category, failed_controls, key)
+        return await _respond(key, parsed, declined_result(reasons), 400)
+
+    except IdempotencyConflict as e:
+        return JsonResponse(declined_result([str(e)], error=str(e)), status=422)
+    except Card.DoesNotExist:
+        return JsonResponse(declined_result(["Card not found"], error="Card not found"), status=400)
+    except Exception as e:
+        return JsonResponse(declined_result([str(e)], error=str(e)), status=400)
+
+
+MAX_BATCH_SIZE = 1000
+
+
+class BalanceChanged(Exception):
+    """
+    A card's balance or spend counters moved between reading and updating them.
+    """
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def transactions_batch(request):
+    """
+    Handle the POST request for authorizing a batch of transactions.
+
+    The request body should be a JSON array of transaction objects, each shaped like the
+    body of a single POST to the transactions endpoint, with at most MAX_BATCH_SIZE items.
+
+    Every referenced card, its balance and its cached controls are loaded and the merchant and category
+    names of transactions on those cards interned up front, the approval
+    rules are applied in order against a running balance and running spend counters per card,
+    all transactions and their ledger debits are written with one bulk insert each, each
+    card's spend counters are updated with one UPDATE and the spend rollups with one upsert.
+    Batches cannot carry an Idempotency-Key header; a request with one is rejected.
+
+    Returns:
+        JsonResponse: A JSON response with a 'results' list holding one entry per submitted
+        transaction, in order, with the same 'status', 'transaction_id' and 'reasons' keys as the
+        single transaction endpoint. If the body is not a valid batch, an error message is returned.
+    """
+    if idempotency.HEADER in request.headers:
+        # A retried batch could be partly new; clients send each retryable transaction on its own
+        return JsonResponse({"error": f"{idempotency.HEADER} is not supported for batches"}, status=400)
+    try:
+        items = json.loads(request.body)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if not isinstance(items, list):
+        return JsonResponse({"error": "Expected a JSON array of transactions"}, status=400)
+    if len(items) > MAX_BATCH_SIZE:
+        return JsonResponse({"error": f"Batches are limited to {MAX_BATCH_SIZE} transactions"}, status=400)
+
+    parsed = []
+    for item in items:
+        try:
+            parsed.append(parse_transaction(item))
+        except InvalidTransaction as e:
+            parsed.append(e)
+
+    # A concurrent debit can change a balance or spend counter between reading and updating it;
+    # the guarded UPDATE detects that and the whole batch is re-evaluated
+    for attempt in range(3):
+        try:
+            with db_transaction.atomic(using=tenant_database()):
+                results = _authorize_batch(parsed)
+            break
+        except BalanceChanged:
+            continue
+    else:
+        return JsonResponse({"error": "Card balances changed during authorization, retry the batch"}, status=409)
+    return JsonResponse({"results": results})
+
+
+def _authorize_batch(parsed):
+    valid = [item for item in parsed if not isinstance(item, Exception)]
+    cards = Card.objects.in_bulk({card_id for card_id, _, _, _ in valid})
+    # Every transaction on a found card is recorded, approved or not, so only their names are interned
+    valid = [item for item in valid if item[0] in cards]
+    merchant_ids = merchants.intern_many(merchant for _, _, merchant, _ in valid)
+    category_ids = categories.intern_many(merchant_category for _, _, _, merchant_category in valid)
+    states = get_card_states(cards.keys())
+    balances = {card_id: balance for card_id, (is_active, balance) in get_accounts(cards.keys()).items()}
+    usage = get_usage(cards.keys())
+    today = localdate()
+    debits = defaultdict(Decimal)
+    approvals = defaultdict(int)
+
+    results, pending = [], []
+    for item in parsed:
+        if isinstance(item, Exception):
+            results.append(declined_result([str(item)], error=str(item)))
+            continue
+        card_id, amount, merchant, merchant_category = item
+        card = cards.get(card_id)
+        if card is None:
+            results.append(declined_result(["Card not found"], error="Card not found"))
+            continue
+
+        controls = states[card_id].controls
+        merchant_id, merchant_category_id = merchant_ids[merchant], category_ids[merchant_category]
+        failed_controls = decline_reasons(balances[card_id], card.is_active, card.expiration_date, controls, amount, merchant_id, merchant_category_id, today)
+        failed_controls += controls.evaluate_velocity(amount, usage[card_id])
+        if not failed_controls:
+            balances[card_id] -= amount
+            debits[card_id] += amount
+            approvals[card_id] += 1
+            usage[card_id] = {period: (spent + amount, count + 1) for period, (spent, count) in usage[card_id].items()}
+        pending.append((len(results), failed_controls))
+        results.append(Transaction(
+            organisation_id=card.organisation_id,
+            card=card,
+            amount=amount,
+            merchant_id=merchant_id,
+            merchant_category_id=merchant_category_id,
+            approved=len(failed_controls) == 0
+        ))
+
+    Transaction.objects.bulk_create([results[index] for index, _ in pending])
+    TransactionDecline.objects.bulk_create([
+        row for index, failed_controls in pending for row in decline_rows(results[index], failed_controls)
+    ])
+    # Ledger debits are checked against the balances once written; a card overdrawn by a
+    # concurrent debit rolls the whole batch back
+    entries = [
+        LedgerEntry(organisation_id=transaction.organisation_id, card_id=transaction.card_id, kind=EntryKind.PURCHASE, amount=-transaction.amount, transaction=transaction)
+        for transaction in (results[index] for index, _ in pending)
+        if transaction.approved
+    ]
+    if entries and not debit_many(entries):
+        raise BalanceChanged
+    for card_id, total in debits.items():
+        if not record_spend(card_id, total, count=approvals[card_id], limits=states[card_id].controls.velocity_limits):
+            raise BalanceChanged
+    add_to_rollups(results[index] for index, _ in pending)
+
+    for index, failed_controls in pending:
+        transaction = results[index]
+        if transaction.approved:
+            results[index] = approved_result(transaction.id)
+        else:
+            _, _, merchant, merchant_category = parsed[index]
+            reasons = describe_all(failed_controls, transaction.amount, merchant, merchant_category)
+            results[index] = declined_result(reasons)
+    return results
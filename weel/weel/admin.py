@@ -0,0 +1,114 @@
+"""
+Admin building blocks for the tables that grow to millions of rows.
+
+The stock changelist counts its rows with a COUNT(*) over the whole filtered
+table on every page, and again without the filters for the "N total" link.
+ModelAdmins of large tables use EstimatedCountPaginator, which stops counting
+at MAX_EXACT_COUNT rows, and set show_full_result_count = False.
+
+Its date_hierarchy reads the distinct years, months or days of every row in
+the list; DateRangeHierarchyMixin answers from the first and last rows instead.
+"""
+import json
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Max, Min, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+# Changelists with more rows than this show an estimate of their size
+MAX_EXACT_COUNT = 10000
+
+
+def planner_estimate(queryset):
+    """
+    Return the query planner's estimate of the number of rows in `queryset`, or None
+    where the database does not give one (anything but PostgreSQL).
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counts at most MAX_EXACT_COUNT + 1 rows, with a LIMITed subquery, so pages stay fast
+    on tables of any size. Beyond that the count is the planner's estimate on PostgreSQL;
+    elsewhere only the pages of the counted rows are linked, and deeper rows are found by
+    narrowing the list with its filters or search.
+    """
+
+    @cached_property
+    def count(self):
+        counted = self.object_list.order_by()[:MAX_EXACT_COUNT + 1].count()
+        if counted <= MAX_EXACT_COUNT:
+            return counted
+        return max(planner_estimate(self.object_list) or 0, counted)
+
+
+def _periods(first, last, kind):
+    """
+    Every year, month or day from the one holding `first` to the one holding `last`.
+    """
+    if kind == 'year':
+        return [(year, 1, 1) for year in range(first.year, last.year + 1)]
+    if kind == 'month':
+        months = range(first.year * 12 + first.month - 1, last.year * 12 + last.month)
+        return [(month // 12, month % 12 + 1, 1) for month in months]
+    days = range(first.toordinal(), last.toordinal() + 1)
+    return [(day.year, day.month, day.day) for day in map(datetime.fromordinal, days)]
+
+
+class DateRangeQuerySet(QuerySet):
+    """
+    A changelist queryset for a date_hierarchy on a large table.
+
+    The hierarchy's datetimes() lists every year, month or day between the first and
+    last rows, rather than the distinct ones of all rows, so an empty month may be
+    linked. Min and Max aggregates over a column are each read with one ordered
+    LIMIT 1 query, which an index answers with a seek.
+    """
+
+    def _edge(self, field_name, descending=False):
+        ordering = f"-{field_name}" if descending else field_name
+        return self.order_by(ordering).values_list(field_name, flat=True).first()
+
+    def aggregate(self, *args, **kwargs):
+        edges = all(
+            type(aggregate) in (Min, Max) and aggregate.filter is None and isinstance(aggregate.source_expressions[0], F)
+            for aggregate in kwargs.values()
+        )
+        if args or not kwargs or not edges:
+            return super().aggregate(*args, **kwargs)
+        return {
+            name: self._edge(aggregate.source_expressions[0].name, descending=isinstance(aggregate, Max))
+            for name, aggregate in kwargs.items()
+        }
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        first, last = self._edge(field_name), self._edge(field_name, descending=True)
+        if first is None:
+            return []
+        tzinfo = tzinfo or timezone.get_current_timezone()
+        first, last = timezone.localtime(first, tzinfo), timezone.localtime(last, tzinfo)
+        periods = [timezone.make_aware(datetime(*period), tzinfo) for period in _periods(first, last, kind)]
+        return periods if order == 'ASC' else periods[::-1]
+
+
+class DateRangeHierarchyMixin:
+    """
+    ModelAdmin mixin making the date_hierarchy of a large table cheap; see DateRangeQuerySet.
+    """
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DateRangeQuerySet(queryset.model, query=queryset.query.chain(), using=queryset.db)
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class WeelConfig(AppConfig):
+    name = 'weel'
+
+    def ready(self):
+        # Connect the query recorder to connections as they are opened
+        from . import middleware  # noqa: F401
@@ -0,0 +1,42 @@
+"""
+SQLite backend with per-connection setup for concurrent use.
+
+Adds the two OPTIONS Django 5.1 gives the stock backend, so settings written for
+it work unchanged here (and this module can go once the project upgrades):
+
+- `init_command`: SQL run on every new connection, e.g. the PRAGMAs that put
+  the database in WAL mode so readers never block the writer.
+- `transaction_mode`: how atomic() begins transactions. IMMEDIATE takes the
+  write lock up front, so a transaction that reads before it writes waits for
+  busy_timeout instead of failing with "database is locked" when another
+  connection wrote in between.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('init_command', None)
+        params.pop('transaction_mode', None)
+        return params
+
+    @property
+    def transaction_mode(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return mode.upper() if mode else None
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        init_command = self.settings_dict['OPTIONS'].get('init_command')
+        if init_command:
+            conn.executescript(init_command)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}" if self.transaction_mode else "BEGIN")
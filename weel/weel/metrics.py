@@ -0,0 +1,145 @@
+"""
+A small in-process metrics registry rendered in the Prometheus text format.
+
+Metrics are kept per process, so with several workers each one exposes its own
+series on /metrics and the scraper aggregates them.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # One slot per bucket plus +Inf, then the running sum
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            all_series = {labels: list(series) for labels, series in self._series.items()}
+        for label_values, series in sorted(all_series.items()):
+            cumulative = 0
+            for bound, observed in zip((*self.buckets, float('inf')), series):
+                cumulative += observed
+                yield f"{self.name}_bucket", _format_labels(self.labels, label_values, [('le', _format_number(bound))]), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), series[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_number(value)}" for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUESTS = registry.counter('weel_requests_total', "Requests handled, by view, method and status.", ('view', 'method', 'status'))
+REQUEST_DURATION = registry.histogram('weel_request_duration_seconds', "Wall time spent handling a request.", ('view', 'method'))
+DB_QUERIES = registry.histogram('weel_db_queries_per_request', "Database queries executed per request.", ('view',), buckets=COUNT_BUCKETS)
+DB_DURATION = registry.histogram('weel_db_duration_seconds', "Time spent in database queries per request.", ('view',))
+SERIALIZATION_DURATION = registry.histogram('weel_serialization_duration_seconds', "Time spent serializing response bodies.", ('view',))
+RESPONSE_SIZE = registry.histogram('weel_response_size_bytes', "Size of non-streaming response bodies.", ('view',), buckets=SIZE_BUCKETS)
+
+
+@contextmanager
+def timed(request, phase):
+    """
+    Accumulate the time spent in the block on the request under `phase`, for
+    the instrumentation middleware to report (e.g. 'serialization').
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = request.__dict__.setdefault('_metrics_timings', {})
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - started
@@ -0,0 +1,136 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import metrics
+
+slow_request_logger = logging.getLogger('weel.slow_requests')
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper counting and timing every query on a request, and
+    keeping the SQL when the slow request log is enabled.
+    """
+
+    def __init__(self, keep_sql):
+        self.count = 0
+        self.duration = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if self.keep_sql:
+                self.statements.append((elapsed, sql))
+
+
+_recorder = ContextVar('query_recorder', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    # Installed on every connection, handing its queries to the recorder of the
+    # request they run for
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install(connection):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@receiver(connection_created)
+def _install_on_connect(sender, connection, **kwargs):
+    _install(connection)
+
+
+@contextmanager
+def _recording(recorder):
+    # Connections are per thread, and an async view's queries run on the connections
+    # of sync_to_async's threads. The recorder is looked up from the context instead,
+    # which sync_to_async carries into those threads.
+    for alias in connections:
+        _install(connections[alias])
+    token = _recorder.set(recorder)
+    try:
+        yield
+    finally:
+        _recorder.reset(token)
+
+
+class InstrumentationMiddleware:
+    """
+    Record wall time, database query count and time, serialization time and
+    response size for every request, labelled by view function name.
+
+    Requests slower than SLOW_REQUEST_THRESHOLD_MS (disabled when unset) are
+    logged to the 'weel.slow_requests' logger along with their SQL.
+
+    Sync and async capable, so an async view such as transactions.views.authorize
+    is served under ASGI without a thread hop through this middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+        recorder = QueryRecorder(keep_sql=threshold is not None)
+        started = time.perf_counter()
+        with _recording(recorder):
+            response = self.get_response(request)
+        self._record(request, response, recorder, time.perf_counter() - started, threshold)
+        return response
+
+    async def __acall__(self, request):
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD_MS', None)
+        recorder = QueryRecorder(keep_sql=threshold is not None)
+        started = time.perf_counter()
+        with _recording(recorder):
+            response = await self.get_response(request)
+        self._record(request, response, recorder, time.perf_counter() - started, threshold)
+        return response
+
+    def _record(self, request, response, recorder, elapsed, threshold):
+        # Read from the resolved URL rather than in process_view, which the async handler
+        # would run through sync_to_async
+        match = getattr(request, 'resolver_match', None)
+        view = getattr(match.func, '__name__', match.func.__class__.__name__) if match else 'unmatched'
+        metrics.REQUESTS.inc(view, request.method, str(response.status_code))
+        metrics.REQUEST_DURATION.observe(elapsed, view, request.method)
+        metrics.DB_QUERIES.observe(recorder.count, view)
+        metrics.DB_DURATION.observe(recorder.duration, view)
+        serialization = getattr(request, '_metrics_timings', {}).get('serialization')
+        if serialization is not None:
+            metrics.SERIALIZATION_DURATION.observe(serialization, view)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), view)
+
+        if threshold is not None and elapsed * 1000 >= threshold:
+            slow_request_logger.warning(
+                "Slow request: %s %s (%s) took %.1fms with %d queries (%.1fms)\n%s",
+                request.method, request.path, view, elapsed * 1000, recorder.count, recorder.duration * 1000,
+                '\n'.join(f"  [{duration * 1000:.2f}ms] {sql}" for duration, sql in recorder.statements),
+            )
@@ -0,0 +1,70 @@
+"""
+Read replicas.
+
+Views whose reads can lag the primary by a little, such as the GET list
+endpoints, wrap their work in replica_reads (or use_replica() directly). While
+that is active, ReplicaRouter sends every read to the replica of the database
+the query would otherwise use, as mapped by settings.DATABASE_REPLICAS
+({primary alias: replica alias}). Writes always go to the primary, and
+databases without a replica are read as usual.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import router
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+@contextmanager
+def use_replica():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_reads(view):
+    """
+    Decorator reading from replicas for the GET requests to a function view.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+        with use_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', {})
+
+
+class ReplicaRouter:
+    """
+    List it before the other routers: it only decides replica reads and leaves
+    everything else to them.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return None
+        # The database this model is written to, as decided by the rest of the routers
+        return _replicas().get(router.db_for_write(model, **hints))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        primaries = {alias: alias for alias in _replicas()} | {replica: primary for primary, replica in _replicas().items()}
+        db1, db2 = obj1._state.db, obj2._state.db
+        if db1 in primaries and db2 in primaries and primaries[db1] == primaries[db2]:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        if db in _replicas().values():
+            return False
+        return None
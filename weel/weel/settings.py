@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -38,11 +41,18 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     # Custom apps
+    'weel',
     'cards',
-    'transactions'
+    'transactions',
+    'taskqueue',
+    'organisations',
+    'ledger',
+    'merchants',
 ]
 
 MIDDLEWARE = [
+    'weel.middleware.InstrumentationMiddleware',
+    'organisations.middleware.OrganisationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,13 +86,62 @@ WSGI_APPLICATION = 'weel.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
+# Configured from DATABASE_URL and DATABASE_REPLICA_URL, SQLite by default; see weel.database
+
+DATABASES, DATABASE_REPLICAS = databases(BASE_DIR)
+
+# Tenant data goes to the database named on each Organisation; add an alias here to
+# move a large organisation off the default database. GET list views read from the
+# replica of their database, if DATABASE_REPLICAS names one.
+DATABASE_ROUTERS = ['weel.routers.ReplicaRouter', 'organisations.routers.TenantRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Holds the authorization-time card state (see cards.cache). The local-memory backend
+# evicts least recently used entries beyond MAX_ENTRIES.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'weel',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
     }
 }
 
+CARD_STATE_CACHE = 'default'
+
+# Responses to transaction POSTs with an Idempotency-Key, kept for this many seconds
+# to answer retries from memory (see transactions.idempotency).
+IDEMPOTENCY_CACHE = 'default'
+IDEMPOTENCY_CACHE_TIMEOUT = 600
+
+
+# Transaction archives
+# Whole months of transactions older than TRANSACTION_RETENTION_DAYS are moved to
+# gzipped NDJSON files under TRANSACTION_ARCHIVE_DIR by archive_transactions (see
+# transactions.archive); the history API still reads them.
+
+TRANSACTION_ARCHIVE_DIR = Path(os.environ.get('TRANSACTION_ARCHIVE_DIR', BASE_DIR / 'archive'))
+TRANSACTION_RETENTION_DAYS = 365
+
+
+# Observability
+# Requests slower than this many milliseconds are logged with their SQL to the
+# 'weel.slow_requests' logger. None disables the slow request log.
+
+SLOW_REQUEST_THRESHOLD_MS = None
+
+
+# Background tasks
+# Run task handlers inline in enqueue() instead of queueing them for the
+# run_task_workers processes.
+
+TASK_QUEUE_EAGER = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
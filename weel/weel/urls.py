@@ -18,10 +18,13 @@ from django.contrib import admin
 from django.contrib.auth import views as auth_views
 from django.urls import include, path
 
+from .views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
+    path('metrics', metrics, name='metrics'),
     # Include other paths here
     path('', include('cards.urls')),
     path('', include('transactions.urls')),